@@ -3,6 +3,10 @@
 """buffer模块用于遍历token。"""
 
 import math
+from collections import deque
+
+# 出错时显示的行数；Buffer只保留这么多已处理的行
+HISTORY_LINES = 4
 
 
 class Buffer:
@@ -37,13 +41,28 @@ class Buffer:
     2: 15
     3: 12 ) >>
     >>> buf.remove_front()  # 返回None
+
+    只保留最近的HISTORY_LINES行，读入很多行时占用的内存不会增长，
+    行号仍从第一行开始计算：
+
+    >>> buf = Buffer(iter([[n] for n in range(1, 1001)]))
+    >>> while buf.remove_front() != 1000:
+    ...     pass
+    >>> len(buf.lines)
+    4
+    >>> print(buf)
+    997: 997
+     998: 998
+     999: 999
+    1000: 1000 >>
     """
     def __init__(self, source):
         """
         source是iterator。
         next(source)返回元素为token的list，对应一行文本。"""
         self.index = 0      # 当前行list的当前token的索引
-        self.lines = []     # 已处理的行，包括当前行
+        self.lines = deque(maxlen=HISTORY_LINES)  # 最近处理的行，包括当前行
+        self.line_count = 0                       # 已处理的行数
         self.source = source
         self.current_line = ()
         self.current()
@@ -62,6 +81,7 @@ class Buffer:
             try:
                 self.current_line = next(self.source)
                 self.lines.append(self.current_line)
+                self.line_count += 1
             except StopIteration:
                 self.current_line = ()
                 return None
@@ -73,12 +93,13 @@ class Buffer:
 
     def __str__(self):
         """返回已读的token，并使用>>标记当前token。"""
-        n = len(self.lines)
+        n = self.line_count
         msg = '{0:>' + str(math.floor(math.log10(n))+1) + "}: "
 
         s = ''
-        for i in range(max(0, n-4), n-1):
-            s += msg.format(i+1) + ' '.join(map(str, self.lines[i])) + '\n'
+        first = n - len(self.lines) + 1   # 保留的第一行的行号
+        for i, line in enumerate(list(self.lines)[:-1], first):
+            s += msg.format(i) + ' '.join(map(str, line)) + '\n'
         s += msg.format(n)
         s += ' '.join(map(str, self.current_line[:self.index]))
         s += ' >> '
@@ -36,24 +36,57 @@ class Pair:
     (1 2)
     >>> print(s.map(lambda x: x+4))
     (5 6)
+
+    map、==、len和str都不使用递归，很长的list也可以处理：
+
+    >>> s = nil
+    >>> for i in range(100000):
+    ...     s = Pair(i, s)
+    >>> t = s.map(lambda x: x)
+    >>> len(t), s == t
+    (100000, True)
     """
+    __slots__ = ('first', 'second')
+
     def __init__(self, first, second):
         self.first = first
         self.second = second
 
     def __repr__(self):
-        return 'Pair({0}, {1})'.format(
-            repr(self.first), repr(self.second))
-
-    def __str__(self):
-        s = '(' + str(self.first)
-        second = self.second
+        s, depth, second = [], 0, self
         while isinstance(second, Pair):
-            s += ' ' + str(second.first)
+            s.append('Pair({0}, '.format(repr(second.first)))
+            depth += 1
             second = second.second
-        if second is not nil:
-            s += ' . ' + str(second)
-        return s + ')'
+        s.append(repr(second))
+        s.append(')' * depth)
+        return ''.join(s)
+
+    def __str__(self):
+        # 使用显式的栈代替递归，嵌套很深的list也可以打印。
+        # 栈中的元素为(是否为文本, 文本或待打印的值)
+        s, stack = [], [(False, self)]
+        while stack:
+            is_text, item = stack.pop()
+            if is_text:
+                s.append(item)
+            elif isinstance(item, Pair):
+                items, second = [], item
+                while isinstance(second, Pair):
+                    items.append(second.first)
+                    second = second.second
+                stack.append((True, ')'))
+                if second is not nil:
+                    stack.append((False, second))
+                    stack.append((True, ' . '))
+                for i in range(len(items) - 1, 0, -1):
+                    stack.append((False, items[i]))
+                    stack.append((True, ' '))
+                stack.append((False, items[0]))
+                stack.append((True, '('))
+            else:
+                s.append(str(item))
+        return ''.join(s)
 
     def __len__(self):
         n, second = 1, self.second
@@ -65,17 +98,29 @@ class Pair:
         return n
 
     def __eq__(self, p):
-        if not isinstance(p, Pair):
-            return False
-        return self.first == p.first and self.second == p.second
+        stack = [(self, p)]
+        while stack:
+            x, y = stack.pop()
+            if isinstance(x, Pair):
+                if not isinstance(y, Pair):
+                    return False
+                stack.append((x.second, y.second))
+                stack.append((x.first, y.first))
+            elif isinstance(y, Pair) or not x == y:
+                return False
+        return True
 
     def map(self, fn):
         """list的每个元素应用函数fn，生成新的list。"""
-        mapped = fn(self.first)
-        if self.second is nil or isinstance(self.second, Pair):
-            return Pair(mapped, self.second.map(fn))
-        else:
+        result = last = Pair(fn(self.first), nil)
+        second = self.second
+        while isinstance(second, Pair):
+            last.second = Pair(fn(second.first), nil)
+            last = last.second
+            second = second.second
+        if second is not nil:
             raise TypeError('无效的list：' + str(self))
+        return result
 
 
 def scheme_read(src_buf):
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+"""Scheme解释器的基准测试。
+
+在scheme目录下以模块方式运行，例如：
+    python -m benchmarks.tail_calls
+
+完整的基准测试套件见benchmarks.runner，程序定义在benchmarks.workloads中。
+"""
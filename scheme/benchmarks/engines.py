@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""比较各个求值引擎在调用密集型程序上的速度。
+
+运行方式（在scheme目录下）：
+    python -m benchmarks.engines
+"""
+
+import time
+
+from sugon.edu.scheme import create_global_frame, scheme_eval, read_line
+from sugon.edu.scheme_compile import compile_eval
+from sugon.edu.scheme_vm import vm_eval
+
+ENGINES = [
+    ('eval', scheme_eval),
+    ('compile', compile_eval),
+    ('vm', vm_eval),
+]
+
+PROGRAMS = [
+    ('fib',
+     ['(define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))'],
+     '(fib 22)', 17711),
+    ('tak',
+     ['(define (tak x y z) (if (not (< y x)) z'
+      ' (tak (tak (- x 1) y z) (tak (- y 1) z x) (tak (- z 1) x y))))'],
+     '(tak 18 12 6)', 7),
+]
+
+
+def bench(evaluate, definitions, call, expected):
+    """使用求值函数evaluate运行一个程序，返回所用的秒数。"""
+    env = create_global_frame()
+    for line in definitions:
+        evaluate(read_line(line), env)
+    expr = read_line(call)
+    start = time.perf_counter()
+    result = evaluate(expr, env)
+    elapsed = time.perf_counter() - start
+    assert result == expected, result
+    return elapsed
+
+
+def main():
+    for name, definitions, call, expected in PROGRAMS:
+        base = None
+        for engine, evaluate in ENGINES:
+            elapsed = bench(evaluate, definitions, call, expected)
+            if base is None:
+                base = elapsed
+            print('{0:<6}{1:<10}{2:8.3f}s  {3:5.1f}x'.format(
+                name, engine, elapsed, base / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""比较关联列表（alist）和哈希表的查找速度。
+
+运行方式（在scheme目录下）：
+    python -m benchmarks.hash_tables [键的个数]
+"""
+
+import random
+import sys
+import time
+
+from sugon.edu.scheme import (create_global_frame, scheme_eval, read_line,
+                              Pair, nil, scheme_list)
+from sugon.edu.scheme_primitives import (HashTable, scheme_hash_set,
+                                         structural_key)
+
+DEFINITIONS = [
+    '(define (assoc-ref key alist)'
+    '  (cond ((null? alist) #f)'
+    '        ((equal? key (car (car alist))) (cdr (car alist)))'
+    '        (else (assoc-ref key (cdr alist)))))',
+    '(define (probe-alist keys alist)'
+    '  (if (null? keys) #t'
+    '      (begin (assoc-ref (car keys) alist) (probe-alist (cdr keys) alist))))',
+    '(define (probe-hash keys table)'
+    '  (if (null? keys) #t'
+    '      (begin (hash-ref table (car keys)) (probe-hash (cdr keys) table))))',
+]
+
+
+def timed(env, call):
+    """求值call，返回所用的秒数。"""
+    expr = read_line(call)
+    start = time.perf_counter()
+    scheme_eval(expr, env)
+    return time.perf_counter() - start
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 10**5
+    env = create_global_frame()
+    for line in DEFINITIONS:
+        scheme_eval(read_line(line), env)
+
+    # 键为(i i)形式的list，需要按equal?比较
+    keys = [scheme_list(i, i) for i in range(n)]
+    alist, table = nil, HashTable(structural_key)
+    for i in reversed(range(n)):
+        alist = Pair(Pair(keys[i], i), alist)
+        scheme_hash_set(table, keys[i], i)
+    env.define('alist', alist)
+    env.define('table', table)
+
+    # alist每次查找是O(n)的，只抽取少量的键
+    alist_probes = random.Random(0).sample(keys, 5)
+    env.define('alist-keys', scheme_list(*alist_probes))
+    env.define('all-keys', scheme_list(*keys))
+
+    alist_time = timed(env, '(probe-alist alist-keys alist)') / len(alist_probes)
+    hash_time = timed(env, '(probe-hash all-keys table)') / n
+    print('键的个数: {0}'.format(n))
+    print('alist:      {0:12.1f} 微秒/次'.format(alist_time * 1e6))
+    print('hash-table: {0:12.1f} 微秒/次'.format(hash_time * 1e6))
+    print('加速比:     {0:12.0f}x'.format(alist_time / hash_time))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""内存测试：通过同一个Buffer用scheme_read读入很多行代码，检查内存占用不增长。
+
+代码按需生成，不预先保存在内存中；读入过程中定期记录进程的RSS。
+读入前10%的行之后（词法分析的token缓存已经填满），RSS增长超过限度时
+以状态1退出。
+
+运行方式（在scheme目录下）：
+    python -m benchmarks.memory [行数] [--limit MB]
+"""
+
+import argparse
+import resource
+import sys
+import time
+
+from sugon.edu.scheme_buffer import Buffer
+from sugon.edu.scheme_reader import scheme_read
+from sugon.edu.scheme_tokens import tokenize_lines
+
+
+def rss_megabytes():
+    """返回进程当前的RSS（MB）；无法读取时返回最大RSS。"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def generate_lines(n):
+    """生成至少n行代码，每三行一组，其中有跨行的表达式。"""
+    for i in range(0, n, 3):
+        yield "(define (f-{0} x) (if (< x {0}) 'small".format(i)
+        yield "    (g #(1 2.5 \"s\") '(a . b))))"
+        yield '(f-{0} {0})'.format(i)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Buffer和scheme_read的内存测试')
+    parser.add_argument('lines', type=int, nargs='?', default=10 ** 7)
+    parser.add_argument('--limit', type=float, default=16,
+                        help='允许的RSS增长（MB）')
+    args = parser.parse_args(argv)
+
+    buf = Buffer(tokenize_lines(generate_lines(args.lines)))
+    step = max(args.lines // 10, 1)
+    checkpoint, baseline, peak = step, None, 0
+    start = time.perf_counter()
+    expressions = 0
+    while buf.current() is not None:
+        scheme_read(buf)
+        expressions += 1
+        if buf.line_count >= checkpoint:
+            rss = rss_megabytes()
+            if baseline is None:
+                baseline = rss
+            peak = max(peak, rss)
+            print('{0:>12}行  RSS {1:8.1f} MB'.format(buf.line_count, rss))
+            checkpoint += step
+    elapsed = time.perf_counter() - start
+    print('表达式数: {0}  耗时: {1:.1f}s'.format(expressions, elapsed))
+    growth = peak - baseline if baseline is not None else 0
+    print('RSS增长: {0:.1f} MB（限度{1} MB）'.format(growth, args.limit))
+    return 1 if growth > args.limit else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
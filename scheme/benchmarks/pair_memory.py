@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""测量每个Pair节点占用的内存。
+
+比较使用__dict__保存属性的Pair（原来的实现）和使用__slots__的Pair。
+
+运行方式（在scheme目录下）：
+    python -m benchmarks.pair_memory [元素个数]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from sugon.edu.scheme_reader import Pair, nil
+
+
+class DictPair:
+    """原来的Pair实现：属性保存在每个实例的__dict__中。"""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+
+def bytes_per_cell(pair_class, n):
+    """构造n个元素的list，返回平均每个节点占用的字节数。"""
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    lst = nil
+    for i in range(n):
+        lst = pair_class(None, lst)
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return used / n
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 10**6
+    before = bytes_per_cell(DictPair, n)
+    after = bytes_per_cell(Pair, n)
+    print('元素个数: {0}'.format(n))
+    print('__dict__ Pair: {0:.1f} 字节/节点'.format(before))
+    print('__slots__ Pair: {0:.1f} 字节/节点'.format(after))
+
+    lst = nil
+    for i in range(n):
+        lst = Pair(i, lst)
+    start = time.perf_counter()
+    mapped = lst.map(lambda x: x + 1)
+    same = mapped.map(lambda x: x - 1) == lst
+    print('map/==/len: {0:.2f}s (len={1}, equal={2})'.format(
+        time.perf_counter() - start, len(mapped), same))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
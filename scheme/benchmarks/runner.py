@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""运行基准测试套件，将结果保存为JSON，或者比较两次的结果。
+
+运行方式（在scheme目录下）：
+    python -m benchmarks.runner run -o results.json [--engine vm] [名字 ...]
+    python -m benchmarks.runner compare old.json new.json [--threshold 0.1]
+
+每个程序先运行warmup次（不计入结果），再运行repeat次；每次都在新的
+全局环境中，通过read_eval_print_loop读入并求值。compare发现变慢的
+程序时以状态1退出。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+
+from sugon.edu.scheme import (create_global_frame, read_eval_print_loop,
+                              buffer_lines, scheme_eval)
+from benchmarks.workloads import WORKLOADS
+
+
+def evaluator(engine, optimize=False):
+    """返回名为engine的求值引擎的求值函数。"""
+    if engine == 'compile':
+        from sugon.edu.scheme_compile import compile_eval
+        evaluate = compile_eval
+    elif engine == 'vm':
+        from sugon.edu.scheme_vm import vm_eval
+        evaluate = vm_eval
+    else:
+        evaluate = scheme_eval
+    if optimize:
+        from sugon.edu.scheme_optimize import optimizing_eval
+        evaluate = optimizing_eval(evaluate)
+    return evaluate
+
+
+def run_lines(lines, env, evaluate):
+    """通过read_eval_print_loop求值lines，返回打印的非空行。"""
+    pending = iter(lines)  # 各个Buffer从同一个iterator中读入
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        read_eval_print_loop(lambda: buffer_lines(pending), env,
+                             evaluate=evaluate)
+    printed = [line for line in output.getvalue().splitlines() if line]
+    for line in printed:
+        if line.startswith('Error'):
+            raise AssertionError(line)
+    return printed
+
+
+def run_once(workload, evaluate):
+    """运行一次workload，返回program部分所用的秒数。"""
+    env = create_global_frame()
+    run_lines(workload.setup, env, evaluate)
+    start = time.perf_counter()
+    output = run_lines(workload.program, env, evaluate)
+    elapsed = time.perf_counter() - start
+    if not output or output[-1] != workload.expected:
+        raise AssertionError('{0}: 结果应为{1}，实际输出为{2}'.format(
+            workload.name, workload.expected, ' '.join(output[-3:])))
+    return elapsed
+
+
+def missing_names(workload):
+    """返回workload需要、但全局环境中没有的名字。"""
+    bindings = create_global_frame().bindings
+    return [name for name in workload.requires if name not in bindings]
+
+
+def run_suite(workloads, evaluate, warmup=1, repeat=5, log=sys.stderr):
+    """运行workloads中的程序，返回各程序的结果和跳过的程序。"""
+    results, skipped = {}, {}
+    for workload in workloads:
+        missing = missing_names(workload)
+        if missing:
+            skipped[workload.name] = '缺少' + ', '.join(missing)
+            print('{0:<14}跳过（{1}）'.format(
+                workload.name, skipped[workload.name]), file=log)
+            continue
+        for _ in range(warmup):
+            run_once(workload, evaluate)
+        times = [run_once(workload, evaluate) for _ in range(repeat)]
+        results[workload.name] = {
+            'times': times,
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+        }
+        print('{0:<14}{1:9.4f}s'.format(workload.name, min(times)), file=log)
+    return results, skipped
+
+
+def compare(old, new, threshold):
+    """比较两次的结果（以最短时间为准），返回变慢超过threshold的程序。"""
+    regressions = []
+    print('{0:<14}{1:>10}{2:>10}{3:>9}'.format('程序', '之前(s)', '之后(s)', '比例'))
+    for name, entry in new['benchmarks'].items():
+        if name not in old['benchmarks']:
+            continue
+        before, after = old['benchmarks'][name]['min'], entry['min']
+        ratio = after / before
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  变慢'
+        elif ratio < 1 - threshold:
+            flag = '  变快'
+        print('{0:<14}{1:10.4f}{2:10.4f}{3:8.2f}x{4}'.format(
+            name, before, after, ratio, flag))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Scheme解释器的基准测试')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='运行基准测试')
+    run_parser.add_argument('names', nargs='*', help='只运行这些程序')
+    run_parser.add_argument('--engine', choices=['eval', 'compile', 'vm'],
+                            default='eval')
+    run_parser.add_argument('-O', '--optimize', action='store_true')
+    run_parser.add_argument('--warmup', type=int, default=1)
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('-o', '--output', help='保存结果的JSON文件')
+    compare_parser = commands.add_parser('compare', help='比较两次的结果')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='最短时间增加超过这个比例时视为变慢')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        return 1 if compare(old, new, args.threshold) else 0
+
+    workloads = WORKLOADS
+    if args.names:
+        unknown = set(args.names) - {w.name for w in WORKLOADS}
+        if unknown:
+            parser.error('未知的程序: ' + ', '.join(sorted(unknown)))
+        workloads = [w for w in WORKLOADS if w.name in args.names]
+    evaluate = evaluator(args.engine, args.optimize)
+    results, skipped = run_suite(workloads, evaluate,
+                                 args.warmup, args.repeat)
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'engine': args.engine,
+        'optimize': args.optimize,
+        'warmup': args.warmup,
+        'repeat': args.repeat,
+        'benchmarks': results,
+        'skipped': skipped,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
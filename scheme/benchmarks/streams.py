@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""测量流（stream）处理的内存占用。
+
+对n个生成的整数依次执行stream-map、stream-filter和stream-reduce，
+比较不同n下的内存峰值：峰值不随n增长，说明处理过的元素都被释放了。
+
+运行方式（在scheme目录下）：
+    python -m benchmarks.streams [n ...]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from sugon.edu.scheme import create_global_frame, scheme_eval, read_line
+
+DEFINITIONS = [
+    '(define (integers-from n) (cons-stream n (integers-from (+ n 1))))',
+]
+
+PIPELINE = ('(stream-reduce + 0 (stream-filter even? (stream-map'
+            ' (lambda (x) (* x 3)) (stream-take (integers-from 0) {0}))))')
+
+
+def run(n):
+    """运行流水线，返回(结果, 秒数, 内存峰值字节数)。"""
+    env = create_global_frame()
+    for line in DEFINITIONS:
+        scheme_eval(read_line(line), env)
+    expr = read_line(PIPELINE.format(n))
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = scheme_eval(expr, env)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [10**3, 10**4, 10**5]
+    for n in sizes:
+        result, elapsed, peak = run(n)
+        expected = sum(x * 3 for x in range(n) if x * 3 % 2 == 0)
+        assert result == expected, result
+        print('n={0:<10} {1:8.2f}s  内存峰值 {2:8.1f} KB'.format(
+            n, elapsed, peak / 1024))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
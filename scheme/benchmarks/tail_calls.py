@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+"""尾调用的基准测试：测量尾递归循环的吞吐量。
+
+运行方式（在scheme目录下）：
+    python -m benchmarks.tail_calls [迭代次数]
+"""
+
+import sys
+import time
+
+from sugon.edu.scheme import create_global_frame, scheme_eval, read_line
+
+LOOP = '(define (loop n acc) (if (= n 0) acc (loop (- n 1) (+ acc 1))))'
+
+
+def bench_loop(n):
+    """运行n次迭代的尾递归循环，返回所用的秒数。"""
+    env = create_global_frame()
+    scheme_eval(read_line(LOOP), env)
+    call = read_line('(loop {0} 0)'.format(n))
+    start = time.perf_counter()
+    result = scheme_eval(call, env)
+    elapsed = time.perf_counter() - start
+    assert result == n
+    return elapsed
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 10**6
+    elapsed = bench_loop(n)
+    print('迭代次数: {0}'.format(n))
+    print('耗时: {0:.2f}s'.format(elapsed))
+    print('吞吐量: {0:.0f} 次/秒'.format(n / elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
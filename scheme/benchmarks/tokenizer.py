@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""词法分析的基准测试：对约10MB的Scheme代码调用tokenize_lines。
+
+代码由基准测试套件中的程序和一段类似库文件的代码（注释、字符串、
+quote、vector、#t/#f）重复组成，每次重复时给定义的名字加上不同的编号。
+
+运行方式（在scheme目录下）：
+    python -m benchmarks.tokenizer [MB数]
+"""
+
+import sys
+import time
+
+from sugon.edu.scheme_tokens import tokenize_lines
+from benchmarks.workloads import WORKLOADS
+
+LIBRARY = r'''
+;;; 列表工具 {n}
+;; 返回s中满足pred的元素
+(define (filter-{n} pred s)
+  (cond ((null? s) nil)
+        ((pred (car s)) (cons (car s) (filter-{n} pred (cdr s))))
+        (else (filter-{n} pred (cdr s)))))
+
+(define (fold-{n} f init s)   ; 从左向右
+  (if (null? s) init (fold-{n} f (f init (car s)) (cdr s))))
+
+(define (show-{n} x)
+  (display "value: ") (display x) (newline))
+
+(define table-{n} '((a . 1) (b . 2) (c . 3.5) (d . -4)))
+(define flags-{n} (list #t #f true false))
+(define v-{n} #(1 2 3 "three" [4 5]))
+(define (template-{n} x) `(x ,x ,@(list x {n})))
+(define (assert-{n} ok msg)
+  (if (not ok) (error "assertion failed: " msg) #t))
+'''
+
+
+def corpus(megabytes):
+    """返回约megabytes MB的Scheme代码的各行。"""
+    program = []
+    for workload in WORKLOADS:
+        if workload.name != 'tokenizer':
+            program.extend(workload.setup)
+            program.extend(workload.program)
+    lines, size, n = [], 0, 0
+    while size < megabytes * 1024 * 1024:
+        chunk = LIBRARY.format(n=n).splitlines() + program
+        lines.extend(chunk)
+        size += sum(len(line) + 1 for line in chunk)
+        n += 1
+    return lines
+
+
+def main(argv):
+    megabytes = float(argv[1]) if len(argv) > 1 else 10
+    lines = corpus(megabytes)
+    start = time.perf_counter()
+    tokens = sum(len(tokens) for tokens in tokenize_lines(lines))
+    elapsed = time.perf_counter() - start
+    print('行数: {0}  token数: {1}'.format(len(lines), tokens))
+    print('耗时: {0:.2f}s'.format(elapsed))
+    print('吞吐量: {0:.1f} MB/秒'.format(megabytes / elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
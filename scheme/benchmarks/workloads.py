@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""基准测试套件中的Scheme程序。
+
+每个Workload包括：
+  * setup：准备工作的Scheme代码（定义过程、构造数据），不计时
+  * program：被计时的Scheme代码，最后一个表达式的打印结果应为expected
+  * requires：程序用到的、不一定存在的内置名字；全局环境中缺少其中
+    任何一个时，跳过这个程序
+"""
+
+
+class Workload:
+    def __init__(self, name, setup, program, expected, requires=()):
+        self.name = name
+        self.setup = setup
+        self.program = program
+        self.expected = expected
+        self.requires = requires
+
+
+def tokenizer_source(n):
+    """生成n行只需读入、求值很简单的代码，用于测试词法和语法分析。"""
+    line = "'(define (f x y) (if (< x y) (+ x 1.5 -2) (g #(1 2 3) 'sym)))"
+    return [line] * (n - 1) + ["'done"]
+
+
+WORKLOADS = [
+    Workload(
+        'fib',
+        ['(define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))'],
+        ['(fib 20)'],
+        '6765'),
+    Workload(
+        'tak',
+        ['(define (tak x y z) (if (not (< y x)) z',
+         '  (tak (tak (- x 1) y z) (tak (- y 1) z x) (tak (- z 1) x y))))'],
+        ['(tak 15 10 5)'],
+        '10'),
+    Workload(
+        'ackermann',
+        ['(define (ack m n)',
+         '  (cond ((= m 0) (+ n 1))',
+         '        ((= n 0) (ack (- m 1) 1))',
+         '        (else (ack (- m 1) (ack m (- n 1))))))'],
+        ['(ack 2 60)'],
+        '123'),
+    Workload(
+        'n-queens',
+        ['(define (ok? row dist placed)',
+         '  (or (null? placed)',
+         '      (and (not (= (car placed) (+ row dist)))',
+         '           (not (= (car placed) (- row dist)))',
+         '           (not (= (car placed) row))',
+         '           (ok? row (+ dist 1) (cdr placed)))))',
+         '(define (try row n placed)',
+         '  (cond ((> row n) 0)',
+         '        ((ok? row 1 placed)',
+         '         (+ (queens n (cons row placed)) (try (+ row 1) n placed)))',
+         '        (else (try (+ row 1) n placed))))',
+         '(define (queens n placed)',
+         '  (if (= (length placed) n) 1 (try 1 n placed)))'],
+        ['(queens 7 nil)'],
+        '40'),
+    Workload(
+        'list-sort',
+        ['(define (random-list n seed)',
+         '  (if (= n 0) nil',
+         '      (cons seed (random-list (- n 1) (modulo (+ (* seed 1103) 12345) 65536)))))',
+         '(define (merge a b)',
+         '  (cond ((null? a) b) ((null? b) a)',
+         '        ((< (car a) (car b)) (cons (car a) (merge (cdr a) b)))',
+         '        (else (cons (car b) (merge a (cdr b))))))',
+         '(define (split s)',
+         '  (if (or (null? s) (null? (cdr s))) (cons s nil)',
+         '      (let ((rest (split (cddr s))))',
+         '        (cons (cons (car s) (car rest)) (cons (cadr s) (cdr rest))))))',
+         '(define (cddr s) (cdr (cdr s)))',
+         '(define (cadr s) (car (cdr s)))',
+         '(define (msort s)',
+         '  (if (or (null? s) (null? (cdr s))) s',
+         '      (let ((halves (split s)))',
+         '        (merge (msort (car halves)) (msort (cdr halves))))))',
+         '(define (sorted? s)',
+         '  (or (null? s) (null? (cdr s))',
+         '      (and (<= (car s) (cadr s)) (sorted? (cdr s)))))',
+         '(define data (random-list 100 42))',
+         '(define (sort-times n)',
+         '  (if (= n 1) (sorted? (msort data)) (begin (msort data) (sort-times (- n 1)))))'],
+        ['(sort-times 5)'],
+        'True'),
+    Workload(
+        'string-build',
+        ['(define (build n s)',
+         '  (if (= n 0) s (build (- n 1) (string-append s (number->string n)))))'],
+        ['(string-length (build 2000 ""))'],
+        '6893',
+        requires=('string-append', 'number->string', 'string-length')),
+    Workload(
+        'map-filter',
+        ['(define (range a b acc) (if (>= a b) acc (range a (- b 1) (cons (- b 1) acc))))',
+         '(define data (range 0 300 nil))'],
+        ['(define (chain n acc)',
+         '  (if (= n 0) acc',
+         '      (chain (- n 1)',
+         '             (+ acc (reduce + (map (lambda (x) (* x 3))',
+         '                                  (filter even?',
+         '                                          (map (lambda (x) (+ x 1)) data))))))))',
+         '(chain 30 0)'],
+        '2038500'),
+    Workload(
+        'tokenizer',
+        [],
+        tokenizer_source(3000),
+        'done'),
+]
@@ -2,13 +2,24 @@
 
 """Scheme语言解释器。"""
 
+import functools
+import io
+import math
+import os
+import pickle
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from sugon.edu.scheme_primitives import *
 from sugon.edu.scheme_reader import *
+from sugon.edu.scheme_buffer import stream_lines
 
 
-def scheme_eval(expr, env):
+def scheme_eval(expr, env, tail=False):
     """在环境env中求值scheme表达式expr。
 
+    tail为True表示expr处于尾部位置（见optimize_tail_calls）。
+
     >>> expr = read_line('(+ 2 2)')
     >>> expr
     Pair('+', Pair(2, Pair(2, nil)))
@@ -40,7 +51,21 @@ def scheme_eval(expr, env):
 
 def self_evaluating(expr):
     """表达式expr是否求值为自身"""
-    return scheme_atomp(expr) or scheme_stringp(expr) or expr is None
+    return (scheme_atomp(expr) or scheme_stringp(expr) or
+            scheme_vectorp(expr) or expr is None)
+
+
+def eval_operand(expr, env):
+    """求值过程调用的一个参数expr。
+
+    符号和数字等直接求值，不经过scheme_eval的尾调用循环。"""
+    if type(expr) is Pair:
+        return scheme_eval(expr, env)
+    elif type(expr) is Symbol:
+        return env.lookup(expr)
+    elif self_evaluating(expr):
+        return expr
+    return scheme_eval(expr, env)
 
 
 def scheme_apply(procedure, args, env):
@@ -50,17 +75,19 @@ def scheme_apply(procedure, args, env):
 
 
 def eval_all(expressions, env):
-    """在环境env中求值expressions列表的每一个表达式，并返回最后一个表达式的值。"""
+    """在环境env中求值expressions列表的每一个表达式，并返回最后一个表达式的值。
+
+    最后一个表达式处于尾部位置。"""
     # *** 问题10开始 ***
     '*** 修改下面的代码 ***'
     # return scheme_eval(expressions.first, env)
+    if expressions is nil:
+        return None
     rest = expressions
-    result = None
-    while rest != nil:
-        exp = rest.first
-        result = scheme_eval(exp, env)
+    while rest.second is not nil:
+        scheme_eval(rest.first, env)
         rest = rest.second
-    return result
+    return scheme_eval(rest.first, env, True)
     # *** 问题10结束 ***
 
 
@@ -71,6 +98,7 @@ class Frame:
         """构造一个空的frame，parent指向父frame（可以是None）。"""
         self.bindings = {}
         self.parent = parent
+        self.version = 0  # 每次define加1，用于判断查找结果的缓存是否失效
 
     def __repr__(self):
         if self.parent is None:
@@ -82,7 +110,12 @@ class Frame:
         """在frame中绑定符号symbol和值value。"""
         # *** 问题2开始 ***
         '*** 在这里补充你的代码 ***'
-        self.bindings[symbol] = value
+        # 已经展开的宏调用不会随之改变，所以宏的名字不能重新绑定
+        if type(self.bindings.get(symbol)) is MacroProcedure:
+            raise SchemeError('宏不能重新定义: {0}'.format(symbol))
+        # 绑定的名字总是interned的Symbol，查找时直接按对象命中
+        self.bindings[Symbol(symbol)] = value
+        self.version += 1
         # *** 问题2结束 ***
 
     def lookup(self, symbol):
@@ -110,18 +143,22 @@ class Frame:
         >>> formals, expressions = read_line('(a b c)'), read_line('(1 2 3)')
         >>> env.make_child_frame(formals, expressions)
         <{a: 1, b: 2, c: 3} -> <Global Frame>>
+        >>> env.make_child_frame(read_line('(a . b)'), expressions)
+        Traceback (most recent call last):
+            ...
+        sugon.edu.scheme_primitives.SchemeError: 形式参数不是list: (a . b)
         """
         child = Frame(self)
         # *** 问题8开始 ***
         '*** 在这里补充你的代码 ***'
-        if len(formals) != len(vals):
-            raise SchemeError('形式参数和实际参数值不匹配: \n{1}\n{2}'.format(formals, vals))
-        while formals != nil:
-            name = formals.first
-            val = vals.first
-            child.define(name, val)
-            formals = formals.second
-            vals = vals.second
+        names, rest = formals, vals
+        while isinstance(names, Pair) and rest is not nil:
+            child.bindings[names.first] = rest.first
+            names, rest = names.second, rest.second
+        if names is not nil and not isinstance(names, Pair):
+            raise SchemeError('形式参数不是list: {0}'.format(formals))
+        if names is not nil or rest is not nil:
+            raise SchemeError('形式参数和实际参数值不匹配: \n{0}\n{1}'.format(formals, vals))
         # *** 问题8结束 ***
         return child
 
@@ -140,7 +177,7 @@ class Procedure:
         在环境env中求值参数operands，然后使用求值结果作为参数调用自身过程。"""
         # *** 问题4开始 ***
         '*** 在这里补充你的代码 ***'
-        args = operands.map(lambda exp: scheme_eval(exp, env))
+        args = operands.map(lambda exp: eval_operand(exp, env))
         return self.apply(args, env)
         # *** 问题4结束 ***
 
@@ -158,14 +195,53 @@ class PrimitiveProcedure(Procedure):
         fn: 求值本过程所对应的Python函数
         use_env: 调用fn是否需要传递env参数
         name: 过程的名称
+
+        参数个数的范围min_args、max_args由fn的定义得到，
+        use_env为True时不包括最后的env参数。
         """
         self.name = name
         self.fn = fn
         self.use_env = use_env
+        self.min_args, self.max_args = primitive_arity(fn)
+        # 两个int参数时直接使用的运算符，见INT_BINARY_OPS
+        self.int_op = INT_BINARY_OPS.get(fn)
+        if use_env:
+            self.min_args = max(self.min_args - 1, 0)
+            if self.max_args is not None:
+                self.max_args -= 1
 
     def __str__(self):
         return '#[{0}]'.format(self.name)
 
+    def __reduce__(self):
+        # fn可能是无法序列化的闭包（见number_fn），内置的基本过程按名字序列化
+        builtin = builtin_primitives().get(self.name)
+        if builtin is not None and builtin.fn is self.fn:
+            return builtin_primitive, (self.name,)
+        return PrimitiveProcedure, (self.fn, self.use_env, self.name)
+
+    def eval_call(self, operands, env):
+        """求值参数然后调用自身过程。
+
+        参数直接求值到Python的tuple中，不构造Scheme list。"""
+        if operands is nil:
+            args = ()
+        elif operands.second is nil:
+            args = (eval_operand(operands.first, env),)
+        elif operands.second.second is nil:
+            x = eval_operand(operands.first, env)
+            y = eval_operand(operands.second.first, env)
+            if (self.int_op is not None and
+                    type(x) is int and type(y) is int):
+                return self.int_op(x, y)
+            args = (x, y)
+        else:
+            args = []
+            while operands is not nil:
+                args.append(eval_operand(operands.first, env))
+                operands = operands.second
+        return self.call(args, env)
+
     def apply(self, args, env):
         """在环境env中应用自身过程，参数args是一个Scheme的list。
 
@@ -175,22 +251,45 @@ class PrimitiveProcedure(Procedure):
         >>> plus.apply(twos, env)
         4
         """
-        if not scheme_listp(args):
-            raise SchemeError('参数args不是一个list: {0}'.format(args))
         # Scheme list 转为 Python list
         python_args = []
-        while args is not nil:
+        while isinstance(args, Pair):
             python_args.append(args.first)
             args = args.second
+        if args is not nil:
+            raise SchemeError('参数args不是一个list: {0}'.format(args))
+        return self.call(python_args, env)
+
+    def call(self, python_args, env):
+        """在环境env中应用自身过程，参数python_args是一个Python的list或tuple。
+
+        参数个数不符合时不调用fn，直接报错：
+
+        >>> env = create_global_frame()
+        >>> env.bindings['car'].call([1, 2], env)
+        Traceback (most recent call last):
+            ...
+        sugon.edu.scheme_primitives.SchemeError: 调用car时传递了错误的参数：(1 2)
+        """
         # *** 问题3开始 ***
         '*** 在这里补充你的代码 ***'
-        if self.use_env:
-            python_args.append(env)
+        n = len(python_args)
+        if n < self.min_args or (self.max_args is not None and
+                                 n > self.max_args):
+            raise SchemeError('调用{0}时传递了错误的参数：{1}'.format(
+                self.name, str(scheme_list(*python_args))))
         try:
+            if self.use_env:
+                return self.fn(*python_args, env)
+            elif n == 1:
+                return self.fn(python_args[0])
+            elif n == 2:
+                return self.fn(python_args[0], python_args[1])
             return self.fn(*python_args)
         except TypeError:
+            # fn内部的TypeError也报告为参数错误
             raise SchemeError('调用{0}时传递了错误的参数：{1}'.format(
-                self.name, str(args)))
+                self.name, str(scheme_list(*python_args))))
         # *** 问题3结束 ***
 
 
@@ -217,10 +316,11 @@ class LambdaProcedure(Procedure):
     def make_call_frame(self, args, env):
         """创建一个新的Frame，从而构成新的环境，用于本次函数应用。
 
+        新Frame的parent是定义函数时的环境self.env（词法作用域）。
         同时，在新的环境的Frame中，将函数的形式参数绑定到对应的实际参数上。"""
         # *** 问题9开始 ***
         '*** 在这里补充你的代码 ***'
-        return env.make_child_frame(self.formals, args)
+        return self.env.make_child_frame(self.formals, args)
         # *** 问题9结束 ***
 
     def __str__(self):
@@ -231,6 +331,177 @@ class LambdaProcedure(Procedure):
             repr(self.formals), repr(self.body), repr(self.env))
 
 
+# memoize和define-memo默认的缓存大小
+MEMO_CACHE_SIZE = 1024
+
+
+class MemoProcedure(Procedure):
+    """带有缓存的过程：使用equal?的参数再次调用时，直接返回缓存的结果。
+
+    缓存最多保存size个结果，超出时淘汰最久没有使用的结果（LRU）。
+
+    >>> env = create_global_frame()
+    >>> scheme_eval(read_line('(define-memo (square x) (* x x))'), env)
+    'square'
+    >>> print(scheme_eval(read_line("(list (square 3) (square 3) (square 4))"), env))
+    (9 9 16)
+    >>> print(scheme_eval(read_line('(memo-stats square)'), env))
+    ((hits . 1) (misses . 2) (size . 2) (capacity . 1024))
+    """
+
+    def __init__(self, procedure, size=MEMO_CACHE_SIZE):
+        """
+        procedure: 被缓存的过程
+        size: 最多缓存的结果个数
+        """
+        self.procedure = procedure
+        self.size = size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def apply(self, args, env):
+        """使用参数args应用自身过程，参数相同时使用缓存的结果。"""
+        # args是Scheme list，它的键是所有参数的键组成的tuple
+        key = structural_key(args)
+        cache = self.cache
+        try:
+            value = cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # 参数不可哈希，不使用缓存
+            return complete_apply(self.procedure, args, env)
+        else:
+            self.hits += 1
+            cache.move_to_end(key)
+            return value
+        self.misses += 1
+        value = complete_apply(self.procedure, args, env)
+        cache[key] = value
+        if len(cache) > self.size:
+            cache.popitem(last=False)
+        return value
+
+    def __str__(self):
+        return '#[memo {0}]'.format(self.procedure)
+
+
+# 每个宏最多缓存的展开结果个数，超出时清空缓存
+MACRO_CACHE_SIZE = 1 << 16
+
+
+class MacroProcedure(Procedure):
+    """define-macro定义的宏。
+
+    调用宏时不求值参数，而是用参数表达式应用expander，得到的展开结果
+    代替调用表达式求值。展开结果只取决于参数表达式，按调用处（参数表达式
+    对象）缓存，同一个调用处只展开一次。
+
+    >>> env = create_global_frame()
+    >>> scheme_eval(read_line('(define-macro (unless c e) `(if ,c nil ,e))'), env)
+    'unless'
+    >>> scheme_eval(read_line('(define (f x) (unless (< x 0) (* x 2)))'), env)
+    'f'
+    >>> scheme_eval(read_line('(list (f 1) (f 2) (f -1))'), env)
+    Pair(2, Pair(4, Pair(nil, nil)))
+    >>> len(env.lookup('unless').expansions)
+    1
+    """
+
+    def __init__(self, expander, name):
+        """
+        expander: 展开宏的LambdaProcedure
+        name: 宏的名字
+        """
+        self.expander = expander
+        self.name = name
+        self.expansions = {}  # id(参数表达式) -> (参数表达式, 展开结果)
+
+    def expand(self, operands):
+        """返回参数表达式为operands的宏调用的展开结果。"""
+        entry = self.expansions.get(id(operands))
+        if entry is not None and entry[0] is operands:
+            return entry[1]
+        expansion = complete_apply(self.expander, operands, self.expander.env)
+        if len(self.expansions) >= MACRO_CACHE_SIZE:
+            self.expansions.clear()
+        # 缓存中引用operands，它的id在缓存期间不会被其他对象使用
+        self.expansions[id(operands)] = (operands, expansion)
+        return expansion
+
+    def eval_call(self, operands, env):
+        """展开宏调用，展开结果在环境env中求值，处于尾部位置。"""
+        return Thunk(self.expand(operands), env)
+
+    def apply(self, args, env):
+        raise SchemeError('宏不能作为过程应用: {0}'.format(self.name))
+
+    def __str__(self):
+        return '#[macro {0}]'.format(self.name)
+
+
+def lookup_macro(name, env):
+    """如果name在环境env中绑定到宏，返回这个宏，否则返回None。"""
+    try:
+        value = env.lookup(name)
+    except SchemeError:
+        return None
+    return value if isinstance(value, MacroProcedure) else None
+
+
+class Promise:
+    """delay和cons-stream创建的promise。
+
+    第一次force时在环境env中求值表达式expr，保存结果，之后直接返回保存的值。
+    计算完成后不再引用expr和env。promise中只有表达式和环境，
+    可以序列化（见pmap）。
+
+    >>> env = create_global_frame()
+    >>> p = scheme_eval(read_line('(delay (begin (print "once") 42))'), env)
+    >>> p.force()
+    "once"
+    42
+    >>> p.force()
+    42
+    >>> s = scheme_eval(read_line('(cons-stream 1 (+ 1 1))'), env)
+    >>> pickle.loads(pickle.dumps(s)).second.force()
+    2
+    """
+    __slots__ = ('expr', 'env', 'value')
+
+    def __init__(self, expr, env):
+        self.expr = expr
+        self.env = env   # 为None表示已经计算
+        self.value = None
+
+    def compute(self):
+        return scheme_eval(self.expr, self.env)
+
+    def force(self):
+        if self.env is not None:
+            value = self.compute()
+            # 计算中可能已经force了这个promise，以第一次的结果为准
+            if self.env is not None:
+                self.value, self.expr, self.env = value, None, None
+        return self.value
+
+    def __str__(self):
+        if self.env is None:
+            return '#[promise (forced)]'
+        return '#[promise]'
+
+
+class CallPromise(Promise):
+    """流的基本过程创建的promise：force时调用Python函数expr(*env)。
+
+    expr是模块中的函数（不是lambda），env是参数的tuple，所以也可以序列化。"""
+    __slots__ = ()
+
+    def compute(self):
+        return self.expr(*self.env)
+
+
 def add_primitives(frame, funcs_and_names):
     for name, fn, proc_name in funcs_and_names:
         frame.define(name, PrimitiveProcedure(fn, name=proc_name))
@@ -257,6 +528,10 @@ def do_define_form(expressions, env):
     elif isinstance(target, Pair) and scheme_symbolp(target.first):
         # *** 问题开始 ***
         '*** 在这里补充你的代码 ***'
+        name, formals = target.first, target.second
+        value = do_lambda_form(Pair(formals, expressions.second), env)
+        env.define(name, value)
+        return name
         # *** 问题结束 ***
     else:
         if isinstance(target, Pair):
@@ -281,6 +556,133 @@ def do_begin_form(expressions, env):
     return eval_all(expressions, env)
 
 
+def memo_definition(expressions):
+    """检查define-memo或define-macro形式，返回(名字, lambda形式去掉lambda之后的部分)。"""
+    check_form(expressions, 2)
+    target = expressions.first
+    if not isinstance(target, Pair) or not scheme_symbolp(target.first):
+        if isinstance(target, Pair):
+            bad_target = target.first
+        else:
+            bad_target = target
+        raise SchemeError('不是符号（symbol）: {0}'.format(bad_target))
+    return target.first, Pair(target.second, expressions.second)
+
+
+def do_define_memo_form(expressions, env):
+    """求值define-memo特殊形式：(define-memo (函数名 形式参数...) 函数体...)。
+
+    与define定义函数相同，但是函数带有缓存（见MemoProcedure），
+    函数体中的递归调用也会使用缓存。"""
+    name, lambda_form = memo_definition(expressions)
+    env.define(name, MemoProcedure(do_lambda_form(lambda_form, env)))
+    return name
+
+
+def do_define_macro_form(expressions, env):
+    """求值define-macro特殊形式：(define-macro (宏名 形式参数...) 函数体...)。
+
+    宏是非卫生的：形式参数绑定到未求值的参数表达式，函数体返回的表达式
+    （通常用quasiquote构造）在调用处的环境中求值（见MacroProcedure）。
+
+    compile和vm引擎在分析表达式时展开宏调用，所以宏要在使用它的表达式
+    被分析之前定义。已经展开的宏调用不会再改变，为了让所有引擎的结果
+    相同，宏只能在全局环境中定义，名字不能已经绑定，定义之后也不能再用
+    define或define-macro重新绑定（见Frame.define）：
+
+    >>> env = create_global_frame()
+    >>> scheme_eval(read_line('(define-macro (m x) `(+ ,x 2))'), env)
+    'm'
+    >>> scheme_eval(read_line('(define-macro (m x) `(+ ,x 200))'), env)
+    Traceback (most recent call last):
+        ...
+    sugon.edu.scheme_primitives.SchemeError: 名字已经绑定，不能定义为宏: m
+    >>> scheme_eval(read_line('(define m 1)'), env)
+    Traceback (most recent call last):
+        ...
+    sugon.edu.scheme_primitives.SchemeError: 宏不能重新定义: m
+    >>> scheme_eval(read_line('(define (f x) (define-macro (n y) y) (n x))'), env)
+    'f'
+    >>> scheme_eval(read_line('(f 1)'), env)
+    Traceback (most recent call last):
+        ...
+    sugon.edu.scheme_primitives.SchemeError: define-macro只能在全局环境中使用: n
+
+    宏的形式参数必须是list，定义时检查：
+
+    >>> scheme_eval(read_line('(define-macro (my-list . xs) `(list ,@xs))'), env)
+    Traceback (most recent call last):
+        ...
+    sugon.edu.scheme_primitives.SchemeError: 形式参数不是list: xs
+    """
+    name, lambda_form = memo_definition(expressions)
+    if not isinstance(env, Frame) or env.parent is not None:
+        raise SchemeError('define-macro只能在全局环境中使用: {0}'.format(name))
+    if name in env.bindings:
+        raise SchemeError('名字已经绑定，不能定义为宏: {0}'.format(name))
+    env.define(name, MacroProcedure(do_lambda_form(lambda_form, env), name))
+    return name
+
+
+def do_quasiquote_form(expressions, env):
+    """求值quasiquote特殊形式。
+
+    >>> env = create_global_frame()
+    >>> print(scheme_eval(read_line("`(1 ,(+ 1 1) ,@(list 3 4) #(5 ,(- 7 1)) . ,(* 7 1))"), env))
+    (1 2 3 4 #(5 6) . 7)
+    >>> print(scheme_eval(read_line("`(1 `(2 ,(3 ,(+ 2 2))))"), env))
+    (1 (quasiquote (2 (unquote (3 4)))))
+    """
+    check_form(expressions, 1, 1)
+    return quasiquote(expressions.first, env, 1)
+
+
+def quasiquote(template, env, depth):
+    """返回quasiquote的模板template的值，depth是quasiquote嵌套的层数。"""
+    if isinstance(template, Vector):
+        items = []
+        value = quasiquote(make_list(template.items), env, depth)
+        while value is not nil:
+            items.append(value.first)
+            value = value.second
+        return Vector(items)
+    elif not isinstance(template, Pair):
+        return template
+    first = template.first
+    if first == 'unquote':
+        check_form(template.second, 1, 1)
+        if depth == 1:
+            return scheme_eval(template.second.first, env)
+        return scheme_list(first, quasiquote(template.second.first, env, depth - 1))
+    elif first == 'quasiquote':
+        check_form(template.second, 1, 1)
+        return scheme_list(first, quasiquote(template.second.first, env, depth + 1))
+    elif first == 'unquote-splicing' and depth == 1:
+        raise SchemeError('unquote-splicing不在list中: {0}'.format(template))
+    items, rest = [], template
+    while isinstance(rest, Pair):
+        if rest is not template and rest.first == 'unquote':
+            # (a . ,b)读入为(a unquote b)
+            break
+        item = rest.first
+        if isinstance(item, Pair) and item.first == 'unquote-splicing':
+            check_form(item.second, 1, 1)
+            if depth == 1:
+                value = scheme_eval(item.second.first, env)
+                if not scheme_listp(value):
+                    raise SchemeError('unquote-splicing的值不是list: {0}'.format(value))
+                while value is not nil:
+                    items.append(value.first)
+                    value = value.second
+            else:
+                items.append(scheme_list(item.first, quasiquote(
+                    item.second.first, env, depth - 1)))
+        else:
+            items.append(quasiquote(item, env, depth))
+        rest = rest.second
+    return make_list(items, quasiquote(rest, env, depth))
+
+
 def do_lambda_form(expressions, env):
     """求值lambda特殊形式。"""
     check_form(expressions, 2)
@@ -297,15 +699,23 @@ def do_if_form(expressions, env):
     """求值if特殊形式。"""
     check_form(expressions, 2, 3)
     if scheme_truep(scheme_eval(expressions.first, env)):
-        return scheme_eval(expressions.second.first, env)
+        return scheme_eval(expressions.second.first, env, True)
     elif len(expressions) == 3:
-        return scheme_eval(expressions.second.second.first, env)
+        return scheme_eval(expressions.second.second.first, env, True)
 
 
 def do_and_form(expressions, env):
     """求值and特殊形式。"""
     # *** 问题开始 ***
     '*** 在这里补充你的代码 ***'
+    if expressions is nil:
+        return True
+    while expressions.second is not nil:
+        value = scheme_eval(expressions.first, env)
+        if scheme_falsep(value):
+            return value
+        expressions = expressions.second
+    return scheme_eval(expressions.first, env, True)
     # *** 问题结束 ***
 
 
@@ -313,6 +723,14 @@ def do_or_form(expressions, env):
     """求值or特殊形式。"""
     # *** 问题开始 ***
     '*** 在这里补充你的代码 ***'
+    if expressions is nil:
+        return False
+    while expressions.second is not nil:
+        value = scheme_eval(expressions.first, env)
+        if scheme_truep(value):
+            return value
+        expressions = expressions.second
+    return scheme_eval(expressions.first, env, True)
     # *** 问题结束 ***
 
 
@@ -330,6 +748,9 @@ def do_cond_form(expressions, env):
         if scheme_truep(test):
             # *** 问题开始 ***
             '*** 在这里补充你的代码 ***'
+            if clause.second is nil:
+                return test
+            return eval_all(clause.second, env)
             # *** 问题结束 ***
         expressions = expressions.second
 
@@ -346,19 +767,92 @@ def make_let_frame(bindings, env):
         raise SchemeError('bad bindings list in let form')
     # *** 问题开始 ***
     '*** 在这里补充你的代码 ***'
+    formals, vals = nil, nil
+    while bindings is not nil:
+        binding = bindings.first
+        check_form(binding, 2, 2)
+        formals = Pair(binding.first, formals)
+        vals = Pair(scheme_eval(binding.second.first, env), vals)
+        bindings = bindings.second
+    check_formals(formals)
+    return env.make_child_frame(formals, vals)
     # *** 问题结束 ***
 
 
+def make_promise(expr, env):
+    """返回一个promise，force时在环境env中求值expr。"""
+    return Promise(expr, env)
+
+
+def do_delay_form(expressions, env):
+    """求值delay特殊形式，返回promise。"""
+    check_form(expressions, 1, 1)
+    return make_promise(expressions.first, env)
+
+
+def do_cons_stream_form(expressions, env):
+    """求值cons-stream特殊形式：立即求值第一个表达式，第二个表达式延迟求值。"""
+    check_form(expressions, 2, 2)
+    first = scheme_eval(expressions.first, env)
+    return Pair(first, make_promise(expressions.second.first, env))
+
+
+def do_stream_reduce_form(expressions, env):
+    """求值stream-reduce特殊形式：(stream-reduce 过程 初始值 流)。
+
+    写成特殊形式而不是基本过程，是因为基本过程的参数在调用期间
+    一直被Python的调用栈引用，流的开头无法释放；这里只保存流的当前位置，
+    归约很长的流只占用常数大小的内存。"""
+    check_form(expressions, 3, 3)
+    fn = scheme_eval(expressions.first, env)
+    check_type(fn, scheme_procedurep, 0, 'stream-reduce')
+    value = scheme_eval(expressions.second.first, env)
+    stream = scheme_eval(expressions.second.second.first, env)
+    while stream is not nil:
+        check_type(stream, scheme_pairp, 2, 'stream-reduce')
+        value = complete_apply(fn, scheme_list(value, stream.first), env)
+        stream = scheme_force(stream.second)
+    return value
+
+
+# 优化器生成的特殊形式的名字；读入的符号都是小写，用户代码无法写出这个符号
+FOLDED = Symbol('#folded')
+
+
+def do_folded_form(expressions, env):
+    """求值(#folded 条件 折叠后的表达式 原来的表达式)，这是优化器为函数体中
+    折叠的表达式生成的特殊形式（见scheme_optimize.FoldGuard）。
+
+    条件仍然成立时求值折叠后的表达式，否则求值原来的表达式，都处于尾部位置。
+    折叠后的表达式通常是常量，直接返回，不经过scheme_eval。"""
+    if expressions.first.valid():
+        expr = expressions.second.first
+    else:
+        expr = expressions.second.second.first
+    if isinstance(expr, Pair):
+        return Thunk(expr, env)
+    elif scheme_symbolp(expr):
+        return env.lookup(expr)
+    return expr
+
+
 SPECIAL_FORMS = {
+    FOLDED: do_folded_form,
     'and': do_and_form,
     'begin': do_begin_form,
     'cond': do_cond_form,
+    'cons-stream': do_cons_stream_form,
     'define': do_define_form,
+    'define-macro': do_define_macro_form,
+    'define-memo': do_define_memo_form,
+    'delay': do_delay_form,
     'if': do_if_form,
     'lambda': do_lambda_form,
     'let': do_let_form,
     'or': do_or_form,
-    'quote': do_quote_form
+    'quasiquote': do_quasiquote_form,
+    'quote': do_quote_form,
+    'stream-reduce': do_stream_reduce_form,
 }
 
 
@@ -381,7 +875,12 @@ def check_formals(formals):
 
     一个有效的形式参数列表，是一个元素为符号（symbol）类型的Scheme列表。
     其中，每一个符号都是不相同的。
-    如果没有通过检查，抛出SchemeError。
+    如果没有通过检查，抛出SchemeError。不支持(a . rest)形式的可变参数：
+
+    >>> check_formals(read_line('(a . rest)'))
+    Traceback (most recent call last):
+        ...
+    sugon.edu.scheme_primitives.SchemeError: 形式参数不是list: (a . rest)
     """
     symbols = set()
     def check_and_add(symbol):
@@ -391,9 +890,12 @@ def check_formals(formals):
             raise SchemeError('重复的符号（symbol）: {0}'.format(symbol))
         symbols.add(symbol)
 
-    while isinstance(formals, Pair):
-        check_and_add(formals.first)
-        formals = formals.second
+    rest = formals
+    while isinstance(rest, Pair):
+        check_and_add(rest.first)
+        rest = rest.second
+    if rest is not nil:
+        raise SchemeError('形式参数不是list: {0}'.format(formals))
 
 
 def check_procedure(procedure):
@@ -403,10 +905,208 @@ def check_procedure(procedure):
             type(procedure).__name__.lower(), str(procedure)))
 
 
+# 尾调用优化
+class Thunk:
+    """尚未求值的尾部表达式expr及其求值环境env。"""
+
+    def __init__(self, expr, env):
+        self.expr = expr
+        self.env = env
+
+
+def complete_apply(procedure, args, env):
+    """应用procedure过程，并确保返回的是值而不是Thunk。"""
+    if hooks.active:
+        return traced_apply(procedure, args, env)
+    val = scheme_apply(procedure, args, env)
+    if isinstance(val, Thunk):
+        return scheme_eval(val.expr, val.env)
+    return val
+
+
+def optimize_tail_calls(original_scheme_eval):
+    """返回支持尾调用优化的scheme_eval。
+
+    处于尾部位置的表达式不会立即求值，而是返回一个Thunk，
+    由外层的循环继续求值。这样尾递归只占用常数大小的Python栈。
+
+    >>> env = create_global_frame()
+    >>> scheme_eval(read_line('(define (count n) (if (= n 0) 0 (count (- n 1))))'), env)
+    'count'
+    >>> scheme_eval(read_line('(count 5000)'), env)
+    0
+    """
+    @functools.wraps(original_scheme_eval)
+    def optimized_eval(expr, env, tail=False):
+        if tail and not scheme_symbolp(expr) and not self_evaluating(expr):
+            return Thunk(expr, env)
+        if hooks.active:
+            return run_traced(Thunk(expr, env), {})
+        result = Thunk(expr, env)
+        while isinstance(result, Thunk):
+            result = original_scheme_eval(result.expr, result.env)
+        return result
+    return optimized_eval
+
+
+scheme_eval = optimize_tail_calls(scheme_eval)
+
+
+class EventHooks:
+    """求值器事件的订阅接口。
+
+    事件及订阅函数的参数：
+      * 'enter'：应用过程之前，fn(过程, 参数list, 调用处的环境)
+      * 'exit'：过程返回之后，fn(过程, 返回值)
+      * 'form'：求值特殊形式之前，fn(特殊形式的名字, 去掉名字的表达式, 环境)
+      * 'error'：求值出错时，fn(错误, 出错处的环境)，每个错误只通知一次
+
+    尾调用时，被替换的过程与替换它的过程一起返回，返回值相同；同一个
+    过程在这一串尾调用中的多次调用，按它第一次被替换的顺序连续返回。
+    没有订阅者时，scheme_eval只多检查一次active属性。
+    只有scheme_eval（eval引擎）产生事件。
+
+    >>> env = create_global_frame()
+    >>> calls = []
+    >>> handle = hooks.subscribe('enter', lambda proc, args, env: calls.append(str(proc)))
+    >>> scheme_eval(read_line('(+ 1 (* 2 3))'), env)
+    7
+    >>> calls
+    ['#[*]', '#[+]']
+    >>> hooks.unsubscribe(handle)
+    >>> hooks.active
+    False
+    """
+
+    EVENTS = ('enter', 'exit', 'form', 'error')
+
+    def __init__(self):
+        self.active = False
+        self.subscribers = {event: [] for event in self.EVENTS}
+
+    def subscribe(self, event, fn, every=1):
+        """订阅事件event，每发生every次调用一次fn，返回用于取消订阅的对象。
+
+        >>> hooks.subscribe('enter', print, every=0)
+        Traceback (most recent call last):
+            ...
+        ValueError: every必须是正整数: 0
+        """
+        if event not in self.subscribers:
+            raise ValueError('未知的事件: {0}'.format(event))
+        if not isinstance(every, int) or every < 1:
+            raise ValueError('every必须是正整数: {0}'.format(every))
+        subscriber = [fn, every, 0]
+        self.subscribers[event].append(subscriber)
+        self.active = True
+        return event, subscriber
+
+    def unsubscribe(self, handle):
+        event, subscriber = handle
+        self.subscribers[event].remove(subscriber)
+        self.active = any(self.subscribers.values())
+
+    def emit(self, event, *args):
+        for subscriber in self.subscribers[event]:
+            subscriber[2] += 1
+            if subscriber[2] == subscriber[1]:
+                subscriber[2] = 0
+                subscriber[0](*args)
+
+
+hooks = EventHooks()
+
+
+def run_traced(result, entered):
+    """同optimize_tail_calls中的循环，并产生事件。
+
+    entered记录在这个循环中进入、尚未返回的过程：id(过程) -> [过程, 次数]。
+    互相替换的尾调用只增加计数，所以长的尾递归循环只占用常数空间。
+
+    >>> env = create_global_frame()
+    >>> exits = []
+    >>> handle = hooks.subscribe('exit', lambda proc, value: exits.append(value))
+    >>> scheme_eval(read_line("(define (loop n) (if (= n 0) 'done (loop (- n 1))))"), env)
+    'loop'
+    >>> entered = {}
+    >>> run_traced(Thunk(read_line('(loop 1000)'), env), entered)
+    'done'
+    >>> [count for procedure, count in entered.values()]
+    [1001]
+    >>> exits.count('done')
+    1001
+    >>> hooks.unsubscribe(handle)
+    """
+    try:
+        while isinstance(result, Thunk):
+            thunk = result
+            result = traced_step(thunk.expr, thunk.env, entered)
+    except Exception as err:
+        report_error(err, thunk.env)
+        raise
+    for procedure, count in reversed(list(entered.values())):
+        for _ in range(count):
+            hooks.emit('exit', procedure, result)
+    return result
+
+
+def report_error(err, env):
+    """产生error事件；已经在更内层报告过的错误不再报告。"""
+    if not getattr(err, 'hook_reported', False):
+        err.hook_reported = True
+        hooks.emit('error', err, env)
+
+
+def traced_step(expr, env, entered):
+    """同scheme_eval的一步求值，并产生事件。"""
+    if scheme_symbolp(expr):
+        return env.lookup(expr)
+    elif self_evaluating(expr):
+        return expr
+    if not scheme_listp(expr):
+        raise SchemeError('无效的复合表达式: {0}'.format(str(expr)))
+    first, rest = expr.first, expr.second
+    if not scheme_symbolp(first):
+        raise SchemeError('无效的复合表达式: {0}'.format(str(expr)))
+    if first in SPECIAL_FORMS:
+        hooks.emit('form', first, rest, env)
+        return SPECIAL_FORMS[first](rest, env)
+    procedure = scheme_eval(first, env)
+    check_procedure(procedure)
+    if isinstance(procedure, MacroProcedure):
+        return procedure.eval_call(rest, env)
+    args = rest.map(lambda operand: eval_operand(operand, env))
+    hooks.emit('enter', procedure, args, env)
+    result = procedure.apply(args, env)
+    if isinstance(result, Thunk):
+        entry = entered.get(id(procedure))
+        if entry is None:
+            entered[id(procedure)] = [procedure, 1]
+        else:
+            entry[1] += 1
+    else:
+        hooks.emit('exit', procedure, result)
+    return result
+
+
+def traced_apply(procedure, args, env):
+    """同complete_apply，并产生事件。"""
+    hooks.emit('enter', procedure, args, env)
+    try:
+        result = scheme_apply(procedure, args, env)
+    except Exception as err:
+        report_error(err, env)
+        raise
+    if isinstance(result, Thunk):
+        return run_traced(result, {id(procedure): [procedure, 1]})
+    hooks.emit('exit', procedure, result)
+    return result
+
+
 def scheme_map(fn, lst, env):
     check_type(fn, scheme_procedurep, 0, 'map')
     check_type(lst, scheme_listp, 1, 'map')
-    return lst.map(lambda x: fn.apply(Pair(x, nil), env))
+    return lst.map(lambda x: complete_apply(fn, Pair(x, nil), env))
 
 
 def scheme_filter(fn, lst, env):
@@ -415,7 +1115,7 @@ def scheme_filter(fn, lst, env):
     head, current = nil, nil
     while lst is not nil:
         item, lst = lst.first, lst.second
-        if fn.apply(Pair(item, nil), env):
+        if complete_apply(fn, Pair(item, nil), env):
             if head is nil:
                 head = Pair(item, nil)
                 current = head
@@ -431,20 +1131,273 @@ def scheme_reduce(fn, lst, env):
     check_type(lst, scheme_listp, 1, 'reduce')
     value, lst = lst.first, lst.second
     while lst is not nil:
-        value = fn.apply(scheme_list(value, lst.first), env)
+        value = complete_apply(fn, scheme_list(value, lst.first), env)
         lst = lst.second
     return value
 
 
+def scheme_force(value):
+    """force基本过程：返回promise的值；参数不是promise时返回参数本身。"""
+    if isinstance(value, Promise):
+        return value.force()
+    return value
+
+
+def scheme_promisep(value):
+    return isinstance(value, Promise)
+
+
+# 流（stream）是第二个元素为promise的Pair，或者nil。
+# 下面的函数也接受普通的list。
+
+def scheme_stream_car(stream):
+    check_type(stream, scheme_pairp, 0, 'stream-car')
+    return stream.first
+
+
+def scheme_stream_cdr(stream):
+    check_type(stream, scheme_pairp, 0, 'stream-cdr')
+    return scheme_force(stream.second)
+
+
+def scheme_stream_map(fn, stream, env):
+    """返回对流stream的每个元素应用fn得到的流，只在需要时计算。"""
+    check_type(fn, scheme_procedurep, 0, 'stream-map')
+    if stream is nil:
+        return nil
+    check_type(stream, scheme_pairp, 1, 'stream-map')
+    return Pair(complete_apply(fn, Pair(stream.first, nil), env),
+                CallPromise(stream_map_rest, (fn, stream.second, env)))
+
+
+def stream_map_rest(fn, rest, env):
+    return scheme_stream_map(fn, scheme_force(rest), env)
+
+
+def scheme_stream_filter(fn, stream, env):
+    """返回流stream中使fn为真的元素构成的流，只在需要时计算。"""
+    check_type(fn, scheme_procedurep, 0, 'stream-filter')
+    while stream is not nil:
+        check_type(stream, scheme_pairp, 1, 'stream-filter')
+        if scheme_truep(complete_apply(fn, Pair(stream.first, nil), env)):
+            return Pair(stream.first, CallPromise(
+                stream_filter_rest, (fn, stream.second, env)))
+        stream = scheme_force(stream.second)
+    return nil
+
+
+def stream_filter_rest(fn, rest, env):
+    return scheme_stream_filter(fn, scheme_force(rest), env)
+
+
+def scheme_stream_take(stream, n):
+    """返回流stream的前n个元素构成的流。"""
+    check_type(n, lambda x: type(x) is int and x >= 0, 1, 'stream-take')
+    if stream is nil or n == 0:
+        return nil
+    check_type(stream, scheme_pairp, 0, 'stream-take')
+    if n == 1:
+        return Pair(stream.first, CallPromise(scheme_stream_take, (nil, 0)))
+    return Pair(stream.first, CallPromise(
+        stream_take_rest, (stream.second, n - 1)))
+
+
+def stream_take_rest(rest, n):
+    return scheme_stream_take(scheme_force(rest), n)
+
+
+def scheme_stream_to_list(stream):
+    """计算流stream的所有元素，返回list。"""
+    items = []
+    while stream is not nil:
+        check_type(stream, scheme_pairp, 0, 'stream->list')
+        items.append(stream.first)
+        stream = scheme_force(stream.second)
+    return make_list(items)
+
+
+def scheme_pmap(fn, lst, workers=None, chunksize=None):
+    """在多个进程中对lst的每个元素应用fn，按原来的顺序返回结果。
+
+    fn及其局部环境会被序列化，发送给工作进程；全局环境中只发送fn可能
+    用到的绑定（见pmap_dumps）。
+    workers: 进程个数，默认为CPU个数；chunksize: 每次发送的元素个数。
+
+    >>> env = create_global_frame()
+    >>> print(scheme_eval(read_line("(pmap (lambda (x) (* x x)) '(1 2 3) 2)"), env))
+    (1 4 9)
+    >>> scheme_pmap(PrimitiveProcedure(lambda x: x, name='id'), scheme_list(1))  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    sugon.edu.scheme_primitives.SchemeError: pmap: 无法将过程#[id]发送到其他进程：...
+
+    全局环境中无法序列化的值只影响用到它的过程：
+
+    >>> env.define('id', PrimitiveProcedure(lambda x: x, name='id'))
+    >>> print(scheme_eval(read_line("(pmap (lambda (x) (+ x 1)) '(1 2) 2)"), env))
+    (2 3)
+    >>> scheme_eval(read_line("(pmap (lambda (x) (id x)) '(1 2) 2)"), env)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    sugon.edu.scheme_primitives.SchemeError: pmap: 无法将过程(lambda (x) (id x))用到的全局变量id发送到其他进程：...
+    """
+    check_type(fn, scheme_procedurep, 0, 'pmap')
+    check_type(lst, scheme_listp, 1, 'pmap')
+    positive = lambda x: x is None or (type(x) is int and x > 0)
+    check_type(workers, positive, 2, 'pmap')
+    check_type(chunksize, positive, 3, 'pmap')
+    items = []
+    while lst is not nil:
+        items.append(lst.first)
+        lst = lst.second
+    if not items:
+        return nil
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = math.ceil(len(items) / (workers * 4))
+    chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+    payload, chunks = pmap_dumps(fn, chunks)
+    results = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        for chunk_results in pool.map(pmap_chunk, [payload] * len(chunks),
+                                      chunks):
+            results.extend(chunk_results)
+    return make_list(results)
+
+
+# 序列化时可能出现的错误
+PICKLE_ERRORS = (pickle.PicklingError, TypeError, AttributeError)
+
+
+class PmapPickler(pickle.Pickler):
+    """pmap使用的Pickler：全局环境中只序列化names中的名字的绑定。
+
+    同时记录序列化时遇到的符号和全局环境。"""
+
+    def __init__(self, file, names):
+        pickle.Pickler.__init__(self, file)
+        self.names = names
+        self.symbols = set()
+        self.global_frames = {}  # id -> 全局Frame
+
+    def reducer_override(self, obj):
+        if type(obj) is Symbol:
+            self.symbols.add(obj)
+        elif type(obj) is Frame and obj.parent is None:
+            self.global_frames[id(obj)] = obj
+            bindings = {name: obj.bindings[name] for name in self.names
+                        if name in obj.bindings}
+            return Frame, (None,), bindings, None, None, restore_global_frame
+        return NotImplemented
+
+
+def restore_global_frame(frame, bindings):
+    """在工作进程中恢复全局环境：内置的绑定加上发送过来的绑定。"""
+    frame.bindings = create_global_frame().bindings
+    frame.bindings.update(bindings)
+
+
+def pmap_dumps(fn, chunks):
+    """序列化pmap的过程fn和参数chunks，返回(fn的数据, 各组参数的数据)。
+
+    全局环境中的绑定不一定都能序列化（例如包含Python函数的值），也不一定
+    会用到，所以只发送可能用到的名字：已发送的值中出现的符号如果在全局
+    环境中有绑定，就把它加入发送的名字，重复直到不再增加。
+
+    无法序列化时抛出SchemeError，并尽量指出是哪个全局变量。"""
+    names, procedure = set(), '过程{0}'.format(fn)
+    while True:
+        symbols, frames = set(), {}
+        payload = pmap_pickle(fn, names, symbols, frames, procedure)
+        data = [pmap_pickle(chunk, names, symbols, frames, '参数')
+                for chunk in chunks]
+        used = {symbol for symbol in symbols for frame in frames.values()
+                if symbol in frame.bindings}
+        if used <= names:
+            return payload, data
+        names = names | used
+
+
+def pmap_pickle(value, names, symbols, frames, what):
+    """使用PmapPickler序列化value，遇到的符号和全局环境加入symbols和frames。
+
+    what是value的说明，用于错误信息。"""
+    out = io.BytesIO()
+    pickler = PmapPickler(out, names)
+    try:
+        pickler.dump(value)
+    except PICKLE_ERRORS as err:
+        raise SchemeError(pmap_error(what, err, names, pickler.global_frames))
+    symbols |= pickler.symbols
+    frames.update(pickler.global_frames)
+    return out.getvalue()
+
+
+class IsolatedPickler(pickle.Pickler):
+    """不序列化全局环境的Pickler，用于找出无法序列化的全局变量。"""
+
+    def persistent_id(self, obj):
+        if type(obj) is Frame and obj.parent is None:
+            return 'global'
+        return None
+
+
+def pmap_error(what, err, names, frames):
+    """返回无法序列化what时的错误信息；names中无法序列化的全局变量（在
+    全局环境frames中）被认为是原因。"""
+    for frame in frames.values():
+        for name in sorted(names):
+            if name not in frame.bindings:
+                continue
+            try:
+                IsolatedPickler(io.BytesIO()).dump(frame.bindings[name])
+            except PICKLE_ERRORS as binding_err:
+                return 'pmap: 无法将{0}用到的全局变量{1}发送到其他进程：{2}'.format(
+                    what, name, binding_err)
+    return 'pmap: 无法将{0}发送到其他进程：{1}'.format(what, err)
+
+
+def pmap_chunk(payload, chunk):
+    """在工作进程中对一组元素应用序列化的过程，返回结果的Python list。"""
+    fn, items = pickle.loads(payload), pickle.loads(chunk)
+    env = create_global_frame()
+    return [complete_apply(fn, Pair(item, nil), env) for item in items]
+
+
+def scheme_memoize(procedure, size=MEMO_CACHE_SIZE):
+    check_type(procedure, scheme_procedurep, 0, 'memoize')
+    check_type(size, lambda x: type(x) is int and x >= 0, 1, 'memoize')
+    return MemoProcedure(procedure, size)
+
+
+def scheme_memo_stats(procedure):
+    check_type(procedure, lambda x: isinstance(x, MemoProcedure), 0, 'memo-stats')
+    return scheme_list(Pair(Symbol('hits'), procedure.hits),
+                       Pair(Symbol('misses'), procedure.misses),
+                       Pair(Symbol('size'), len(procedure.cache)),
+                       Pair(Symbol('capacity'), procedure.size))
+
+
+def scheme_memo_clear(procedure):
+    check_type(procedure, lambda x: isinstance(x, MemoProcedure), 0, 'memo-clear!')
+    procedure.cache.clear()
+    procedure.hits = procedure.misses = 0
+
+
 # 读取-求值-打印 循环
-def read_eval_print_loop(next_buffer, env, interactive=False):
-    """读取表达式并求值，直到文件结束或者键盘中断。"""
+def read_eval_print_loop(next_buffer, env, interactive=False,
+                         evaluate=scheme_eval, read=scheme_read):
+    """读取表达式并求值，直到文件结束或者键盘中断。
+
+    evaluate: 求值函数，默认为scheme_eval，也可以是其他求值引擎。
+    read: 从next_buffer()的结果中读取一个表达式的函数。"""
     while True:
         try:
             src = next_buffer()
             while src.more_on_line():
-                expression = scheme_read(src)
-                result = scheme_eval(expression, env)
+                expression = read(src)
+                result = evaluate(expression, env)
                 if result is not None:
                     print(result)
         except (SchemeError, SyntaxError, ValueError, RuntimeError) as err:
@@ -480,28 +1433,124 @@ def create_global_frame():
                PrimitiveProcedure(scheme_filter, True, 'filter'))
     env.define('reduce',
                PrimitiveProcedure(scheme_reduce, True, 'reduce'))
+    env.define('force',
+               PrimitiveProcedure(scheme_force, False, 'force'))
+    env.define('promise?',
+               PrimitiveProcedure(scheme_promisep, False, 'promise?'))
+    env.define('stream-car',
+               PrimitiveProcedure(scheme_stream_car, False, 'stream-car'))
+    env.define('stream-cdr',
+               PrimitiveProcedure(scheme_stream_cdr, False, 'stream-cdr'))
+    env.define('stream-map',
+               PrimitiveProcedure(scheme_stream_map, True, 'stream-map'))
+    env.define('stream-filter',
+               PrimitiveProcedure(scheme_stream_filter, True, 'stream-filter'))
+    env.define('stream-take',
+               PrimitiveProcedure(scheme_stream_take, False, 'stream-take'))
+    env.define('stream->list',
+               PrimitiveProcedure(scheme_stream_to_list, False, 'stream->list'))
+    env.define('pmap',
+               PrimitiveProcedure(scheme_pmap, False, 'pmap'))
+    env.define('memoize',
+               PrimitiveProcedure(scheme_memoize, False, 'memoize'))
+    env.define('memo-stats',
+               PrimitiveProcedure(scheme_memo_stats, False, 'memo-stats'))
+    env.define('memo-clear!',
+               PrimitiveProcedure(scheme_memo_clear, False, 'memo-clear!'))
     env.define('undefined', None)
     add_primitives(env, PRIMITIVES)
     return env
 
 
+_builtin_primitives = None
+
+
+def builtin_primitives():
+    """返回全局环境中的所有基本过程：名字 -> PrimitiveProcedure。"""
+    global _builtin_primitives
+    if _builtin_primitives is None:
+        env = create_global_frame()
+        _builtin_primitives = {
+            name: value for name, value in env.bindings.items()
+            if isinstance(value, PrimitiveProcedure)}
+    return _builtin_primitives
+
+
+def builtin_primitive(name):
+    """按名字取得内置的基本过程，用于反序列化PrimitiveProcedure。"""
+    return builtin_primitives()[name]
+
+
 def run():
     import argparse
     parser = argparse.ArgumentParser(description='Scheme解释器')
     parser.add_argument('file', nargs='?',
                         type=argparse.FileType('r'), default=None,
-                        help='要运行的Scheme文件')
+                        help='要运行的Scheme文件，-表示从标准输入读入')
+    parser.add_argument('--engine', choices=['eval', 'compile', 'vm'],
+                        default='eval',
+                        help='求值引擎：eval为遍历表达式树的scheme_eval，'
+                             'compile为闭包编译引擎，vm为字节码虚拟机')
+    parser.add_argument('-O', '--optimize', action='store_true',
+                        help='求值前进行常量折叠等优化')
+    parser.add_argument('--profile', action='store_true',
+                        help='统计每个过程的调用次数、时间和分配次数，'
+                             '结束时输出到标准错误（只支持eval引擎）')
+    parser.add_argument('--profile-json', metavar='FILE',
+                        help='同--profile，并将统计结果以JSON格式写入FILE')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='不读取、也不写入解析结果的缓存文件（.scmc）')
     args = parser.parse_args()
+    profiler = None
+    if args.profile or args.profile_json:
+        if args.engine != 'eval':
+            parser.error('--profile只支持eval引擎')
+        from sugon.edu.scheme_profile import Profiler
+        profiler = Profiler()
+        profiler.install()
+    if args.engine == 'compile':
+        from sugon.edu.scheme_compile import compile_eval
+        evaluate = compile_eval
+    elif args.engine == 'vm':
+        from sugon.edu.scheme_vm import vm_eval
+        evaluate = vm_eval
+    else:
+        evaluate = scheme_eval
+    if args.optimize:
+        from sugon.edu.scheme_optimize import optimizing_eval
+        evaluate = optimizing_eval(evaluate)
+    read = scheme_read
     if args.file is not None:
-        lines = args.file.readlines()
-        next_buffer = lambda: buffer_lines(lines)
         interactive = False
+        next_buffer = None
+        if not args.no_cache and args.file is not sys.stdin:
+            from sugon.edu.scheme_cache import (cacheable, cached_buffers,
+                                                ExpressionBuffer)
+            if cacheable(args.file):
+                next_buffer = cached_buffers(args.file.name,
+                                             stream_lines(args.file))
+        if next_buffer is not None:
+            read = ExpressionBuffer.remove_front
+        else:
+            # 所有Buffer共用同一个iterator，按需从文件中读入各行
+            lines = stream_lines(args.file)
+            next_buffer = lambda: buffer_lines(lines)
     else:
         next_buffer = buffer_input
         interactive = True
-    read_eval_print_loop(next_buffer, create_global_frame(),
-                         interactive=interactive)
+    env = create_global_frame()
+    try:
+        read_eval_print_loop(next_buffer, env, interactive=interactive,
+                             evaluate=evaluate, read=read)
+    finally:
+        if profiler is not None:
+            profiler.uninstall()
+            profiler.print_report(env)
+            if args.profile_json:
+                profiler.write_json(env, args.profile_json)
 
 
 if __name__ == '__main__':
-    run()
+    # 通过sugon.edu.scheme模块运行，使各个求值引擎模块与本模块使用同一组类
+    import sugon.edu.scheme as _scheme
+    _scheme.run()
@@ -3,6 +3,12 @@
 """buffer模块用于遍历token。"""
 
 import math
+from collections import deque
+import mmap
+import os
+
+# 出错时显示的行数；Buffer只保留这么多已处理的行
+HISTORY_LINES = 4
 
 
 class Buffer:
@@ -37,13 +43,28 @@ class Buffer:
     2: 15
     3: 12 ) >>
     >>> buf.remove_front()  # 返回None
+
+    只保留最近的HISTORY_LINES行，读入很多行时占用的内存不会增长，
+    行号仍从第一行开始计算：
+
+    >>> buf = Buffer(iter([[n] for n in range(1, 1001)]))
+    >>> while buf.remove_front() != 1000:
+    ...     pass
+    >>> len(buf.lines)
+    4
+    >>> print(buf)
+    997: 997
+     998: 998
+     999: 999
+    1000: 1000 >>
     """
     def __init__(self, source):
         """
         source是iterator。
         next(source)返回元素为token的list，对应一行文本。"""
         self.index = 0      # 当前行list的当前token的索引
-        self.lines = []     # 已处理的行，包括当前行
+        self.lines = deque(maxlen=HISTORY_LINES)  # 最近处理的行，包括当前行
+        self.line_count = 0                       # 已处理的行数
         self.source = source
         self.current_line = ()
         self.current()
@@ -62,6 +83,7 @@ class Buffer:
             try:
                 self.current_line = next(self.source)
                 self.lines.append(self.current_line)
+                self.line_count += 1
             except StopIteration:
                 self.current_line = ()
                 return None
@@ -73,12 +95,13 @@ class Buffer:
 
     def __str__(self):
         """返回已读的token，并使用>>标记当前token。"""
-        n = len(self.lines)
+        n = self.line_count
         msg = '{0:>' + str(math.floor(math.log10(n))+1) + "}: "
 
         s = ''
-        for i in range(max(0, n-4), n-1):
-            s += msg.format(i+1) + ' '.join(map(str, self.lines[i])) + '\n'
+        first = n - len(self.lines) + 1   # 保留的第一行的行号
+        for i, line in enumerate(list(self.lines)[:-1], first):
+            s += msg.format(i) + ' '.join(map(str, line)) + '\n'
         s += msg.format(n)
         s += ' '.join(map(str, self.current_line[:self.index]))
         s += ' >> '
@@ -107,11 +130,53 @@ class InputReader:
 
 
 class LineReader:
+    """LineReader是iterable类型，依次给出lines中的各行，结束时抛出EOFError。
+
+    lines是list时按下标依次给出，不修改list；lines也可以是文件等iterator，
+    此时按需读入。多个LineReader要从同一组行中接着读入时，应使用同一个
+    iterator，后面的LineReader从前一个停止的地方继续：
+
+    >>> lines = iter(['(+ 1', '2)', '(* 3 4)'])
+    >>> first, second = iter(LineReader(lines)), iter(LineReader(lines))
+    >>> next(first), next(second), next(first)
+    ('(+ 1', '2)', '(* 3 4)')
+    """
     def __init__(self, lines):
         self.lines = lines
+        self.index = 0  # lines是list时，下一个要给出的行的下标
 
     def __iter__(self):
-        while self.lines:
-            line = self.lines.pop(0).strip('\n')
-            yield line
+        if isinstance(self.lines, list):
+            while self.index < len(self.lines):
+                line = self.lines[self.index]
+                self.index += 1
+                yield line.strip('\n')
+        else:
+            for line in self.lines:
+                yield line.strip('\n')
         raise EOFError
+
+
+# 超过这个大小的文件使用mmap读入
+MMAP_THRESHOLD = 1 << 20
+
+
+def stream_lines(file):
+    """返回按需读入文件file各行的iterator。
+
+    大的普通文件使用mmap读入；标准输入、管道等直接逐行读入。"""
+    try:
+        size = os.fstat(file.fileno()).st_size
+    except (OSError, ValueError, AttributeError):
+        size = 0
+    if size < MMAP_THRESHOLD:
+        return iter(file)
+    return mmap_lines(file)
+
+
+def mmap_lines(file):
+    """使用mmap逐行读入文件file。"""
+    encoding = getattr(file, 'encoding', None) or 'utf-8'
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for line in iter(data.readline, b''):
+            yield line.decode(encoding)
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+
+"""将Scheme源文件解析出的表达式缓存在.scmc文件中。
+
+源文件foo.scm的缓存为foo.scmc。缓存文件中保存了源文件内容和解释器
+（词法分析、语法分析及本模块的代码）的散列值，其中任何一个改变时，
+缓存失效，重新解析源文件并写入新的缓存。
+
+表达式按read_eval_print_loop读入它们的方式分组：同一组中的表达式
+在同一个Buffer中读入，求值出错时，同组中剩余的表达式被跳过。
+使用缓存时，求值的结果与直接读入源文件完全相同。
+
+缓存失效时，源文件边读入边求值，各组表达式同时写入临时文件，读完
+整个文件之后才替换原来的缓存，所以大文件也不需要全部读入内存。
+使用缓存时，各组表达式也是在求值时才解码的。
+
+    >>> lines = ['(define x 1) (+ x 1)', "'(a . b) #(1 2.5)"]
+    >>> segments = [segment for segment, error in parse_segments(lines)]
+    >>> segments
+    [[Pair('define', Pair('x', Pair(1, nil))), Pair('+', Pair('x', Pair(1, nil)))], [Pair('quote', Pair(Pair('a', 'b'), nil)), Vector([1, 2.5])]]
+    >>> decoded = decode_segments(encode_segments(segments))
+    >>> decoded == segments
+    True
+
+符号解码后仍是interned的Symbol：
+
+    >>> decoded[0][1].second.first is segments[0][0].second.first
+    True
+
+编码是后缀形式的：先写出list的元素和结尾，再写出构造list的指令，
+所以编码和解码都不使用递归。
+"""
+
+import hashlib
+import os
+import stat
+import struct
+
+from sugon.edu.scheme_reader import (Pair, Vector, nil, Symbol,
+                                     scheme_read, buffer_lines)
+from sugon.edu.scheme_tokens import String
+
+FORMAT_VERSION = 3
+MAGIC = b'SCMC'
+# 缓存文件的结尾是编码数据的散列值，用于检查缓存文件是否完整
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+# 编码中的指令
+_NIL, _TRUE, _FALSE = b'n'[0], b't'[0], b'f'[0]
+_INT, _FLOAT = b'i'[0], b'd'[0]
+_SYMBOL, _SYMBOL_REF = b's'[0], b'r'[0]   # 新的符号、之前出现过的符号
+_STRING = b'q'[0]
+_LIST, _VECTOR, _SEGMENT = b'l'[0], b'v'[0], b'g'[0]
+
+_DOUBLE = struct.Struct('<d')
+
+_fingerprint = None
+
+
+def interpreter_fingerprint():
+    """返回词法分析、语法分析和缓存格式的散列值。"""
+    global _fingerprint
+    if _fingerprint is None:
+        from sugon.edu import scheme_tokens, scheme_reader, scheme_buffer
+        digest = hashlib.sha256(str(FORMAT_VERSION).encode())
+        for module in (scheme_tokens, scheme_reader, scheme_buffer):
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        with open(__file__, 'rb') as f:
+            digest.update(f.read())
+        _fingerprint = digest.digest()
+    return _fingerprint
+
+
+def cache_path(path):
+    """返回源文件path对应的缓存文件。"""
+    return os.path.splitext(path)[0] + '.scmc'
+
+
+def cacheable(file):
+    """是否为打开的源文件file使用缓存：只缓存普通文件。
+
+    管道等输入无法按路径计算散列值，直接边读入边求值。"""
+    try:
+        info = os.fstat(file.fileno())
+    except (OSError, ValueError, AttributeError):
+        return False
+    return stat.S_ISREG(info.st_mode)
+
+
+def parse_segments(lines):
+    """像read_eval_print_loop一样读入lines中的表达式，依次给出各组表达式。
+
+    给出的是(表达式list, 错误)。读入一组表达式时出错，错误是读入时抛出的
+    异常，表达式list是出错之前读入的表达式；否则错误为None。"""
+    pending = iter(lines)
+    while True:
+        try:
+            src = buffer_lines(pending)
+        except EOFError:
+            return
+        except (SyntaxError, ValueError) as err:
+            # 第一行的词法分析出错
+            yield [], err
+            continue
+        segment = []
+        try:
+            while src.more_on_line():
+                segment.append(scheme_read(src))
+        except (SyntaxError, ValueError, EOFError) as err:
+            yield segment, err
+        else:
+            yield segment, None
+
+
+def write_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(data, pos):
+    n, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+class _Emit(bytes):
+    """编码时栈中待写出的指令。"""
+
+
+def encode_segments(segments):
+    """将分组的表达式编码为bytes。
+
+    表达式中出现无法编码的值时抛出TypeError。"""
+    encoder = SegmentEncoder()
+    return b''.join(encoder.encode(segment) for segment in segments)
+
+
+class SegmentEncoder:
+    """依次编码各组表达式；符号表在各组之间共用。"""
+
+    def __init__(self):
+        self.symbols = {}  # 符号 -> 在符号表中的下标
+
+    def encode(self, segment):
+        """将一组表达式编码为bytes，无法编码时抛出TypeError。"""
+        out = bytearray()
+        symbols = self.symbols
+        op = bytearray([_SEGMENT])
+        write_varint(op, len(segment))
+        stack = [_Emit(op)]
+        stack.extend(reversed(segment))
+        while stack:
+            item = stack.pop()
+            if type(item) is _Emit:
+                out += item
+            elif item is nil:
+                out.append(_NIL)
+            elif item is True:
+                out.append(_TRUE)
+            elif item is False:
+                out.append(_FALSE)
+            elif type(item) is int:
+                raw = item.to_bytes(item.bit_length() // 8 + 1, 'little', signed=True)
+                out.append(_INT)
+                write_varint(out, len(raw))
+                out += raw
+            elif type(item) is float:
+                out.append(_FLOAT)
+                out += _DOUBLE.pack(item)
+            elif type(item) is Symbol:
+                index = symbols.get(item)
+                if index is not None:
+                    out.append(_SYMBOL_REF)
+                    write_varint(out, index)
+                else:
+                    symbols[item] = len(symbols)
+                    raw = item.encode('utf-8')
+                    out.append(_SYMBOL)
+                    write_varint(out, len(raw))
+                    out += raw
+            elif type(item) is String:
+                raw = item.encode('utf-8')
+                out.append(_STRING)
+                write_varint(out, len(raw))
+                out += raw
+            elif isinstance(item, Pair):
+                items, second = [], item
+                while isinstance(second, Pair):
+                    items.append(second.first)
+                    second = second.second
+                op = bytearray([_LIST])
+                write_varint(op, len(items))
+                stack.append(_Emit(op))
+                stack.append(second)
+                stack.extend(reversed(items))
+            elif isinstance(item, Vector):
+                op = bytearray([_VECTOR])
+                write_varint(op, len(item.items))
+                stack.append(_Emit(op))
+                stack.extend(reversed(item.items))
+            else:
+                raise TypeError('无法编码的值: {0!r}'.format(item))
+        return bytes(out)
+
+
+def decode_segments(data):
+    """将encode_segments的结果解码为分组的表达式。
+
+    数据损坏时抛出ValueError。"""
+    return list(iter_decode(data, 0, len(data)))
+
+
+def iter_decode(data, start, end):
+    """依次给出data[start:end]中解码的各组表达式。数据损坏时抛出ValueError。"""
+    try:
+        yield from _decode(data, start, end)
+    except (IndexError, struct.error, UnicodeDecodeError) as err:
+        raise ValueError('损坏的缓存数据: {0}'.format(err))
+
+
+def _decode(data, pos, end):
+    stack, symbols = [], []
+    push, pop = stack.append, stack.pop
+    unpack_double = _DOUBLE.unpack_from
+    while pos < end:
+        op = data[pos]
+        pos += 1
+        # 按出现的频率排列各个分支
+        if op == _SYMBOL_REF:
+            index = data[pos]
+            pos += 1
+            if index >= 0x80:
+                index, pos = read_varint(data, pos - 1)
+            push(symbols[index])
+        elif op == _LIST:
+            n, pos = read_varint(data, pos)
+            result = pop()
+            if n > len(stack):
+                raise ValueError('损坏的缓存数据')
+            for _ in range(n):
+                result = Pair(pop(), result)
+            push(result)
+        elif op == _SYMBOL:
+            n, pos = read_varint(data, pos)
+            symbol = Symbol(data[pos:pos+n].decode('utf-8'))
+            pos += n
+            symbols.append(symbol)
+            push(symbol)
+        elif op == _INT:
+            n, pos = read_varint(data, pos)
+            push(int.from_bytes(data[pos:pos+n], 'little', signed=True))
+            pos += n
+        elif op == _FLOAT:
+            push(unpack_double(data, pos)[0])
+            pos += 8
+        elif op == _STRING:
+            n, pos = read_varint(data, pos)
+            push(String(data[pos:pos+n].decode('utf-8')))
+            pos += n
+        elif op == _NIL:
+            push(nil)
+        elif op == _TRUE:
+            push(True)
+        elif op == _FALSE:
+            push(False)
+        elif op == _VECTOR:
+            n, pos = read_varint(data, pos)
+            if n > len(stack):
+                raise ValueError('损坏的缓存数据')
+            items = stack[len(stack)-n:]
+            del stack[len(stack)-n:]
+            push(Vector(items))
+        elif op == _SEGMENT:
+            n, pos = read_varint(data, pos)
+            if n != len(stack):
+                raise ValueError('损坏的缓存数据')
+            yield stack[:]
+            del stack[:]
+        else:
+            raise ValueError('未知的指令: {0}'.format(op))
+    if stack or pos != end:
+        raise ValueError('损坏的缓存数据')
+
+
+def cache_header(source_hash):
+    return MAGIC + bytes([FORMAT_VERSION]) + interpreter_fingerprint() + source_hash
+
+
+def load_cache(path, source_hash):
+    """读取缓存文件path，返回依次解码各组表达式的iterator；缓存不存在、
+    已失效或者不完整时返回None。"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    header = cache_header(source_hash)
+    if not data.startswith(header) or len(data) < len(header) + DIGEST_SIZE:
+        return None
+    start, end = len(header), len(data) - DIGEST_SIZE
+    with memoryview(data) as view:
+        if hashlib.sha256(view[start:end]).digest() != data[end:]:
+            return None
+    return iter_decode(data, start, end)
+
+
+class CacheWriter:
+    """依次将各组表达式写入缓存文件path。
+
+    先写入临时文件，commit时才替换原来的缓存；无法编码或写入时放弃，
+    不影响求值。"""
+
+    def __init__(self, path, source_hash):
+        self.path = path
+        self.temp = '{0}.{1}.tmp'.format(path, os.getpid())
+        self.encoder = SegmentEncoder()
+        self.digest = hashlib.sha256()
+        try:
+            self.file = open(self.temp, 'wb')
+            self.file.write(cache_header(source_hash))
+        except OSError:
+            self.file = None
+            self.abandon()
+
+    def add(self, segment):
+        if self.file is None:
+            return
+        try:
+            data = self.encoder.encode(segment)
+            self.file.write(data)
+        except (TypeError, OSError):
+            self.abandon()
+            return
+        self.digest.update(data)
+
+    def commit(self):
+        """写入结尾的散列值，用临时文件替换缓存文件。"""
+        if self.file is None:
+            return
+        try:
+            self.file.write(self.digest.digest())
+            self.file.close()
+            self.file = None
+            os.replace(self.temp, self.path)
+        except OSError:
+            self.abandon()
+        self.temp = None
+
+    def abandon(self):
+        """放弃写入，删除临时文件。commit之后调用时不做任何事。"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.temp is not None:
+            try:
+                os.remove(self.temp)
+            except OSError:
+                pass
+            self.temp = None
+
+
+def file_hash(path):
+    """返回文件path内容的散列值。"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def cached_buffers(path, lines):
+    """返回供read_eval_print_loop使用的next_buffer函数，依次给出源文件
+    path中各组表达式的ExpressionBuffer，配合read=ExpressionBuffer.remove_front
+    使用。无法读取源文件时返回None。
+
+    缓存有效时从缓存中解码；否则从lines（源文件各行的iterator）中边读入
+    边给出，读完整个文件并且没有语法错误时写入缓存。"""
+    try:
+        source_hash = file_hash(path)
+    except OSError:
+        return None
+    cache = cache_path(path)
+    segments = load_cache(cache, source_hash)
+    if segments is not None:
+        buffers = (ExpressionBuffer(segment) for segment in segments)
+    else:
+        buffers = parsed_buffers(lines, CacheWriter(cache, source_hash))
+
+    def next_buffer():
+        for buffer in buffers:
+            return buffer
+        raise EOFError
+    return next_buffer
+
+
+def parsed_buffers(lines, writer):
+    """从lines中边读入边给出各组表达式的ExpressionBuffer，同时交给writer。
+
+    有语法错误的文件不写入缓存。没有读完就不再使用时（例如求值时被
+    中断），writer放弃写入。"""
+    try:
+        for segment, error in parse_segments(lines):
+            if error is None:
+                writer.add(segment)
+            else:
+                writer.abandon()
+            yield ExpressionBuffer(segment, error)
+        writer.commit()
+    finally:
+        writer.abandon()
+
+
+class ExpressionBuffer:
+    """代替Buffer，依次给出一组已经读入的表达式。
+
+    error不为None时，给出所有表达式之后抛出error，与直接读入源文件时
+    在同样的位置报告语法错误。"""
+
+    def __init__(self, expressions, error=None):
+        self.expressions = expressions
+        self.index = 0
+        self.error = error
+
+    def more_on_line(self):
+        return self.index < len(self.expressions) or self.error is not None
+
+    def remove_front(self):
+        if self.index == len(self.expressions):
+            error, self.error = self.error, None
+            raise error
+        expression = self.expressions[self.index]
+        self.index += 1
+        return expression
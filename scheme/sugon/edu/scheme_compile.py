@@ -0,0 +1,695 @@
+# -*- coding: utf-8 -*-
+
+"""Scheme解释器的闭包编译引擎。
+
+scheme_eval每次求值都要重新遍历Pair构成的表达式树。
+本模块的analyze把表达式预先分析一次，得到由Python闭包构成的树，
+之后每次求值只需要运行这些闭包：
+
+    >>> env = create_global_frame()
+    >>> compile_eval(read_line('(define (sq x) (* x x))'), env)
+    'sq'
+    >>> compile_eval(read_line('(sq 12)'), env)
+    144
+
+分析时还会为每个局部变量确定一个词法地址(depth, index)：
+depth是向外跨过的Frame层数，index是变量在该Frame的slots中的下标。
+运行时访问局部变量只需按下标读取，不需要查字典。
+
+求值结果和错误信息与scheme_eval保持一致。
+"""
+
+from sugon.edu.scheme import *
+
+
+class Scope:
+    """编译时的作用域，对应运行时的一个SlotFrame。
+
+    最外层的作用域（parent为None）对应compile_eval的环境env，
+    其中的变量在运行时按名字查找。"""
+
+    def __init__(self, names, parent=None, env=None):
+        """
+        names: 形式参数或let绑定的名字
+        parent: 外层作用域
+        env: 最外层作用域对应的环境
+        """
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.defined = set()  # 由define引入、运行时可能尚未赋值的名字
+        self.parent = parent
+        self.env = env if parent is None else parent.env
+
+    def add(self, name):
+        """在作用域中加入一个由define引入的局部变量。"""
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+            self.defined.add(name)
+
+    def resolve(self, name):
+        """返回局部变量name的词法地址(depth, index)，全局变量返回None。"""
+        depth, scope = 0, self
+        while scope.parent is not None:
+            if name in scope.index:
+                return depth, scope.index[name]
+            scope = scope.parent
+            depth += 1
+        return None
+
+
+class Unassigned:
+    """尚未执行define的局部变量的值。"""
+
+    def __reduce__(self):
+        # 序列化后仍然是同一个UNASSIGNED对象
+        return 'UNASSIGNED'
+
+
+UNASSIGNED = Unassigned()
+
+# 曾经在SlotFrame中运行时define（不在作用域中）的名字。引用这些名字的
+# 全局变量不使用缓存，而是沿Frame链查找，与scheme_eval一致。
+RUNTIME_NAMES = set()
+
+
+class SlotFrame:
+    """编译后的代码在函数调用和let中使用的Frame。
+
+    局部变量按词法地址存放在slots中；lookup和define按名字访问，
+    供scheme_eval（例如eval基本过程）和do_xxx_form函数使用。"""
+
+    __slots__ = ('parent', 'index', 'slots', 'bindings')
+
+    def __init__(self, parent, index, slots):
+        """
+        parent: 父frame
+        index: 名字到slots下标的dict
+        slots: 局部变量的值，Python list
+        """
+        self.parent = parent
+        self.index = index
+        self.slots = slots
+        self.bindings = None  # 运行时新增的、不在index中的绑定
+
+    def __repr__(self):
+        s = ['{0}: {1}'.format(k, self.slots[i]) for k, i in self.index.items()
+             if self.slots[i] is not UNASSIGNED]
+        if self.bindings:
+            s += ['{0}: {1}'.format(k, v) for k, v in self.bindings.items()]
+        return '<{{{0}}} -> {1}>'.format(', '.join(sorted(s)), repr(self.parent))
+
+    def define(self, symbol, value):
+        """在frame中绑定符号symbol和值value。"""
+        if symbol in self.index:
+            self.slots[self.index[symbol]] = value
+        else:
+            if self.bindings is None:
+                self.bindings = {}
+            self.bindings[symbol] = value
+            RUNTIME_NAMES.add(symbol)
+
+    def lookup(self, symbol):
+        """查找绑定到符号symbol上的值。"""
+        if symbol in self.index:
+            value = self.slots[self.index[symbol]]
+            if value is not UNASSIGNED:
+                return value
+        elif self.bindings and symbol in self.bindings:
+            return self.bindings[symbol]
+        return self.parent.lookup(symbol)
+
+    def make_child_frame(self, formals, vals):
+        """同Frame.make_child_frame。"""
+        return Frame.make_child_frame(self, formals, vals)
+
+
+class CompiledProcedure(LambdaProcedure):
+    """由闭包编译引擎生成的用户自定义函数过程。"""
+
+    def __init__(self, formals, body, env, code, scope):
+        """
+        formals, body, env: 同LambdaProcedure
+        code: 编译后的函数体闭包
+        scope: 函数体的作用域
+        """
+        LambdaProcedure.__init__(self, formals, body, env)
+        self.code = code
+        self.scope = scope
+        self.index = scope.index
+        self.nparams = len(scope.names) - len(scope.defined)
+        self.padding = [UNASSIGNED] * len(scope.defined)
+
+    def apply(self, args, env):
+        """使用Scheme list参数args应用自身函数。"""
+        python_args = []
+        while args is not nil:
+            python_args.append(args.first)
+            args = args.second
+        return apply_procedure(self, python_args, env)
+
+    def __reduce__(self):
+        # 闭包无法序列化，反序列化时在外层作用域中重新分析函数体
+        return rebuild_procedure, (self.formals, self.body, self.env,
+                                   self.scope.parent)
+
+
+def rebuild_procedure(formals, body, env, parent_scope):
+    """创建反序列化的CompiledProcedure，函数体在第一次调用时重新分析。
+
+    反序列化时env可能还没有完全恢复（env中包含这个过程本身），所以
+    不能立即分析，也不能查找函数体中的宏、找出函数体中的define。
+    这时作用域中只有形式参数，第一次调用时再加入define的名字。
+
+    >>> import pickle
+    >>> env = create_global_frame()
+    >>> compile_eval(read_line('(define (f x) (define y (* x 10)) (+ x y))'), env)
+    'f'
+    >>> f = pickle.loads(pickle.dumps(env.lookup('f')))
+    >>> f.env.lookup('f') is f
+    True
+    >>> apply_procedure(f, [2], env), apply_procedure(f, [3], env)
+    (22, 33)
+    """
+    scope = Scope(as_python_list(formals), parent_scope)
+    procedure = CompiledProcedure(formals, body, env, None, scope)
+    def code(frame):
+        scan_defines(body, scope)
+        procedure.padding = [UNASSIGNED] * len(scope.defined)
+        frame.slots += procedure.padding
+        procedure.code = analyze_sequence(body, scope, True)
+        return procedure.code(frame)
+    procedure.code = code
+    return procedure
+
+
+class TailCall:
+    """尾部位置上尚未执行的过程调用。"""
+
+    __slots__ = ('procedure', 'args')
+
+    def __init__(self, procedure, args):
+        self.procedure = procedure
+        self.args = args
+
+
+def compile_eval(expr, env):
+    """编译表达式expr，然后在环境env中运行。
+
+    >>> compile_eval(read_line('(+ 2 2)'), create_global_frame())
+    4
+    """
+    return analyze(expr, Scope((), env=env))(env)
+
+
+def apply_procedure(procedure, args, env):
+    """使用Python list参数args应用procedure过程，返回值。
+
+    编译后的函数之间的尾调用在这里的循环中完成，不会增加Python栈的深度。
+    args会直接用作新SlotFrame的slots。"""
+    while True:
+        if type(procedure) is CompiledProcedure:
+            if len(args) != procedure.nparams:
+                raise SchemeError('形式参数和实际参数值不匹配: \n{0}\n{1}'.format(
+                    procedure.formals, scheme_list(*args)))
+            if procedure.padding:
+                args += procedure.padding
+            frame = SlotFrame(procedure.env, procedure.index, args)
+            result = procedure.code(frame)
+            if type(result) is not TailCall:
+                return result
+            procedure, args, env = result.procedure, result.args, frame
+        elif type(procedure) is PrimitiveProcedure:
+            return procedure.call(args, env)
+        else:
+            return complete_apply(procedure, scheme_list(*args), env)
+
+
+def analyze(expr, scope, tail=False):
+    """在作用域scope中分析表达式expr，返回一个以环境为参数的闭包。
+
+    tail为True表示expr处于尾部位置，此时过程调用返回TailCall。
+    表达式的语法错误推迟到运行闭包时才抛出，与scheme_eval一致。
+    """
+    try:
+        return analyze_expression(expr, scope, tail)
+    except SchemeError as err:
+        return analyze_error(err)
+
+
+def analyze_error(err):
+    def raise_error(env):
+        raise err
+    return raise_error
+
+
+def analyze_expression(expr, scope, tail):
+    # 基本表达式
+    if scheme_symbolp(expr):
+        return analyze_symbol(expr, scope)
+    elif self_evaluating(expr):
+        return lambda env: expr
+
+    # 复合表达式
+    if not scheme_listp(expr):
+        raise SchemeError('无效的复合表达式: {0}'.format(str(expr)))
+    first, rest = expr.first, expr.second
+    if not scheme_symbolp(first):
+        raise SchemeError('无效的复合表达式: {0}'.format(str(expr)))
+    if first in ANALYZERS:
+        return ANALYZERS[first](rest, scope, tail)
+    elif first in SPECIAL_FORMS:
+        return analyze_special_form(SPECIAL_FORMS[first], rest)
+    macro = scope_macro(first, scope)
+    if macro is not None:
+        # 宏调用在分析时展开，运行时只执行展开结果
+        return analyze_expression(macro.expand(rest), scope, tail)
+    return analyze_call(first, rest, scope, tail)
+
+
+def scope_macro(name, scope):
+    """如果name不是局部变量，并且在最外层环境中绑定到宏，返回这个宏。
+
+    >>> env = create_global_frame()
+    >>> compile_eval(read_line('(define-macro (defconst name value) `(define ,name ,value))'), env)
+    'defconst'
+    >>> compile_eval(read_line('(define (f x) (defconst y (* x 2)) (+ x y))'), env)
+    'f'
+    >>> compile_eval(read_line('(f 3)'), env)
+    9
+    """
+    if scope.resolve(name) is not None:
+        return None
+    return lookup_macro(name, scope.env)
+
+
+def analyze_symbol(name, scope):
+    """分析变量引用。局部变量按词法地址读取，全局变量在最外层环境中查找。"""
+    address = scope.resolve(name)
+    if address is None:
+        return analyze_global(name, scope.env)
+    depth, i = address
+    if depth == 0:
+        load = lambda frame: frame.slots[i]
+    elif depth == 1:
+        load = lambda frame: frame.parent.slots[i]
+    elif depth == 2:
+        load = lambda frame: frame.parent.parent.slots[i]
+    else:
+        def load(frame):
+            for _ in range(depth):
+                frame = frame.parent
+            return frame.slots[i]
+    for _ in range(depth):
+        scope = scope.parent
+    if name not in scope.defined:
+        return load
+
+    def load_defined(frame):
+        value = load(frame)
+        if value is UNASSIGNED:
+            # 尚未执行define时，与scheme_eval一样到外层环境中查找
+            for _ in range(depth):
+                frame = frame.parent
+            return frame.parent.lookup(name)
+        return value
+    return load_defined
+
+
+def analyze_global(name, env):
+    """分析全局变量引用，每个引用处缓存查找的结果。
+
+    env的version在每次define时改变，此时缓存失效，
+    所以重新定义的全局变量立即生效：
+
+    >>> env = create_global_frame()
+    >>> compile_eval(read_line('(define (f) (g))'), env)
+    'f'
+    >>> compile_eval(read_line('(define (g) 1)'), env)
+    'g'
+    >>> compile_eval(read_line('(f)'), env)
+    1
+    >>> compile_eval(read_line('(define (g) 2)'), env)
+    'g'
+    >>> compile_eval(read_line('(f)'), env)
+    2
+
+    函数体中在运行时define的名字（例如通过eval）不在作用域中，存放在
+    SlotFrame的bindings里（见RUNTIME_NAMES），按Frame链查找，优先于
+    同名的全局变量：
+
+    >>> compile_eval(read_line('(define q 1)'), env)
+    'q'
+    >>> compile_eval(read_line("(define (h) (eval '(define q 3)) q)"), env)
+    'h'
+    >>> compile_eval(read_line('(h)'), env)
+    3
+    >>> compile_eval(read_line('q'), env)
+    1
+    """
+    if not isinstance(env, Frame) or env.parent is not None:
+        # 外层Frame中的define不会改变env的version，不能缓存
+        return lambda frame: frame.lookup(name)
+    version, value = None, None
+    runtime_names = RUNTIME_NAMES
+    def load_global(frame):
+        nonlocal version, value
+        if runtime_names and name in runtime_names:
+            return frame.lookup(name)
+        if version != env.version:
+            value = env.lookup(name)
+            version = env.version
+        return value
+    return load_global
+
+
+def analyze_call(operator, operands, scope, tail):
+    """分析过程调用表达式。
+
+    基本过程直接调用；尾部位置上的其他过程调用返回TailCall。"""
+    fn = analyze(operator, scope)
+    arg_fns = [analyze(operand, scope) for operand in as_python_list(operands)]
+    if len(arg_fns) == 2:
+        return analyze_binary_call(fn, arg_fns[0], arg_fns[1], tail)
+    if tail:
+        def call(env):
+            procedure = fn(env)
+            check_procedure(procedure)
+            args = [arg_fn(env) for arg_fn in arg_fns]
+            if type(procedure) is PrimitiveProcedure:
+                return procedure.call(args, env)
+            return TailCall(procedure, args)
+    else:
+        def call(env):
+            procedure = fn(env)
+            check_procedure(procedure)
+            args = [arg_fn(env) for arg_fn in arg_fns]
+            if type(procedure) is PrimitiveProcedure:
+                return procedure.call(args, env)
+            return apply_procedure(procedure, args, env)
+    return call
+
+
+def analyze_binary_call(fn, x_fn, y_fn, tail):
+    """分析有两个参数的过程调用。
+
+    与PrimitiveProcedure.eval_call一样，两个参数都是int时直接使用
+    基本过程的int_op（见INT_BINARY_OPS）。"""
+    def call(env):
+        procedure = fn(env)
+        check_procedure(procedure)
+        x, y = x_fn(env), y_fn(env)
+        if type(procedure) is PrimitiveProcedure:
+            if (procedure.int_op is not None and
+                    type(x) is int and type(y) is int):
+                return procedure.int_op(x, y)
+            return procedure.call([x, y], env)
+        if tail:
+            return TailCall(procedure, [x, y])
+        return apply_procedure(procedure, [x, y], env)
+    return call
+
+
+def analyze_special_form(do_form, expressions):
+    """没有专门分析函数的特殊形式，在运行时交给scheme模块的do_xxx_form函数。"""
+    def run_form(env):
+        result = do_form(expressions, env)
+        if isinstance(result, Thunk):
+            result = scheme_eval(result.expr, result.env)
+        return result
+    return run_form
+
+
+def analyze_body(expressions, names, scope, tail):
+    """分析函数体或let体，返回(闭包, 新的作用域)。
+
+    names是新作用域的形式参数。体中define的名字预先加入新的作用域，
+    使得体内的闭包可以通过词法地址访问它们。"""
+    body_scope = Scope(names, scope)
+    scan_defines(expressions, body_scope)
+    return analyze_sequence(expressions, body_scope, tail), body_scope
+
+
+def scan_defines(expressions, scope):
+    """找出表达式列表中会在当前Frame中执行的define（不包括内层的lambda和let体）。"""
+    while isinstance(expressions, Pair):
+        expr = expressions.first
+        if isinstance(expr, Pair):
+            first, rest = expr.first, expr.second
+            if first == 'quote' or first == 'quasiquote' or first == 'lambda':
+                pass
+            elif first == 'define' and isinstance(rest, Pair):
+                target = rest.first
+                if scheme_symbolp(target):
+                    scope.add(target)
+                    scan_defines(rest.second, scope)
+                elif isinstance(target, Pair) and scheme_symbolp(target.first):
+                    scope.add(target.first)
+            elif first == 'define-memo' and isinstance(rest, Pair):
+                target = rest.first
+                if isinstance(target, Pair) and scheme_symbolp(target.first):
+                    scope.add(target.first)
+            elif first == 'let' and isinstance(rest, Pair):
+                bindings = rest.first
+                while isinstance(bindings, Pair):
+                    if isinstance(bindings.first, Pair):
+                        scan_defines(bindings.first.second, scope)
+                    bindings = bindings.second
+            else:
+                macro = scope_macro(first, scope) if scheme_symbolp(first) else None
+                if macro is not None:
+                    scan_macro_defines(macro, rest, scope)
+                else:
+                    scan_defines(expr, scope)
+        expressions = expressions.second
+
+
+def scan_macro_defines(macro, operands, scope):
+    """找出宏调用的展开结果中的define。展开结果被缓存，分析时不会再次展开。"""
+    try:
+        expansion = macro.expand(operands)
+    except SchemeError:
+        return  # 分析这个调用时会再次出错，错误推迟到运行时
+    scan_defines(Pair(expansion, nil), scope)
+
+
+def analyze_sequence(expressions, scope, tail):
+    """分析表达式序列，返回的闭包按顺序运行每个表达式，并返回最后一个值。"""
+    if expressions is nil:
+        return lambda env: None
+    body, last = analyze_operands(expressions, scope, tail)
+    if not body:
+        return last
+    def sequence(env):
+        for fn in body:
+            fn(env)
+        return last(env)
+    return sequence
+
+
+def analyze_define(expressions, scope, tail):
+    check_form(expressions, 2)
+    target = expressions.first
+    if scheme_symbolp(target):
+        check_form(expressions, 2, 2)
+        name = target
+        value_fn = analyze(expressions.second.first, scope)
+    elif isinstance(target, Pair) and scheme_symbolp(target.first):
+        name = target.first
+        value_fn = analyze_lambda(Pair(target.second, expressions.second),
+                                  scope, tail)
+    else:
+        if isinstance(target, Pair):
+            bad_target = target.first
+        else:
+            bad_target = target
+        raise SchemeError('不是符号（symbol）: {0}'.format(bad_target))
+    return analyze_definition(name, value_fn, scope)
+
+
+def analyze_define_memo(expressions, scope, tail):
+    name, lambda_form = memo_definition(expressions)
+    make_procedure = analyze_lambda(lambda_form, scope, tail)
+    value_fn = lambda env: MemoProcedure(make_procedure(env))
+    return analyze_definition(name, value_fn, scope)
+
+
+def analyze_definition(name, value_fn, scope):
+    """将name绑定到value_fn的值，返回name。"""
+    if scope.parent is None or name not in scope.index:
+        def define(env):
+            env.define(name, value_fn(env))
+            return name
+    else:
+        i = scope.index[name]
+        def define(frame):
+            frame.slots[i] = value_fn(frame)
+            return name
+    return define
+
+
+def analyze_quote(expressions, scope, tail):
+    check_form(expressions, 1, 1)
+    value = expressions.first
+    return lambda env: value
+
+
+def analyze_begin(expressions, scope, tail):
+    check_form(expressions, 1)
+    return analyze_sequence(expressions, scope, tail)
+
+
+def analyze_lambda(expressions, scope, tail):
+    check_form(expressions, 2)
+    formals = expressions.first
+    check_formals(formals)
+    body = expressions.second
+    code, body_scope = analyze_body(body, as_python_list(formals), scope, True)
+    return lambda env: CompiledProcedure(formals, body, env, code, body_scope)
+
+
+def analyze_if(expressions, scope, tail):
+    check_form(expressions, 2, 3)
+    test = analyze(expressions.first, scope)
+    consequent = analyze(expressions.second.first, scope, tail)
+    if len(expressions) == 3:
+        alternative = analyze(expressions.second.second.first, scope, tail)
+    else:
+        alternative = lambda env: None
+    def if_(env):
+        if test(env) is not False:
+            return consequent(env)
+        return alternative(env)
+    return if_
+
+
+def analyze_and(expressions, scope, tail):
+    if expressions is nil:
+        return lambda env: True
+    body, last = analyze_operands(expressions, scope, tail)
+    def and_(env):
+        for fn in body:
+            value = fn(env)
+            if value is False:
+                return value
+        return last(env)
+    return and_
+
+
+def analyze_or(expressions, scope, tail):
+    if expressions is nil:
+        return lambda env: False
+    body, last = analyze_operands(expressions, scope, tail)
+    def or_(env):
+        for fn in body:
+            value = fn(env)
+            if value is not False:
+                return value
+        return last(env)
+    return or_
+
+
+def analyze_cond(expressions, scope, tail):
+    clauses = []
+    while expressions is not nil:
+        clauses.append(analyze_clause(expressions, scope, tail))
+        expressions = expressions.second
+    def cond(env):
+        for test, body in clauses:
+            value = test(env)
+            if value is not False:
+                if body is None:
+                    return value
+                return body(env)
+    return cond
+
+
+def analyze_clause(expressions, scope, tail):
+    """分析cond的一个分支，返回(test, body)，body为None表示分支没有表达式。
+
+    分支的语法错误在运行到该分支时才抛出，与scheme_eval一致。"""
+    clause = expressions.first
+    try:
+        check_form(clause, 1)
+        if clause.first == 'else':
+            if expressions.second != nil:
+                raise SchemeError('else must be last')
+            test = lambda env: True
+        else:
+            test = analyze(clause.first, scope)
+    except SchemeError as err:
+        return analyze_error(err), None
+    if clause.second is nil:
+        return test, None
+    return test, analyze_sequence(clause.second, scope, tail)
+
+
+def analyze_let(expressions, scope, tail):
+    check_form(expressions, 2)
+    bindings = expressions.first
+    if not scheme_listp(bindings):
+        raise SchemeError('bad bindings list in let form')
+    formals, names, value_fns = nil, [], []
+    while bindings is not nil:
+        binding = bindings.first
+        check_form(binding, 2, 2)
+        formals = Pair(binding.first, formals)
+        names.append(binding.first)
+        value_fns.append(analyze(binding.second.first, scope))
+        bindings = bindings.second
+    check_formals(formals)
+    body, body_scope = analyze_body(expressions.second, names, scope, tail)
+    index = body_scope.index
+    padding = [UNASSIGNED] * len(body_scope.defined)
+    def let(env):
+        slots = [fn(env) for fn in value_fns]
+        if padding:
+            slots += padding
+        return body(SlotFrame(env, index, slots))
+    return let
+
+
+def analyze_folded(expressions, scope, tail):
+    """分析优化器生成的FOLDED特殊形式（见do_folded_form）。"""
+    check_form(expressions, 3, 3)
+    valid = expressions.first.valid
+    folded = analyze(expressions.second.first, scope, tail)
+    original = analyze(expressions.second.second.first, scope, tail)
+    def folded_(env):
+        if valid():
+            return folded(env)
+        return original(env)
+    return folded_
+
+
+ANALYZERS = {
+    FOLDED: analyze_folded,
+    'and': analyze_and,
+    'begin': analyze_begin,
+    'cond': analyze_cond,
+    'define': analyze_define,
+    'define-memo': analyze_define_memo,
+    'if': analyze_if,
+    'lambda': analyze_lambda,
+    'let': analyze_let,
+    'or': analyze_or,
+    'quote': analyze_quote,
+}
+
+
+def as_python_list(lst):
+    """Scheme list 转为 Python list。"""
+    result = []
+    while isinstance(lst, Pair):
+        result.append(lst.first)
+        lst = lst.second
+    return result
+
+
+def analyze_operands(expressions, scope, tail):
+    """分析非空的表达式列表，返回(除最后一个外的闭包list, 最后一个的闭包)。
+
+    只有最后一个表达式可能处于尾部位置。"""
+    exprs = as_python_list(expressions)
+    return ([analyze(exp, scope) for exp in exprs[:-1]],
+            analyze(exprs[-1], scope, tail))
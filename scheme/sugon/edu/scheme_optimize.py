@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+"""在求值之前优化Scheme表达式：常量折叠和部分求值。
+
+optimize在求值前改写表达式：
+  * 参数都是常量的纯基本过程调用，在优化时直接算出结果；
+  * 条件为常量的if，只保留会被执行的分支。
+
+    >>> env = create_global_frame()
+    >>> optimize(read_line('(* 60 60 24)'), env)
+    86400
+    >>> print(optimize(read_line("(let ((x 1)) (if (< 1 2) (+ x (car '(3 4))) (f)))"), env))
+    (let ((x 1)) (+ x 3))
+
+如果基本过程的名字已经被define重新绑定，或者在表达式中被重新绑定，
+则不折叠对它的调用：
+
+    >>> scheme_eval(read_line('(define (* a b) 0)'), env)
+    '*'
+    >>> print(optimize(read_line('(* 60 60 24)'), env))
+    (* 60 60 24)
+    >>> print(optimize(read_line('(let ((+ -)) (+ 1 2))'), env))
+    (let ((+ -)) (+ 1 2))
+
+函数体在之后才求值，那时基本过程的名字可能已经被重新绑定。函数体中
+折叠的表达式与原来的表达式一起保存在#folded特殊形式中，运行时先检查
+所依赖的绑定（见FoldGuard）：
+
+    >>> print(optimize(read_line('(define (f) (- 5 2))'), env))
+    (define (f) (#folded #[guard -] 3 (- 5 2)))
+    >>> optimizing_eval(scheme_eval)(read_line('(define (f) (- 5 2))'), env)
+    'f'
+    >>> scheme_eval(read_line('(f)'), env)
+    3
+    >>> scheme_eval(read_line('(define - +)'), env)
+    '-'
+    >>> scheme_eval(read_line('(f)'), env)
+    7
+
+环境中已经定义的宏在优化时展开，展开结果再继续优化：
+
+    >>> scheme_eval(read_line('(define-macro (twice x) `(+ ,x ,x))'), env)
+    'twice'
+    >>> print(optimize(read_line('(lambda (y) (twice (car y)))'), env))
+    (lambda (y) (+ (car y) (car y)))
+    >>> optimize(read_line("(twice (car '(9 8)))"), env)
+    18
+"""
+
+from sugon.edu.scheme import *
+
+# 没有副作用、结果只取决于参数的基本过程
+PURE_PRIMITIVES = {
+    '+', '-', '*', '/', '=', '<', '>', '<=', '>=', 'abs', 'expt',
+    'quotient', 'modulo', 'remainder', 'even?', 'odd?', 'zero?', 'not',
+    'car', 'cdr', 'length', 'eq?', 'equal?', 'null?', 'pair?', 'list?',
+    'atom?', 'boolean?', 'number?', 'integer?', 'string?', 'symbol?',
+    'acos', 'acosh', 'asin', 'asinh', 'atan', 'atan2', 'atanh', 'ceil',
+    'copysign', 'cos', 'cosh', 'degrees', 'floor', 'log', 'log10', 'log1p',
+    'log2', 'radians', 'sin', 'sinh', 'sqrt', 'tan', 'tanh', 'trunc',
+}
+
+_PRIMITIVE_FNS = {name: fn for name, fn, _ in PRIMITIVES
+                  if name in PURE_PRIMITIVES}
+
+
+def optimizing_eval(evaluate):
+    """返回一个求值函数：先优化表达式，再使用evaluate求值。"""
+    def optimized_eval(expr, env):
+        return evaluate(optimize(expr, env), env)
+    return optimized_eval
+
+
+def optimize(expr, env):
+    """返回优化后的表达式expr，expr将在环境env中求值。"""
+    rebound = set()
+    find_bindings(expr, rebound)
+    # 名字 -> 纯基本过程的Python函数，或者在优化时展开的宏
+    pure = {}
+    for name, fn in _PRIMITIVE_FNS.items():
+        if name not in rebound and is_bound_to(env, name, fn):
+            pure[name] = fn
+    for name in macro_names(expr):
+        macro = lookup_macro(name, env)
+        if macro is not None and name not in rebound:
+            pure[name] = macro
+    # env不是全局环境时，外层Frame中的define不改变env的version，
+    # 无法检查函数体中折叠的结果是否仍然有效，所以不折叠函数体
+    guard = None
+    if isinstance(env, Frame) and env.parent is None:
+        guard = FoldGuard(env)
+    return optimize_expression(expr, pure, Context(guard, False))
+
+
+class FoldGuard:
+    """函数体中折叠的结果仍然有效的条件：折叠时用到的基本过程的名字在全局
+    环境env中仍然绑定到原来的基本过程。
+
+    env的version在每次define时改变，只有这时才重新检查这些名字。"""
+
+    def __init__(self, env):
+        self.env = env
+        self.version = env.version
+        self.names = {}  # 名字 -> 基本过程的Python函数
+        self.ok = True
+
+    def depend(self, name, fn):
+        self.names[name] = fn
+
+    def valid(self):
+        if self.version != self.env.version:
+            self.ok = all(is_bound_to(self.env, name, fn)
+                          for name, fn in self.names.items())
+            self.version = self.env.version
+        return self.ok
+
+    def __str__(self):
+        return '#[guard {0}]'.format(' '.join(sorted(self.names)))
+
+
+class Context:
+    """优化一个表达式时的上下文。
+
+    guard: 本次优化的FoldGuard，None表示不折叠函数体
+    deferred: 表达式是否在函数体中，即之后才求值"""
+
+    __slots__ = ('guard', 'deferred')
+
+    def __init__(self, guard, deferred):
+        self.guard = guard
+        self.deferred = deferred
+
+
+def guarded(expr, folded, context):
+    """返回在上下文context中代替表达式expr的折叠结果folded。
+
+    函数体中的折叠结果用FOLDED特殊形式保护，条件不成立时求值expr。"""
+    if not context.deferred:
+        return folded
+    return scheme_list(FOLDED, context.guard, folded, expr)
+
+
+def macro_names(expr):
+    """返回表达式中所有可能是宏调用的名字（复合表达式的第一个符号）。"""
+    names, stack = set(), [expr]
+    while stack:
+        expr = stack.pop()
+        while isinstance(expr, Pair):
+            if scheme_symbolp(expr.first):
+                names.add(expr.first)
+            stack.append(expr.first)
+            expr = expr.second
+    return names
+
+
+def is_bound_to(env, name, fn):
+    """name在环境env中是否仍然绑定到以fn实现的基本过程。"""
+    try:
+        value = env.lookup(name)
+    except SchemeError:
+        return False
+    return isinstance(value, PrimitiveProcedure) and value.fn is fn
+
+
+def find_bindings(expr, names):
+    """找出表达式中被define、lambda或let绑定的所有名字，加入集合names。"""
+    while isinstance(expr, Pair):
+        first, rest = expr.first, expr.second
+        if first == 'quote':
+            return
+        if (first in ('define', 'define-memo', 'define-macro', 'lambda') and
+                isinstance(rest, Pair)):
+            target = rest.first
+            if scheme_symbolp(target):
+                names.add(target)
+            while isinstance(target, Pair):
+                if scheme_symbolp(target.first):
+                    names.add(target.first)
+                target = target.second
+        elif first == 'let' and isinstance(rest, Pair):
+            bindings = rest.first
+            while isinstance(bindings, Pair):
+                binding = bindings.first
+                if isinstance(binding, Pair) and scheme_symbolp(binding.first):
+                    names.add(binding.first)
+                bindings = bindings.second
+        find_bindings(first, names)
+        expr = rest
+
+
+def constant_value(expr):
+    """如果expr是常量表达式，返回(True, 值)，否则返回(False, None)。
+
+    FOLDED特殊形式的值是折叠的结果。"""
+    if scheme_symbolp(expr):
+        return False, None
+    elif self_evaluating(expr):
+        return True, expr
+    elif isinstance(expr, Pair) and isinstance(expr.second, Pair):
+        if expr.first == 'quote' and expr.second.second is nil:
+            return True, expr.second.first
+        elif expr.first is FOLDED:
+            return constant_value(expr.second.second.first)
+    return False, None
+
+
+def as_expression(value):
+    """返回求值结果为value的表达式。"""
+    if scheme_symbolp(value) or isinstance(value, Pair):
+        return scheme_list(Symbol('quote'), value)
+    return value
+
+
+def optimize_expression(expr, pure, context):
+    """在上下文context中优化表达式expr。"""
+    if not isinstance(expr, Pair) or not scheme_listp(expr):
+        return expr
+    first = expr.first
+    if not scheme_symbolp(first) or first == 'quote':
+        return expr
+    elif first == 'if':
+        return optimize_if(expr, pure, context)
+    elif first in ('define', 'define-memo', 'lambda'):
+        # 保留define的目标和lambda的形式参数
+        if not isinstance(expr.second, Pair):
+            return expr
+        rest = expr.second
+        if first != 'define' or not scheme_symbolp(rest.first):
+            # 函数体在之后才求值
+            if context.guard is None:
+                return expr
+            context = Context(context.guard, True)
+        return Pair(first, Pair(rest.first, optimize_all(rest.second, pure, context)))
+    elif first == 'let':
+        if not isinstance(expr.second, Pair) or not scheme_listp(expr.second.first):
+            return expr
+        bindings = expr.second.first.map(
+            lambda b: optimize_binding(b, pure, context))
+        return Pair(first, Pair(bindings, optimize_all(expr.second.second, pure, context)))
+    elif first == 'cond':
+        clauses = expr.second.map(
+            lambda c: optimize_all(c, pure, context) if scheme_listp(c) else c)
+        return Pair(first, clauses)
+    elif first in ('begin', 'and', 'or'):
+        return Pair(first, optimize_all(expr.second, pure, context))
+    elif first in SPECIAL_FORMS:
+        return expr
+    elif isinstance(pure.get(first), MacroProcedure):
+        try:
+            expansion = pure[first].expand(expr.second)
+        except SchemeError:
+            return expr  # 留到求值时报错
+        return optimize_expression(expansion, pure, context)
+    operands = optimize_all(expr.second, pure, context)
+    call = Pair(first, operands)
+    if first in pure:
+        folded = fold_call(call, pure[first])
+        if folded is not call:
+            if context.deferred:
+                context.guard.depend(first, pure[first])
+            return guarded(expr, folded, context)
+    return call
+
+
+def optimize_all(expressions, pure, context):
+    return expressions.map(lambda e: optimize_expression(e, pure, context))
+
+
+def optimize_binding(binding, pure, context):
+    if scheme_listp(binding) and len(binding) == 2:
+        return scheme_list(binding.first,
+                           optimize_expression(binding.second.first, pure, context))
+    return binding
+
+
+def optimize_if(expr, pure, context):
+    """优化if表达式；条件为常量时只保留对应的分支。"""
+    if not scheme_listp(expr.second) or not 2 <= len(expr.second) <= 3:
+        return expr
+    parts = optimize_all(expr.second, pure, context)
+    is_constant, test = constant_value(parts.first)
+    if not is_constant:
+        return Pair(expr.first, parts)
+    if scheme_truep(test):
+        branch = parts.second.first
+    elif parts.second.second is not nil:
+        branch = parts.second.second.first
+    else:
+        return Pair(expr.first, parts)
+    if constant_value(expr.second.first)[0]:
+        return branch  # 条件本来就是常量，不依赖折叠的结果
+    return guarded(expr, branch, context)
+
+
+def fold_call(expr, fn):
+    """如果基本过程调用expr的参数都是常量，返回调用结果的表达式。
+
+    调用出错或者结果无法表示为表达式时，不折叠，返回expr本身，
+    留到求值时处理。"""
+    args = []
+    operands = expr.second
+    while operands is not nil:
+        is_constant, value = constant_value(operands.first)
+        if not is_constant:
+            return expr
+        args.append(value)
+        operands = operands.second
+    try:
+        value = fn(*args)
+    except Exception:
+        return expr
+    if value is None:
+        return expr
+    return as_expression(value)
@@ -2,10 +2,18 @@
 
 """本模块实现了Scheme语言的基本操作过程。"""
 
+import inspect
 import math
 import operator
 import sys
-from sugon.edu.scheme_reader import Pair, nil
+from sugon.edu.scheme_reader import Pair, Vector, nil, Symbol
+from sugon.edu.scheme_tokens import String
+
+# 数值数组（array-xxx系列基本过程）需要NumPy，没有安装时这些过程会报错
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class SchemeError(Exception):
@@ -27,6 +35,34 @@ def primitive(*names):
     return add
 
 
+def primitive_arity(fn):
+    """返回Python函数fn接受的参数个数范围(最少个数, 最多个数)。
+
+    最多个数为None表示可以接受任意多个参数。
+
+    >>> primitive_arity(scheme_cons)
+    (2, 2)
+    >>> primitive_arity(scheme_sub)
+    (1, None)
+    >>> primitive_arity(scheme_error)
+    (0, 1)
+    """
+    try:
+        parameters = inspect.signature(fn).parameters.values()
+    except (TypeError, ValueError):
+        return 0, None
+    min_args, max_args = 0, 0
+    for param in parameters:
+        if param.kind == param.VAR_POSITIONAL:
+            max_args = None
+        elif param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+            if param.default is param.empty:
+                min_args += 1
+            if max_args is not None:
+                max_args += 1
+    return min_args, max_args
+
+
 def check_type(val, predicate, k, name):
     if not predicate(val):
         msg = "argument {0} of {1} has wrong type ({2})"
@@ -58,17 +94,49 @@ def scheme_equalp(x, y):
         return scheme_equalp(x.first, y.first) and scheme_equalp(x.second, y.second)
     elif scheme_numberp(x) and scheme_numberp(y):
         return x == y
+    elif scheme_vectorp(x) and scheme_vectorp(y):
+        return (len(x.items) == len(y.items) and
+                all(map(scheme_equalp, x.items, y.items)))
+    elif scheme_arrayp(x) and scheme_arrayp(y):
+        return bool(numpy.array_equal(x.data, y.data))
     else:
         return type(x) == type(y) and x == y
 
 
+def structural_key(value):
+    """返回value的可哈希的键，equal?的两个值的键相等。
+
+    Pair按结构转换为tuple；布尔值单独标记，避免#t与1的键相等。
+
+    >>> a = Pair(1, Pair(Pair(2, nil), nil))
+    >>> b = Pair(1.0, Pair(Pair(2, nil), nil))
+    >>> structural_key(a) == structural_key(b)
+    True
+    >>> structural_key(Pair(1, 2)) == structural_key(Pair(1, Pair(2, nil)))
+    False
+    >>> structural_key(True) == structural_key(1)
+    False
+    """
+    if type(value) is bool:
+        return (bool, value)
+    elif isinstance(value, Pair):
+        items = [Pair]
+        while isinstance(value, Pair):
+            items.append(structural_key(value.first))
+            value = value.second
+        items.append(structural_key(value))
+        return tuple(items)
+    elif isinstance(value, Vector):
+        return (Vector,) + tuple(map(structural_key, value.items))
+    return value
+
+
 @primitive("eq?")
 def scheme_eqp(x, y):
     if scheme_numberp(x) and scheme_numberp(y):
         return x == y
-    elif scheme_symbolp(x) and scheme_symbolp(y):
-        return x == y
     else:
+        # 符号是interned的，名字相同的符号是同一个对象
         return x is y
 
 
@@ -143,14 +211,170 @@ def scheme_append(*vals):
     return result
 
 
+@primitive("vector?")
+def scheme_vectorp(x):
+    return isinstance(x, Vector)
+
+
+def _check_index(v, k, name):
+    """检查k是vector v的有效下标。"""
+    check_type(k, lambda x: type(x) is int, 1, name)
+    if not 0 <= k < len(v.items):
+        raise SchemeError('index {0} out of range for {1}'.format(k, name))
+
+
+@primitive("make-vector")
+def scheme_make_vector(k, fill=0):
+    check_type(k, lambda x: type(x) is int and x >= 0, 0, 'make-vector')
+    return Vector([fill] * k)
+
+
+@primitive("vector")
+def scheme_vector(*vals):
+    return Vector(list(vals))
+
+
+@primitive("vector-ref")
+def scheme_vector_ref(v, k):
+    check_type(v, scheme_vectorp, 0, 'vector-ref')
+    _check_index(v, k, 'vector-ref')
+    return v.items[k]
+
+
+@primitive("vector-set!")
+def scheme_vector_set(v, k, obj):
+    check_type(v, scheme_vectorp, 0, 'vector-set!')
+    _check_index(v, k, 'vector-set!')
+    v.items[k] = obj
+
+
+@primitive("vector-length")
+def scheme_vector_length(v):
+    check_type(v, scheme_vectorp, 0, 'vector-length')
+    return len(v.items)
+
+
+@primitive("vector->list")
+def scheme_vector_to_list(v):
+    check_type(v, scheme_vectorp, 0, 'vector->list')
+    return scheme_list(*v.items)
+
+
+@primitive("list->vector")
+def scheme_list_to_vector(x):
+    check_type(x, scheme_listp, 0, 'list->vector')
+    items = []
+    while x is not nil:
+        items.append(x.first)
+        x = x.second
+    return Vector(items)
+
+
+@primitive("vector-fill!")
+def scheme_vector_fill(v, fill):
+    check_type(v, scheme_vectorp, 0, 'vector-fill!')
+    v.items[:] = [fill] * len(v.items)
+
+
+class HashTable:
+    """Scheme的哈希表，使用Python的dict实现。
+
+    key_fn把Scheme的值转换为dict的键：eq?表使用_eq_key，
+    equal?表使用structural_key。dict中保存(原来的键, 值)。
+
+    >>> table = HashTable(structural_key)
+    >>> scheme_hash_set(table, Pair(1, nil), 'a')
+    >>> scheme_hash_ref(table, Pair(1.0, nil))
+    'a'
+    """
+    __slots__ = ('key_fn', 'entries')
+
+    def __init__(self, key_fn):
+        self.key_fn = key_fn
+        self.entries = {}
+
+    def __str__(self):
+        return '#[hash-table]'
+
+
+def _eq_key(value):
+    """返回value在eq?哈希表中的键。
+
+    数字、符号和字符串按值比较，Pair和vector按对象本身比较。"""
+    if type(value) is bool:
+        return (bool, value)
+    elif isinstance(value, (Pair, Vector)):
+        return (id, id(value))
+    return value
+
+
+@primitive("make-hash-table")
+def scheme_make_hash_table():
+    return HashTable(_eq_key)
+
+
+@primitive("make-equal-hash-table")
+def scheme_make_equal_hash_table():
+    return HashTable(structural_key)
+
+
+@primitive("hash-table?")
+def scheme_hash_tablep(x):
+    return isinstance(x, HashTable)
+
+
+def _hash_key(table, key, name):
+    check_type(table, scheme_hash_tablep, 0, name)
+    return table.key_fn(key)
+
+
+# hash-ref没有给出默认值
+_NO_DEFAULT = object()
+
+
+@primitive("hash-ref")
+def scheme_hash_ref(table, key, default=_NO_DEFAULT):
+    k = _hash_key(table, key, 'hash-ref')
+    entry = table.entries.get(k)
+    if entry is not None:
+        return entry[1]
+    elif default is not _NO_DEFAULT:
+        return default
+    raise SchemeError('key not found: {0}'.format(key))
+
+
+@primitive("hash-set!")
+def scheme_hash_set(table, key, value):
+    k = _hash_key(table, key, 'hash-set!')
+    table.entries[k] = (key, value)
+
+
+@primitive("hash-remove!")
+def scheme_hash_remove(table, key):
+    k = _hash_key(table, key, 'hash-remove!')
+    table.entries.pop(k, None)
+
+
+@primitive("hash-count")
+def scheme_hash_count(table):
+    check_type(table, scheme_hash_tablep, 0, 'hash-count')
+    return len(table.entries)
+
+
+@primitive("hash-keys")
+def scheme_hash_keys(table):
+    check_type(table, scheme_hash_tablep, 0, 'hash-keys')
+    return scheme_list(*[key for key, _ in table.entries.values()])
+
+
 @primitive("string?")
 def scheme_stringp(x):
-    return isinstance(x, str) and x.startswith('"')
+    return isinstance(x, String)
 
 
 @primitive("symbol?")
 def scheme_symbolp(x):
-    return isinstance(x, str) and not scheme_stringp(x)
+    return isinstance(x, Symbol)
 
 
 @primitive("number?")
@@ -165,29 +389,80 @@ def scheme_integerp(x):
 
 def _check_nums(*vals):
     """检查确保vals中的所有参数都是数字。"""
+    for v in vals:
+        if type(v) is not int and type(v) is not float:
+            break
+    else:
+        # 常见情况：参数都是int或float
+        return
     for i, v in enumerate(vals):
         if not scheme_numberp(v):
             msg = "operand {0} ({1}) is not a number"
             raise SchemeError(msg.format(i, v))
 
 
+def _all_ints(vals):
+    """vals中的所有参数是否都是int（不包括bool）。"""
+    for v in vals:
+        if type(v) is not int:
+            return False
+    return True
+
+
+def _all_floats(vals):
+    """vals中的所有参数是否都是float。"""
+    for v in vals:
+        if type(v) is not float:
+            return False
+    return True
+
+
+def _float_result(s):
+    """同_arith对float结果s的处理：值为整数时返回int。
+
+    inf和nan与_arith一样由round抛出错误。"""
+    if s.is_integer():
+        return int(s)
+    if not math.isfinite(s):
+        round(s)
+    return s
+
+
 def _arith(fn, init, vals):
     _check_nums(*vals)
     s = init
     for val in vals:
         s = fn(s, val)
-    if round(s) == s:
+    # 整数的round是它自身，不需要再计算
+    if type(s) is not int and round(s) == s:
         s = round(s)
     return s
 
 
 @primitive("+")
 def scheme_add(*vals):
+    """
+    >>> scheme_add(1, 2, 3), scheme_add(1.5, 2.5), scheme_add(0.1, 0.2)
+    (6, 4, 0.30000000000000004)
+    """
+    if _all_ints(vals):
+        return sum(vals)
+    if _all_floats(vals):
+        s = vals[0]
+        for val in vals[1:]:
+            s += val
+        return _float_result(s)
     return _arith(operator.add, 0, vals)
 
 
 @primitive("-")
 def scheme_sub(val0, *vals):
+    if type(val0) is int and _all_ints(vals):
+        return val0 - sum(vals) if vals else -val0
+    if type(val0) is float and vals and _all_floats(vals):
+        for val in vals:
+            val0 -= val
+        return _float_result(val0)
     _check_nums(val0, *vals) # fixes off-by-one error
     if len(vals) == 0:
         return -val0
@@ -196,11 +471,25 @@ def scheme_sub(val0, *vals):
 
 @primitive("*")
 def scheme_mul(*vals):
+    if _all_ints(vals):
+        return math.prod(vals)
+    if _all_floats(vals):
+        s = vals[0]
+        for val in vals[1:]:
+            s *= val
+        return _float_result(s)
     return _arith(operator.mul, 1, vals)
 
 
 @primitive("/")
 def scheme_div(val0, *vals):
+    if type(val0) is float and vals and _all_floats(vals):
+        try:
+            for val in vals:
+                val0 /= val
+        except ZeroDivisionError as err:
+            raise SchemeError(err)
+        return _float_result(val0)
     _check_nums(val0, *vals) # fixes off-by-one error
     try:
         if len(vals) == 0:
@@ -296,6 +585,20 @@ def scheme_ge(x, y):
     return _numcomp(operator.ge, x, y)
 
 
+# 两个参数都是int时，结果等于直接使用运算符计算的基本过程
+# scheme模块的PrimitiveProcedure.eval_call对这种调用不再调用基本过程本身
+INT_BINARY_OPS = {
+    scheme_add: operator.add,
+    scheme_sub: operator.sub,
+    scheme_mul: operator.mul,
+    scheme_eq: operator.eq,
+    scheme_lt: operator.lt,
+    scheme_gt: operator.gt,
+    scheme_le: operator.le,
+    scheme_ge: operator.ge,
+}
+
+
 @primitive("even?")
 def scheme_evenp(x):
     _check_nums(x)
@@ -347,3 +650,180 @@ def scheme_error(msg=None):
 @primitive("exit")
 def scheme_exit():
     raise EOFError
+
+
+class Array:
+    """NumPy实现的数值数组，运算按整个数组进行。
+
+    整数数组使用int64保存，超出范围时会溢出，这一点与Scheme的整数不同。
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return '#[array {0}]'.format(self.data)
+
+
+def _check_numpy(name):
+    if numpy is None:
+        raise SchemeError('{0} requires NumPy, which is not installed'.format(name))
+
+
+def _array_number(x):
+    """将NumPy的数转换为Scheme的数，与_arith相同，值为整数的float转换为int。"""
+    x = x.item()
+    if type(x) is float and x.is_integer():
+        return int(x)
+    return x
+
+
+def _array_operand(x, k, name):
+    """返回算术运算的操作数：Array的数据或者一个Scheme的数。"""
+    _check_numpy(name)
+    if scheme_arrayp(x):
+        return x.data
+    check_type(x, scheme_numberp, k, name)
+    return x
+
+
+def _array_result(value):
+    if isinstance(value, numpy.ndarray):
+        return Array(value)
+    return _array_number(value)
+
+
+def _to_array(items, name):
+    _check_numpy(name)
+    _check_nums(*items)
+    data = numpy.array(items)
+    if data.dtype.kind not in 'if':
+        # 超出int64范围的整数会得到object数组
+        raise SchemeError('{0}: integer too large for an array'.format(name))
+    return Array(data)
+
+
+@primitive("array?")
+def scheme_arrayp(x):
+    return isinstance(x, Array)
+
+
+@primitive("array-from-list")
+def scheme_array_from_list(x):
+    check_type(x, scheme_listp, 0, 'array-from-list')
+    items = []
+    while x is not nil:
+        items.append(x.first)
+        x = x.second
+    return _to_array(items, 'array-from-list')
+
+
+@primitive("vector->array")
+def scheme_vector_to_array(v):
+    # vector的元素是Python对象，无法与NumPy共享内存，需要复制
+    check_type(v, scheme_vectorp, 0, 'vector->array')
+    return _to_array(v.items, 'vector->array')
+
+
+@primitive("array->list")
+def scheme_array_to_list(a):
+    check_type(a, scheme_arrayp, 0, 'array->list')
+    return scheme_list(*[_array_number(x) for x in a.data])
+
+
+@primitive("array-length")
+def scheme_array_length(a):
+    check_type(a, scheme_arrayp, 0, 'array-length')
+    return len(a.data)
+
+
+def _array_operands(a, b, name):
+    """返回二元运算的两个操作数；两个都是Array时，长度必须相同。"""
+    x, y = _array_operand(a, 0, name), _array_operand(b, 1, name)
+    if scheme_arrayp(a) and scheme_arrayp(b) and x.shape != y.shape:
+        raise SchemeError('{0}: arrays have different lengths'.format(name))
+    return x, y
+
+
+@primitive("array+")
+def scheme_array_add(a, b):
+    return _array_result(numpy.add(*_array_operands(a, b, 'array+')))
+
+
+@primitive("array*")
+def scheme_array_mul(a, b):
+    return _array_result(numpy.multiply(*_array_operands(a, b, 'array*')))
+
+
+@primitive("array-sum")
+def scheme_array_sum(a):
+    check_type(a, scheme_arrayp, 0, 'array-sum')
+    return _array_number(a.data.sum())
+
+
+@primitive("array-dot")
+def scheme_array_dot(a, b):
+    check_type(a, scheme_arrayp, 0, 'array-dot')
+    check_type(b, scheme_arrayp, 1, 'array-dot')
+    if len(a.data) != len(b.data):
+        raise SchemeError('array-dot: arrays have different lengths')
+    return _array_number(numpy.dot(a.data, b.data))
+
+
+@primitive("array-slice")
+def scheme_array_slice(a, start, end, step=1):
+    """返回a中下标从start到end（不包括）的元素，结果与a共享内存，不复制。"""
+    check_type(a, scheme_arrayp, 0, 'array-slice')
+    check_type(start, lambda x: type(x) is int, 1, 'array-slice')
+    check_type(end, lambda x: type(x) is int, 2, 'array-slice')
+    check_type(step, lambda x: type(x) is int and x != 0, 3, 'array-slice')
+    return Array(a.data[start:end:step])
+
+
+# 可以在array-map中按整个数组计算的基本过程：Scheme名字 -> NumPy函数名字
+_ARRAY_UFUNC_NAMES = {
+    'abs': 'absolute', 'acos': 'arccos', 'acosh': 'arccosh',
+    'asin': 'arcsin', 'asinh': 'arcsinh', 'atan': 'arctan',
+    'atanh': 'arctanh', 'ceil': 'ceil', 'cos': 'cos', 'cosh': 'cosh',
+    'degrees': 'degrees', 'floor': 'floor', 'log': 'log', 'log10': 'log10',
+    'log1p': 'log1p', 'log2': 'log2', 'radians': 'radians', 'sin': 'sin',
+    'sinh': 'sinh', 'sqrt': 'sqrt', 'tan': 'tan', 'tanh': 'tanh',
+    'trunc': 'trunc',
+}
+
+# 基本过程的Python函数 -> NumPy函数名字
+_ARRAY_UFUNCS = {fn: _ARRAY_UFUNC_NAMES[name] for name, fn, _ in PRIMITIVES
+                 if name in _ARRAY_UFUNC_NAMES}
+
+
+@primitive("array-map")
+def scheme_array_map(f, a):
+    check_type(a, scheme_arrayp, 1, 'array-map')
+    ufunc_name = _ARRAY_UFUNCS.get(getattr(f, 'fn', None))
+    if ufunc_name is None:
+        raise SchemeError('array-map: {0} cannot be applied to a whole array'.format(f))
+    with numpy.errstate(invalid='raise', divide='raise'):
+        try:
+            return Array(getattr(numpy, ufunc_name)(a.data))
+        except FloatingPointError as err:
+            raise SchemeError('array-map: {0}'.format(err))
+
+
+# 没有安装NumPy时跳过数组的doctest
+if numpy is not None:
+    __test__ = {'array': """
+    >>> a = scheme_array_from_list(Pair(1, Pair(2, Pair(3, nil))))
+    >>> print(scheme_array_add(a, a), scheme_array_mul(a, 0.5))
+    #[array [2 4 6]] #[array [0.5 1.  1.5]]
+    >>> scheme_array_sum(scheme_array_mul(2, a)), scheme_array_dot(a, a)
+    (12, 14)
+    >>> scheme_array_add(a, scheme_array_slice(a, 0, 2))
+    Traceback (most recent call last):
+        ...
+    sugon.edu.scheme_primitives.SchemeError: array+: arrays have different lengths
+    >>> scheme_array_mul(a, Pair(1, nil))
+    Traceback (most recent call last):
+        ...
+    sugon.edu.scheme_primitives.SchemeError: argument 1 of array* has wrong type (Pair)
+    """}
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""按Scheme过程统计运行时间的profiler。
+
+install之后，scheme模块中的scheme_eval、complete_apply以及过程的应用
+被替换为带有统计的版本；uninstall恢复原来的函数。没有安装时不影响求值速度。
+
+每个过程统计：
+  * 调用次数
+  * 总时间：从进入过程到过程返回（递归调用只计算最外层的一次）
+  * 自身时间：总时间中减去调用其他过程的时间
+  * 分配次数：过程自身执行期间创建的Pair和Frame的个数
+
+尾调用会替换当前过程：(define (f) (g))中，f在调用g时就已经结束。
+
+    >>> profiler = Profiler()
+    >>> profiler.install()
+    >>> env = create_global_frame()
+    >>> evaluate = scheme.scheme_eval
+    >>> evaluate(read_line('(define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))'), env)
+    'fib'
+    >>> evaluate(read_line('(fib 10)'), env)
+    55
+    >>> profiler.uninstall()
+    >>> stats = {s['name']: s for s in profiler.results(env)}
+    >>> stats['fib']['calls'], stats['+']['calls']
+    (177, 88)
+"""
+
+import functools
+import json
+import sys
+import time
+
+import sugon.edu.scheme as scheme
+from sugon.edu.scheme import *
+
+
+class ProcedureStats:
+    """一个过程的统计数据。"""
+
+    __slots__ = ('calls', 'inclusive', 'exclusive', 'allocations')
+
+    def __init__(self):
+        self.calls = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        self.allocations = 0
+
+
+class Profiler:
+    """记录每个Scheme过程的调用次数、时间和分配次数。"""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stats = {}    # 过程 -> ProcedureStats
+        self.stack = []    # 正在执行的过程：(过程, 进入的时间)
+        self.bases = [0]   # 每一层求值循环开始时stack的长度
+        self.active = {}   # 过程 -> 在stack中出现的次数
+        self.current = None  # stack顶部过程的ProcedureStats
+        self.last = None
+        self.saved = None
+
+    def switch(self):
+        """将上次切换以来的时间计入当前过程的自身时间，返回当前时间。"""
+        now = self.clock()
+        if self.current is not None:
+            self.current.exclusive += now - self.last
+        self.last = now
+        return now
+
+    def enter(self, procedure):
+        now = self.switch()
+        stats = self.stats.get(procedure)
+        if stats is None:
+            stats = self.stats[procedure] = ProcedureStats()
+        stats.calls += 1
+        self.stack.append((procedure, now))
+        self.active[procedure] = self.active.get(procedure, 0) + 1
+        self.current = stats
+
+    def leave(self, depth):
+        """结束stack中下标不小于depth的过程。"""
+        if len(self.stack) <= depth:
+            return
+        now = self.switch()
+        while len(self.stack) > depth:
+            procedure, start = self.stack.pop()
+            self.active[procedure] -= 1
+            if self.active[procedure] == 0:
+                self.stats[procedure].inclusive += now - start
+        if self.stack:
+            self.current = self.stats[self.stack[-1][0]]
+        else:
+            self.current = None
+
+    def allocate(self):
+        if self.current is not None:
+            self.current.allocations += 1
+
+    def install(self):
+        """替换scheme模块中的函数，开始统计。"""
+        original_eval = scheme.scheme_eval.__wrapped__
+        lambda_apply = LambdaProcedure.apply
+        primitive_call = PrimitiveProcedure.call
+        pair_init, frame_init = Pair.__init__, Frame.__init__
+        profiler, stack, bases = self, self.stack, self.bases
+
+        def run_thunks(result):
+            while isinstance(result, Thunk):
+                result = original_eval(result.expr, result.env)
+            return result
+
+        def profiled_eval(expr, env, tail=False):
+            if tail and not scheme_symbolp(expr) and not self_evaluating(expr):
+                return Thunk(expr, env)
+            depth = len(stack)
+            bases.append(depth)
+            try:
+                return run_thunks(Thunk(expr, env))
+            finally:
+                bases.pop()
+                profiler.leave(depth)
+
+        def profiled_complete_apply(procedure, args, env):
+            depth = len(stack)
+            bases.append(depth)
+            try:
+                return run_thunks(scheme_apply(procedure, args, env))
+            finally:
+                bases.pop()
+                profiler.leave(depth)
+
+        def profiled_apply(procedure, args, env):
+            # 同一层求值循环中之前进入的过程，被这次尾调用替换
+            profiler.leave(bases[-1])
+            profiler.enter(procedure)
+            return lambda_apply(procedure, args, env)
+
+        def profiled_call(procedure, args, env):
+            depth = len(stack)
+            profiler.enter(procedure)
+            bases.append(depth + 1)
+            try:
+                return primitive_call(procedure, args, env)
+            finally:
+                bases.pop()
+                profiler.leave(depth)
+
+        def profiled_eval_call(procedure, operands, env):
+            # 不使用直接计算两个int参数的快速路径，使所有调用都经过call
+            args = []
+            while operands is not nil:
+                args.append(eval_operand(operands.first, env))
+                operands = operands.second
+            return procedure.call(args, env)
+
+        def counting_pair_init(pair, first, second):
+            pair_init(pair, first, second)
+            profiler.allocate()
+
+        def counting_frame_init(frame, parent):
+            frame_init(frame, parent)
+            profiler.allocate()
+
+        self.saved = (scheme.scheme_eval, scheme.complete_apply,
+                      lambda_apply, primitive_call,
+                      PrimitiveProcedure.__dict__['eval_call'],
+                      pair_init, frame_init)
+        scheme.scheme_eval = functools.wraps(original_eval)(profiled_eval)
+        scheme.complete_apply = profiled_complete_apply
+        LambdaProcedure.apply = profiled_apply
+        PrimitiveProcedure.call = profiled_call
+        PrimitiveProcedure.eval_call = profiled_eval_call
+        Pair.__init__ = counting_pair_init
+        Frame.__init__ = counting_frame_init
+        self.last = self.clock()
+
+    def uninstall(self):
+        """恢复scheme模块中原来的函数，结束统计。"""
+        self.leave(0)
+        (scheme.scheme_eval, scheme.complete_apply,
+         LambdaProcedure.apply, PrimitiveProcedure.call,
+         PrimitiveProcedure.eval_call,
+         Pair.__init__, Frame.__init__) = self.saved
+
+    def results(self, env):
+        """返回统计结果的list，按自身时间从大到小排列。
+
+        过程的名字在环境env中查找；同名的过程（例如同一个lambda
+        多次创建的闭包）合并在一起。"""
+        names = {}
+        for name, value in env.bindings.items():
+            if isinstance(value, Procedure):
+                names.setdefault(id(value), name)
+        merged = {}
+        for procedure, stats in self.stats.items():
+            name = names.get(id(procedure))
+            if name is None:
+                name = getattr(procedure, 'name', None) or str(procedure)
+                if len(name) > 40:
+                    name = name[:37] + '...'
+            entry = merged.setdefault(name, {
+                'name': name, 'calls': 0, 'inclusive': 0.0,
+                'exclusive': 0.0, 'allocations': 0})
+            entry['calls'] += stats.calls
+            entry['inclusive'] += stats.inclusive
+            entry['exclusive'] += stats.exclusive
+            entry['allocations'] += stats.allocations
+        return sorted(merged.values(), key=lambda e: -e['exclusive'])
+
+    def print_report(self, env, file=sys.stderr):
+        print('{0:>10} {1:>12} {2:>12} {3:>12}  {4}'.format(
+            '调用次数', '总时间(s)', '自身时间(s)', '分配次数', '过程'), file=file)
+        for entry in self.results(env):
+            print('{calls:>10} {inclusive:>12.4f} {exclusive:>12.4f} '
+                  '{allocations:>12}  {name}'.format(**entry), file=file)
+
+    def write_json(self, env, path):
+        with open(path, 'w') as f:
+            json.dump(self.results(env), f, ensure_ascii=False, indent=2)
@@ -2,7 +2,7 @@
 
 """该模块提供了一个用于解析计算器表达式的parser。"""
 
-from sugon.edu.scheme_tokens import tokenize_lines, DELIMITERS
+from sugon.edu.scheme_tokens import tokenize_lines, DELIMITERS, Symbol
 from sugon.edu.scheme_buffer import Buffer, InputReader, LineReader
 
 
@@ -20,6 +20,10 @@ class Nil:
     def map(self, fn):
         return self
 
+    def __reduce__(self):
+        # 序列化后仍然是同一个nil对象
+        return 'nil'
+
 
 nil = Nil()
 
@@ -36,24 +40,34 @@ class Pair:
     (1 2)
     >>> print(s.map(lambda x: x+4))
     (5 6)
+
+    map、==、len和str都不使用递归，很长的list也可以处理：
+
+    >>> s = nil
+    >>> for i in range(100000):
+    ...     s = Pair(i, s)
+    >>> t = s.map(lambda x: x)
+    >>> len(t), s == t
+    (100000, True)
     """
+    __slots__ = ('first', 'second')
+
     def __init__(self, first, second):
         self.first = first
         self.second = second
 
     def __repr__(self):
-        return 'Pair({0}, {1})'.format(
-            repr(self.first), repr(self.second))
-
-    def __str__(self):
-        s = '(' + str(self.first)
-        second = self.second
+        s, depth, second = [], 0, self
         while isinstance(second, Pair):
-            s += ' ' + str(second.first)
+            s.append('Pair({0}, '.format(repr(second.first)))
+            depth += 1
             second = second.second
-        if second is not nil:
-            s += ' . ' + str(second)
-        return s + ')'
+        s.append(repr(second))
+        s.append(')' * depth)
+        return ''.join(s)
+
+    def __str__(self):
+        return to_string(self)
 
     def __len__(self):
         n, second = 1, self.second
@@ -65,17 +79,125 @@ class Pair:
         return n
 
     def __eq__(self, p):
-        if not isinstance(p, Pair):
-            return False
-        return self.first == p.first and self.second == p.second
+        stack = [(self, p)]
+        while stack:
+            x, y = stack.pop()
+            if isinstance(x, Pair):
+                if not isinstance(y, Pair):
+                    return False
+                stack.append((x.second, y.second))
+                stack.append((x.first, y.first))
+            elif isinstance(y, Pair) or not x == y:
+                return False
+        return True
+
+    def __reduce__(self):
+        # 按整个list序列化，避免长list在pickle时递归过深
+        items, second = [], self
+        while isinstance(second, Pair):
+            items.append(second.first)
+            second = second.second
+        return make_list, (items, second)
 
     def map(self, fn):
         """list的每个元素应用函数fn，生成新的list。"""
-        mapped = fn(self.first)
-        if self.second is nil or isinstance(self.second, Pair):
-            return Pair(mapped, self.second.map(fn))
-        else:
+        result = last = Pair(fn(self.first), nil)
+        second = self.second
+        while isinstance(second, Pair):
+            last.second = Pair(fn(second.first), nil)
+            last = last.second
+            second = second.second
+        if second is not nil:
             raise TypeError('无效的list：' + str(self))
+        return result
+
+
+def make_list(items, tail=nil):
+    """使用Python list中的元素构造Scheme list，最后一个Pair的second为tail。"""
+    result = tail
+    for item in reversed(items):
+        result = Pair(item, result)
+    return result
+
+
+class Vector:
+    """Scheme的vector，元素保存在Python的list中，按下标访问是O(1)的。
+
+    >>> v = Vector([1, Pair(2, nil), '"a"'])
+    >>> v
+    Vector([1, Pair(2, nil), '"a"'])
+    >>> print(v)
+    #(1 (2) "a")
+    """
+    __slots__ = ('items',)
+
+    def __init__(self, items):
+        self.items = items
+
+    def __repr__(self):
+        return 'Vector({0})'.format(repr(self.items))
+
+    def __str__(self):
+        return to_string(self)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __eq__(self, v):
+        return isinstance(v, Vector) and self.items == v.items
+
+
+def to_string(value):
+    """返回Scheme值value的打印形式。
+
+    使用显式的栈代替递归，嵌套很深的list和vector也可以打印。"""
+    # 栈中的元素为(是否为文本, 文本或待打印的值)
+    s, stack = [], [(False, value)]
+    while stack:
+        is_text, item = stack.pop()
+        if is_text:
+            s.append(item)
+        elif isinstance(item, Pair):
+            items, second = [], item
+            while isinstance(second, Pair):
+                items.append(second.first)
+                second = second.second
+            stack.append((True, ')'))
+            if second is not nil:
+                stack.append((False, second))
+                stack.append((True, ' . '))
+            push_items(stack, items, '(')
+        elif isinstance(item, Vector):
+            stack.append((True, ')'))
+            push_items(stack, item.items, '#(')
+        else:
+            s.append(str(item))
+    return ''.join(s)
+
+
+def push_items(stack, items, start):
+    """将打印items所需的元素按相反的顺序压入stack，元素之间用空格分隔。"""
+    for i in range(len(items) - 1, 0, -1):
+        stack.append((False, items[i]))
+        stack.append((True, ' '))
+    if items:
+        stack.append((False, items[0]))
+    stack.append((True, start))
+
+
+# 读入复合表达式时，栈中每一层的种类
+_LIST = 'list'          # list，等待下一个元素、句点或)
+_DOTTED = 'dotted'      # 读入了句点的list，等待最后一个元素
+_VECTOR = 'vector'      # vector，等待下一个元素或)
+_QUOTE = 'quote'        # 单引号等，等待被quote的表达式
+
+# 单引号等分界符号 -> 读入为(名字 表达式)时的名字
+_QUOTES = {
+    "'": Symbol('quote'),
+    '`': Symbol('quasiquote'),
+    ',': Symbol('unquote'),
+    ',@': Symbol('unquote-splicing'),
+}
 
 
 def scheme_read(src_buf):
@@ -98,27 +220,17 @@ def scheme_read(src_buf):
     True
     >>> scheme_read(Buffer(tokenize_lines(['(+ 1 2)'])))
     Pair('+', Pair(1, Pair(2, nil)))
+    >>> scheme_read(Buffer(tokenize_lines(['`(a ,b ,@c)'])))
+    Pair('quasiquote', Pair(Pair('a', Pair(Pair('unquote', Pair('b', nil)), Pair(Pair('unquote-splicing', Pair('c', nil)), nil))), nil))
+
+    使用显式的栈代替递归，很长的list和嵌套很深的表达式也可以读入：
+    >>> s = scheme_read(Buffer(tokenize_lines(['(' * 100000 + ')' * 100000])))
+    >>> len(scheme_read(Buffer(tokenize_lines(["'(" + '1 ' * 100000 + ')']))).second.first)
+    100000
     """
     if src_buf.current() is None:
         raise EOFError
-    val = src_buf.remove_front()  # 取得首个token
-    if val == 'nil':
-        return nil
-    elif val == '(':
-        # *** 问题1开始 ***
-        '*** 在这里补充你的代码 ***'
-        return read_tail(src_buf)
-        # *** 问题1结束 ***
-    elif val == "'":
-        # *** 问题6开始 ***
-        '*** 在这里补充你的代码 ***'
-        exp = scheme_read(src_buf)
-        return Pair("quote", Pair(exp, nil))
-        # *** 问题6结束 ***
-    elif val not in DELIMITERS:
-        return val
-    else:
-        raise SyntaxError('不该在此出现的token: {0}'.format(val))
+    return read_expression(src_buf, [])
 
 
 def read_tail(src_buf):
@@ -129,30 +241,95 @@ def read_tail(src_buf):
     nil
     >>> read_tail(Buffer(tokenize_lines(['2 3)'])))
     Pair(2, Pair(3, nil))
+    >>> read_tail(Buffer(tokenize_lines(['2 . 3)'])))
+    Pair(2, 3)
+    """
+    return read_expression(src_buf, [[_LIST, []]])
+
+
+def read_vector(src_buf):
+    """读取vector表达式#(...)的剩余部分。
+
+    >>> read_vector(Buffer(tokenize_lines(['1 (2 3) #(4))'])))
+    Vector([1, Pair(2, Pair(3, nil)), Vector([4])])
     """
+    return read_expression(src_buf, [[_VECTOR, []]])
+
+
+def read_expression(src_buf, stack):
+    """读入一个表达式；stack为空时从头读入，否则读完stack中的复合表达式。
+
+    stack的每一层是[种类, 已读入的元素]。复合表达式中遇到输入结束时，
+    抛出SyntaxError，否则抛出EOFError。"""
     try:
-        if src_buf.current() is None:
-            raise SyntaxError('不完整的表达式')
-        elif src_buf.current() == ')':
-            src_buf.remove_front()
-            return nil
-        elif src_buf.current() == '.':
-            src_buf.remove_front()
-            second = scheme_read(src_buf)
-            if src_buf.current() == ')':
+        return _read_expression(src_buf, stack)
+    except EOFError:
+        for kind, _ in stack:
+            if kind != _QUOTE:
+                raise SyntaxError('不完整的表达式')
+        raise
+
+
+def _read_expression(src_buf, stack):
+    # stack为空时先读入一个表达式；否则先看栈顶的复合表达式是否结束
+    complete = False
+    pending = bool(stack)
+    while True:
+        if not pending:
+            if src_buf.current() is None:
+                raise EOFError
+            val = src_buf.remove_front()
+            if val in _QUOTES:
+                stack.append([_QUOTE, _QUOTES[val]])
+                continue
+            elif val == '(':
+                stack.append([_LIST, []])
+            elif val == '#(':
+                stack.append([_VECTOR, []])
+            elif val == 'nil':
+                value, complete = nil, True
+            elif val not in DELIMITERS:
+                value, complete = val, True
+            else:
+                raise SyntaxError('不该在此出现的token: {0}'.format(val))
+        pending = False
+        # 将读完的表达式加入栈顶的复合表达式，直到需要读入下一个表达式
+        while True:
+            if complete:
+                if not stack:
+                    return value
+                frame = stack[-1]
+                kind = frame[0]
+                if kind == _QUOTE:
+                    stack.pop()
+                    value = Pair(frame[1], Pair(value, nil))
+                    continue
+                elif kind == _DOTTED:
+                    if src_buf.current() != ')':
+                        raise SyntaxError('无效的pair表达式')
+                    src_buf.remove_front()
+                    stack.pop()
+                    value = make_list(frame[1], value)
+                    continue
+                frame[1].append(value)
+                complete = False
+            kind, items = stack[-1]
+            current = src_buf.current()
+            if current == ')':
                 src_buf.remove_front()
-                return second
+                stack.pop()
+                value = make_list(items) if kind == _LIST else Vector(items)
+                complete = True
+            elif current is None:
+                raise SyntaxError('不完整的表达式')
+            elif current == '.':
+                if kind == _VECTOR:
+                    raise SyntaxError('无效的vector表达式')
+                src_buf.remove_front()
+                stack[-1][0] = _DOTTED
+                break
             else:
-                raise SyntaxError('无效的pair表达式')
-        else:
-            # *** 问题1开始 ***
-            '*** 在这里补充你的代码 ***'
-            first = scheme_read(src_buf)
-            second = read_tail(src_buf)
-            return Pair(first, second)
-            # *** 问题1结束 ***
-    except EOFError:
-        raise SyntaxError('不完整的表达式')
+                break
 
 
 def buffer_input(prompt='scm> '):
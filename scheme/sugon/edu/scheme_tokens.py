@@ -9,112 +9,226 @@ token有下列几种：
 
   * 数字：使用int或float表示
   * 布尔类型
-  * symbol（符号）：使用字符串表示
-  * 分界符号：英文小括号、英文句点、英文单引号
+  * symbol（符号）：使用Symbol表示，名字相同的符号是同一个对象
+  * 字符串：使用String表示，内容是包括引号在内的原文
+  * 分界符号：英文小括号、英文句点、英文单引号、vector的开始#(，使用str表示
 """
 
+import re
 import string
 import sys
-import tokenize
+import weakref
 
 _NUMERAL_STARTS = set(string.digits) | set('+-.')
 _SYMBOL_CHARS = (set('!$%&*/:<=>?@^_~') | set(string.ascii_lowercase) |
                  set(string.ascii_uppercase) | _NUMERAL_STARTS)
-_STRING_DELIMS = set('"')
-_WHITESPACE = set(' \t\n\r')
 _SINGLE_CHAR_TOKENS = set("()[]'`")
-_TOKEN_END = _WHITESPACE | _SINGLE_CHAR_TOKENS | _STRING_DELIMS | {',', ',@'}
-DELIMITERS = _SINGLE_CHAR_TOKENS | {'.', ',', ',@'}
+DELIMITERS = _SINGLE_CHAR_TOKENS | {'.', ',', ',@', '#('}
 
+# 每次匹配一个token：先跳过空白，再匹配普通的token（不以;和#开始，
+# 可以包含;和#）、分界符号、以#开始的token、注释、字符串（规则与
+# Python的单行字符串相同）或者单独的引号（无效的字符串）。
+# 最常见的token放在前面。
+_SCANNER = re.compile(r"""[ \t\n\r]*(
+    [^ \t\n\r()\[\]'`",;\#][^ \t\n\r()\[\]'`",]*
+  | [()\[\]'`] | ,@?
+  | \#.?
+  | ;.*
+  | "" | "(?:[^\n"\\]|\\[^\n])*" | "
+)""", re.VERBOSE | re.DOTALL)
 
-def valid_symbol(s):
-    """判断字符串s是否是有效的scheme符号。"""
-    if len(s) == 0:
-        return False
-    for c in s:
-        if c not in _SYMBOL_CHARS:
-            return False
-    return True
-
-
-def next_candidate_token(line, k):
-    """解析下一个token。"""
-    while k < len(line):
-        c = line[k]
-        if c == ';':
-            return None, len(line)
-        elif c in _WHITESPACE:
-            k += 1
-        elif c in _SINGLE_CHAR_TOKENS:
-            if c == ']':
-                c = ')'
-            if c == '[':
-                c = '('
-            return c, k+1
-        elif c == '#':  # 布尔值：#t、#f
-            return line[k:k+2], min(k+2, len(line))
-        elif c == ',':  # ,@
-            if k+1 < len(line) and line[k+1] == '@':
-                return ',@', k+2
-            return c, k+1
-        elif c in _STRING_DELIMS:
-            if k+1 < len(line) and line[k+1] == c:
-                return c+c, k+2
-            line_bytes = (bytes(line[k:], encoding='utf-8'),)
-            gen = tokenize.tokenize(iter(line_bytes).__next__)
-            next(gen)
-            token = next(gen)
-            if token.type != tokenize.STRING:
-                raise ValueError("无效的字符串: {0}".format(token.string))
-            return token.string, token.end[1]+k
-        else:
-            j = k
-            while j < len(line) and line[j] not in _TOKEN_END:
-                j += 1
-            return line[k:j], min(j, len(line))
-    return None, len(line)
+# 不包含引号、逗号、#以及str.split()视为空白的其他字符的行中，
+# token只有普通的token和单个字符的分界符号，在分界符号两边加上空格后，
+# 使用str.split()拆分即可
+_NEEDS_SCANNER = re.compile('[",#\x0b\x0c\x1c-\x1f\x85\xa0\u1680\u2000-\u200a'
+                            '\u2028\u2029\u202f\u205f\u3000]')
+# ;在行首或者这些字符之后时，是注释的开始
+_COMMENT_FOLLOWS = frozenset(" \t\n\r()[]'`")
 
 
-def tokenize_line(line):
-    """从一行字符串中解析出token列表。
 
-    结果中不包含注释和空白字符。
-    返回：list"""
-    result = []
-    text, i = next_candidate_token(line, 0)
-    while text is not None:
-        if text in DELIMITERS:
-            result.append(text)
-        elif text == '#t' or text.lower() == 'true':
-            result.append(True)
-        elif text == '#f' or text.lower() == 'false':
-            result.append(False)
+class Symbol(str):
+    """Scheme的符号。
+
+    符号是interned的：名字相同的Symbol总是同一个对象，所以符号之间
+    可以用is比较，用作dict的键时查找也更快。Symbol是str的子类，
+    打印形式与名字相同。
+
+    >>> Symbol('abc') is Symbol('abc')
+    True
+    >>> Symbol('abc')
+    'abc'
+
+    _SYMBOLS只保存Symbol的弱引用，不再使用的Symbol会被回收，读入很多
+    不同的名字时占用的内存不会一直增长。词法分析时，已经解析过的符号
+    从_TOKENS中直接取得，不经过_SYMBOLS。
+    """
+    __slots__ = ('__weakref__',)
+
+    def __new__(cls, name):
+        ref = _SYMBOLS.get(name)
+        if ref is not None:
+            symbol = ref()
+            if symbol is not None:
+                return symbol
+        return _new_symbol(str(name))
+
+    def __reduce__(self):
+        # 反序列化时通过__new__取得interned的Symbol
+        return Symbol, (str(self),)
+
+
+class _SymbolRef(weakref.ref):
+    """_SYMBOLS中Symbol的弱引用，name是它在_SYMBOLS中的键。"""
+    __slots__ = ('name',)
+
+
+def _forget_symbol(ref):
+    """Symbol被回收时，从_SYMBOLS中删除它的弱引用。"""
+    if _SYMBOLS.get(ref.name) is ref:
+        del _SYMBOLS[ref.name]
+
+
+_SYMBOLS = {}  # 名字 -> Symbol的弱引用（_SymbolRef）
+_new_str = str.__new__
+
+
+def _new_symbol(name):
+    """创建名字为name的Symbol并加入_SYMBOLS，name是str，不在_SYMBOLS中。"""
+    symbol = _new_str(Symbol, name)
+    ref = _SymbolRef(symbol, _forget_symbol)
+    ref.name = name
+    _SYMBOLS[name] = ref
+    return symbol
+
+
+class String(str):
+    """Scheme的字符串，内容是包括引号在内的原文，打印形式不变。
+
+    >>> s = String('"a b"')
+    >>> s, str(s)
+    ('"a b"', '"a b"')
+    """
+    __slots__ = ()
+
+
+_BRACKETS = {'[': '(', ']': ')'}
+_INVALID = object()  # 无效的token，给出警告后忽略
+
+# token的文本 -> token；分界符号以外的部分是已经解析过的token的缓存
+_BASE_TOKENS = dict({d: d for d in DELIMITERS}, **_BRACKETS)
+_BASE_TOKENS.update({'#t': True, '#f': False})
+_TOKENS = dict(_BASE_TOKENS)
+_cached_token = _TOKENS.__getitem__
+_needs_scanner = _NEEDS_SCANNER.search
+_TOKEN_CACHE_SIZE = 1 << 16
+
+
+def valid_symbol(s):
+    """判断字符串s是否是有效的scheme符号。"""
+    return len(s) > 0 and _SYMBOL_CHARS.issuperset(s)
+
+
+def token_value(text):
+    """返回_SCANNER匹配的文本text对应的token。
+
+    无效的字符串、数字或符号抛出ValueError，无效的token返回_INVALID。"""
+    value = _TOKENS.get(text, _INVALID)
+    if value is not _INVALID:
+        return value
+    c = text[0]
+    if c == '"':
+        if text == '"':
+            raise ValueError("无效的字符串: {0}".format(text))
+        value = String(text)
+    elif c == '#':
+        return _INVALID
+    else:
+        lower = text.lower()
+        if lower == 'true':
+            value = True
+        elif lower == 'false':
+            value = False
         elif text == 'nil':
-            result.append(text)
-        elif text[0] in _SYMBOL_CHARS:
-            number = False
-            if text[0] in _NUMERAL_STARTS:
+            value = Symbol(text)
+        elif c not in _SYMBOL_CHARS:
+            return _INVALID
+        else:
+            value = None
+            if c in _NUMERAL_STARTS:
                 try:
-                    result.append(int(text))
-                    number = True
+                    # 包含.的文本不可能是int
+                    value = float(text) if '.' in text else int(text)
                 except ValueError:
                     try:
-                        result.append(float(text))
-                        number = True
+                        value = float(text)
                     except ValueError:
                         pass
-            if not number:
-                if valid_symbol(text):
-                    result.append(text.lower())
-                else:
+            if value is None:
+                if not valid_symbol(text):
                     raise ValueError("无效的数字或符号: {0}".format(text))
-        elif text[0] in _STRING_DELIMS:
-            result.append(text)
-        else:
-            print("warning: 无效的token: {0}".format(text), file=sys.stderr)
-            print("    ", line, file=sys.stderr)
-            print(" " * (i+3), "^", file=sys.stderr)
-        text, i = next_candidate_token(line, i)
+                # 不经过Symbol.__new__，新的名字直接创建Symbol
+                ref = _SYMBOLS.get(lower)
+                value = ref() if ref is not None else None
+                if value is None:
+                    value = _new_symbol(lower)
+    if len(_TOKENS) >= _TOKEN_CACHE_SIZE:
+        _TOKENS.clear()
+        _TOKENS.update(_BASE_TOKENS)
+    _TOKENS[text] = value
+    return value
+
+
+def tokenize_line(line):
+    """从一行字符串中解析出token列表。
+
+    结果中不包含注释和空白字符。
+    返回：list
+
+    >>> tokens = tokenize_line("(define [f x] '#(1 -2.5 #t \\"s\\") ,@x) ; 注释")
+    >>> tokens
+    ['(', 'define', '(', 'f', 'x', ')', "'", '#(', 1, -2.5, True, '"s"', ')', ',@', 'x', ')']
+    >>> [type(token).__name__ for token in tokens[1:5]] + [type(tokens[11]).__name__]
+    ['Symbol', 'str', 'Symbol', 'Symbol', 'String']
+    """
+    if _needs_scanner(line) is None:
+        # token只有普通的token和单个字符的分界符号：去掉注释，在分界符号
+        # 两边加上空格后拆分
+        simple = line
+        if ';' in simple:
+            k = simple.find(';')
+            while k >= 0:
+                if k == 0 or simple[k-1] in _COMMENT_FOLLOWS:
+                    simple = simple[:k]
+                    break
+                k = simple.find(';', k+1)
+        simple = simple.replace('(', ' ( ').replace(')', ' ) ')
+        if '[' in simple or ']' in simple:
+            simple = simple.replace('[', ' [ ').replace(']', ' ] ')
+        if "'" in simple or '`' in simple:
+            simple = simple.replace("'", " ' ").replace('`', ' ` ')
+        texts = simple.split()
+    else:
+        texts = _SCANNER.findall(line)
+        if texts and texts[-1][0] == ';':
+            texts.pop()
+    try:
+        # 所有token都已经解析过时，直接从缓存中取得
+        return list(map(_cached_token, texts))
+    except KeyError:
+        pass
+    result = []
+    for index, text in enumerate(texts):
+        value = _TOKENS.get(text, _INVALID)
+        if value is _INVALID:
+            value = token_value(text)
+        if value is not _INVALID:
+            result.append(value)
+            continue
+        end = list(_SCANNER.finditer(line))[index].end()
+        print("warning: 无效的token: {0}".format(text), file=sys.stderr)
+        print("    ", line, file=sys.stderr)
+        print(" " * (end+3), "^", file=sys.stderr)
     return result
 
 
@@ -123,5 +237,3 @@ def tokenize_lines(lines):
 
     返回：迭代器，每个元素是一个token列表，对应一行文本。"""
     return map(tokenize_line, lines)
-
-
@@ -0,0 +1,655 @@
+# -*- coding: utf-8 -*-
+
+"""Scheme程序的字节码编译器和栈式虚拟机。
+
+vm_compile把scheme_read得到的Pair表达式树编译为扁平的字节码（Code对象），
+execute在一个循环中执行字节码：过程调用把返回点压入显式的调用栈，
+而不是递归调用Python函数，所以求值过程本身不使用Python递归：
+
+    >>> env = create_global_frame()
+    >>> vm_eval(read_line('(define (count n) (if (= n 0) 0 (+ 1 (count (- n 1)))))'), env)
+    'count'
+    >>> vm_eval(read_line('(count 10000)'), env)
+    10000
+
+字节码的每条指令占两个位置：操作码和参数。disassemble用于查看字节码。
+局部变量的词法地址和SlotFrame与scheme_compile模块相同。
+"""
+
+from sugon.edu.scheme import *
+from sugon.edu.scheme_compile import (Scope, SlotFrame, UNASSIGNED,
+                                      RUNTIME_NAMES, scan_defines,
+                                      scope_macro, as_python_list)
+
+# 操作码
+CONST = 0            # 压入常量consts[arg]
+LOAD_LOCAL = 1       # 压入当前Frame的slots[arg]
+LOAD_FREE = 2        # 压入外层Frame的局部变量，词法地址为addresses[arg]
+LOAD_DEFINED = 3     # 同LOAD_FREE，但变量可能尚未被define赋值
+LOAD_GLOBAL = 4      # 压入全局变量names[arg]，结果按版本缓存
+LOAD_NAME = 5        # 沿Frame链按名字查找names[arg]，不缓存
+STORE_LOCAL = 6      # 弹出栈顶，存入当前Frame的slots[arg]
+DEFINE_NAME = 7      # 弹出栈顶，在当前Frame中define名字names[arg]
+POP = 8              # 弹出栈顶
+CHECK_PROCEDURE = 9  # 检查栈顶是否Scheme过程
+CALL = 10            # 调用过程，参数个数为arg
+TAIL_CALL = 11       # 尾调用：调用过程，并用其结果作为当前函数的返回值
+RETURN = 12          # 返回栈顶的值
+JUMP = 13            # 跳转到arg
+POP_JUMP_IF_FALSE = 14    # 弹出栈顶，若为False则跳转到arg
+JUMP_IF_FALSE_OR_POP = 15  # 若栈顶为False则跳转到arg，否则弹出栈顶
+JUMP_IF_TRUE_OR_POP = 16   # 若栈顶不为False则跳转到arg，否则弹出栈顶
+MAKE_CLOSURE = 17    # 使用函数代码consts[arg]创建VMProcedure
+MAKE_LET = 18        # 使用LetInfo consts[arg]，弹出绑定的值，创建新Frame
+LEAVE_LET = 19       # 回到let外层的Frame
+EVAL_FORM = 20       # 使用scheme_eval求值表达式consts[arg]
+RAISE = 21           # 抛出错误consts[arg]
+CHECK_GUARD = 22     # 压入条件consts[arg]是否成立（见scheme_optimize.FoldGuard）
+
+OPNAMES = ['CONST', 'LOAD_LOCAL', 'LOAD_FREE', 'LOAD_DEFINED', 'LOAD_GLOBAL',
+           'LOAD_NAME', 'STORE_LOCAL', 'DEFINE_NAME', 'POP', 'CHECK_PROCEDURE',
+           'CALL', 'TAIL_CALL', 'RETURN', 'JUMP', 'POP_JUMP_IF_FALSE',
+           'JUMP_IF_FALSE_OR_POP', 'JUMP_IF_TRUE_OR_POP', 'MAKE_CLOSURE',
+           'MAKE_LET', 'LEAVE_LET', 'EVAL_FORM', 'RAISE', 'CHECK_GUARD']
+
+MAX_FRAMES = 100000  # 调用栈的最大深度
+
+# define-memo用来包装函数的基本过程
+MEMOIZE = PrimitiveProcedure(scheme_memoize, False, 'memoize')
+
+
+class Code:
+    """一段编译后的字节码：顶层表达式或者一个函数体。"""
+
+    def __init__(self, name, formals=nil, body=nil, scope=None):
+        """
+        name: 名字，用于反汇编
+        formals, body: 函数的形式参数和函数体，用于打印函数
+        scope: 函数体的作用域
+        """
+        self.name = name
+        self.formals = formals
+        self.body = body
+        self.instructions = []
+        self.constants = []
+        self.names = []       # LOAD_GLOBAL等指令使用的名字
+        self.addresses = []   # LOAD_FREE等指令使用的词法地址(depth, index)
+        self.notes = {}       # 指令位置到变量名的dict，用于反汇编
+        if scope is not None:
+            self.index = scope.index
+            self.nparams = len(scope.names) - len(scope.defined)
+            self.padding = len(scope.defined)
+        self.cache_versions = []
+        self.cache_values = []
+
+    def emit(self, op, arg=0, note=None):
+        """添加一条指令，返回它的位置。note是指令所访问的变量名。"""
+        self.instructions += (op, arg)
+        position = len(self.instructions) - 2
+        if note is not None:
+            self.notes[position] = note
+        return position
+
+    def patch(self, position, target=None):
+        """把位置为position的跳转指令的目标设为target，默认为当前位置。"""
+        if target is None:
+            target = len(self.instructions)
+        self.instructions[position + 1] = target
+
+    def add_constant(self, value):
+        """返回常量value在constants中的下标。"""
+        for i, const in enumerate(self.constants):
+            if const is value:
+                return i
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+    def add_name(self, symbol):
+        """返回名字symbol在names中的下标。"""
+        if symbol not in self.names:
+            self.names.append(symbol)
+            self.cache_versions.append(None)
+            self.cache_values.append(None)
+        return self.names.index(symbol)
+
+    def add_address(self, address):
+        """返回词法地址address在addresses中的下标。"""
+        if address not in self.addresses:
+            self.addresses.append(address)
+        return self.addresses.index(address)
+
+
+class LetInfo:
+    """MAKE_LET指令的参数。"""
+
+    def __init__(self, scope, count):
+        self.index = scope.index
+        self.count = count
+        self.padding = len(scope.defined)
+
+    def __str__(self):
+        return 'let ' + ' '.join(self.index)
+
+
+class VMProcedure(LambdaProcedure):
+    """由字节码虚拟机执行的用户自定义函数过程。"""
+
+    def __init__(self, code, env, genv):
+        """
+        code: 函数的Code
+        env: 定义函数时的Frame
+        genv: 全局环境，即编译时的最外层环境
+        """
+        LambdaProcedure.__init__(self, code.formals, code.body, env)
+        self.code = code
+        self.genv = genv
+
+    def apply(self, args, env):
+        """使用Scheme list参数args应用自身函数。"""
+        python_args = []
+        while args is not nil:
+            python_args.append(args.first)
+            args = args.second
+        frame = make_vm_frame(self, python_args)
+        return execute(self.code, frame, self.genv)
+
+
+def make_vm_frame(procedure, args):
+    """为VMProcedure的调用创建SlotFrame，args用作slots。"""
+    code = procedure.code
+    if len(args) != code.nparams:
+        raise SchemeError('形式参数和实际参数值不匹配: \n{0}\n{1}'.format(
+            code.formals, scheme_list(*args)))
+    if code.padding:
+        args += [UNASSIGNED] * code.padding
+    return SlotFrame(procedure.env, code.index, args)
+
+
+def vm_eval(expr, env):
+    """把表达式expr编译为字节码，然后在环境env中执行。
+
+    >>> env = create_global_frame()
+    >>> vm_eval(read_line('(+ 2 2)'), env)
+    4
+
+    函数体中运行时define的名字优先于同名的全局变量，与scheme_eval一致：
+
+    >>> vm_eval(read_line('(define q 1)'), env)
+    'q'
+    >>> vm_eval(read_line("(define (h) (eval '(define q 3)) q)"), env)
+    'h'
+    >>> vm_eval(read_line('(h)'), env), vm_eval(read_line('q'), env)
+    (3, 1)
+    """
+    return execute(vm_compile(expr, env), env, env)
+
+
+def vm_compile(expr, env):
+    """把要在环境env中求值的表达式expr编译为Code。"""
+    code = Code('<toplevel>')
+    compile_expression(expr, Scope((), env=env), code, True)
+    return code
+
+
+# 编译器
+# compile_xxx函数把表达式编译到code的末尾。
+# tail为True时，生成的代码负责从当前Code返回（RETURN或TAIL_CALL），
+# 否则生成的代码在栈上留下表达式的值。
+
+def compile_expression(expr, scope, code, tail=False):
+    """编译表达式expr。语法错误编译为RAISE指令，推迟到运行时抛出。"""
+    start = len(code.instructions)
+    try:
+        compile_form(expr, scope, code, tail)
+    except SchemeError as err:
+        del code.instructions[start:]
+        code.emit(RAISE, code.add_constant(err))
+
+
+def compile_form(expr, scope, code, tail):
+    if scheme_symbolp(expr):
+        compile_symbol(expr, scope, code)
+    elif self_evaluating(expr):
+        code.emit(CONST, code.add_constant(expr))
+    else:
+        if not scheme_listp(expr):
+            raise SchemeError('无效的复合表达式: {0}'.format(str(expr)))
+        first, rest = expr.first, expr.second
+        if not scheme_symbolp(first):
+            raise SchemeError('无效的复合表达式: {0}'.format(str(expr)))
+        if first in COMPILERS:
+            COMPILERS[first](rest, scope, code, tail)
+            return
+        elif first in SPECIAL_FORMS:
+            code.emit(EVAL_FORM, code.add_constant(expr))
+        else:
+            macro = scope_macro(first, scope)
+            if macro is not None:
+                # 宏调用在编译时展开，字节码中只有展开结果
+                compile_form(macro.expand(rest), scope, code, tail)
+            else:
+                compile_call(first, rest, scope, code, tail)
+            return
+    if tail:
+        code.emit(RETURN)
+
+
+def compile_symbol(name, scope, code):
+    address = scope.resolve(name)
+    if address is None:
+        env = scope.env
+        if isinstance(env, Frame) and env.parent is None:
+            code.emit(LOAD_GLOBAL, code.add_name(name))
+        else:
+            code.emit(LOAD_NAME, code.add_name(name))
+        return
+    depth, i = address
+    defining_scope = scope
+    for _ in range(depth):
+        defining_scope = defining_scope.parent
+    if name in defining_scope.defined:
+        code.emit(LOAD_DEFINED, code.add_address((depth, i, name)), name)
+    elif depth == 0:
+        code.emit(LOAD_LOCAL, i, name)
+    else:
+        code.emit(LOAD_FREE, code.add_address((depth, i)), name)
+
+
+def compile_call(operator, operands, scope, code, tail):
+    compile_expression(operator, scope, code)
+    code.emit(CHECK_PROCEDURE)
+    operands = as_python_list(operands)
+    for operand in operands:
+        compile_expression(operand, scope, code)
+    code.emit(TAIL_CALL if tail else CALL, len(operands))
+
+
+def compile_sequence(expressions, scope, code, tail):
+    if expressions is nil:
+        code.emit(CONST, code.add_constant(None))
+        if tail:
+            code.emit(RETURN)
+        return
+    while expressions.second is not nil:
+        compile_expression(expressions.first, scope, code)
+        code.emit(POP)
+        expressions = expressions.second
+    compile_expression(expressions.first, scope, code, tail)
+
+
+def compile_define(expressions, scope, code, tail):
+    check_form(expressions, 2)
+    target = expressions.first
+    if scheme_symbolp(target):
+        check_form(expressions, 2, 2)
+        name = target
+        compile_expression(expressions.second.first, scope, code)
+    elif isinstance(target, Pair) and scheme_symbolp(target.first):
+        name = target.first
+        compile_lambda(Pair(target.second, expressions.second), scope, code,
+                       False, name)
+    else:
+        if isinstance(target, Pair):
+            bad_target = target.first
+        else:
+            bad_target = target
+        raise SchemeError('不是符号（symbol）: {0}'.format(bad_target))
+    compile_definition(name, scope, code, tail)
+
+
+def compile_define_memo(expressions, scope, code, tail):
+    name, lambda_form = memo_definition(expressions)
+    code.emit(CONST, code.add_constant(MEMOIZE))
+    compile_lambda(lambda_form, scope, code, False, name)
+    code.emit(CALL, 1)
+    compile_definition(name, scope, code, tail)
+
+
+def compile_definition(name, scope, code, tail):
+    """将栈顶的值绑定到name，然后将name压入栈。"""
+    if scope.parent is not None and name in scope.index:
+        code.emit(STORE_LOCAL, scope.index[name], name)
+    else:
+        code.emit(DEFINE_NAME, code.add_name(name))
+    code.emit(CONST, code.add_constant(name))
+    if tail:
+        code.emit(RETURN)
+
+
+def compile_quote(expressions, scope, code, tail):
+    check_form(expressions, 1, 1)
+    code.emit(CONST, code.add_constant(expressions.first))
+    if tail:
+        code.emit(RETURN)
+
+
+def compile_begin(expressions, scope, code, tail):
+    check_form(expressions, 1)
+    compile_sequence(expressions, scope, code, tail)
+
+
+def compile_lambda(expressions, scope, code, tail, name='<lambda>'):
+    check_form(expressions, 2)
+    formals = expressions.first
+    check_formals(formals)
+    body = expressions.second
+    body_scope = Scope(as_python_list(formals), scope)
+    scan_defines(body, body_scope)
+    body_code = Code(name, formals, body, body_scope)
+    compile_sequence(body, body_scope, body_code, True)
+    code.emit(MAKE_CLOSURE, code.add_constant(body_code))
+    if tail:
+        code.emit(RETURN)
+
+
+def compile_if(expressions, scope, code, tail):
+    check_form(expressions, 2, 3)
+    compile_expression(expressions.first, scope, code)
+    jump_alternative = code.emit(POP_JUMP_IF_FALSE)
+    compile_expression(expressions.second.first, scope, code, tail)
+    if not tail:
+        jump_end = code.emit(JUMP)
+    code.patch(jump_alternative)
+    if len(expressions) == 3:
+        compile_expression(expressions.second.second.first, scope, code, tail)
+    else:
+        code.emit(CONST, code.add_constant(None))
+        if tail:
+            code.emit(RETURN)
+    if not tail:
+        code.patch(jump_end)
+
+
+def compile_and(expressions, scope, code, tail):
+    compile_short_circuit(expressions, scope, code, tail,
+                          True, JUMP_IF_FALSE_OR_POP)
+
+
+def compile_or(expressions, scope, code, tail):
+    compile_short_circuit(expressions, scope, code, tail,
+                          False, JUMP_IF_TRUE_OR_POP)
+
+
+def compile_short_circuit(expressions, scope, code, tail, empty, jump_op):
+    """编译and或or：jump_op在短路时保留栈顶的值并跳到末尾。"""
+    if expressions is nil:
+        code.emit(CONST, code.add_constant(empty))
+        if tail:
+            code.emit(RETURN)
+        return
+    jumps = []
+    while expressions.second is not nil:
+        compile_expression(expressions.first, scope, code)
+        jumps.append(code.emit(jump_op))
+        expressions = expressions.second
+    compile_expression(expressions.first, scope, code, tail)
+    for jump in jumps:
+        code.patch(jump)
+    if tail and jumps:
+        code.emit(RETURN)
+
+
+def compile_cond(expressions, scope, code, tail):
+    jumps_end = []
+    while expressions is not nil:
+        clause = expressions.first
+        try:
+            check_form(clause, 1)
+            if clause.first == 'else' and expressions.second != nil:
+                raise SchemeError('else must be last')
+        except SchemeError as err:
+            code.emit(RAISE, code.add_constant(err))
+            break
+        if clause.first == 'else':
+            code.emit(CONST, code.add_constant(True))
+        else:
+            compile_expression(clause.first, scope, code)
+        if clause.second is nil:
+            jumps_end.append(code.emit(JUMP_IF_TRUE_OR_POP))
+        else:
+            jump_next = code.emit(POP_JUMP_IF_FALSE)
+            compile_sequence(clause.second, scope, code, tail)
+            if not tail:
+                jumps_end.append(code.emit(JUMP))
+            code.patch(jump_next)
+        expressions = expressions.second
+    code.emit(CONST, code.add_constant(None))
+    for jump in jumps_end:
+        code.patch(jump)
+    if tail:
+        code.emit(RETURN)
+
+
+def compile_let(expressions, scope, code, tail):
+    check_form(expressions, 2)
+    bindings = expressions.first
+    if not scheme_listp(bindings):
+        raise SchemeError('bad bindings list in let form')
+    formals, names, values = nil, [], []
+    while bindings is not nil:
+        binding = bindings.first
+        check_form(binding, 2, 2)
+        formals = Pair(binding.first, formals)
+        names.append(binding.first)
+        values.append(binding.second.first)
+        bindings = bindings.second
+    check_formals(formals)
+    for value in values:
+        compile_expression(value, scope, code)
+    body_scope = Scope(names, scope)
+    scan_defines(expressions.second, body_scope)
+    code.emit(MAKE_LET, code.add_constant(LetInfo(body_scope, len(names))))
+    compile_sequence(expressions.second, body_scope, code, tail)
+    if not tail:
+        code.emit(LEAVE_LET)
+
+
+def compile_folded(expressions, scope, code, tail):
+    """编译优化器生成的FOLDED特殊形式（见do_folded_form）。"""
+    check_form(expressions, 3, 3)
+    code.emit(CHECK_GUARD, code.add_constant(expressions.first))
+    jump_original = code.emit(POP_JUMP_IF_FALSE)
+    compile_expression(expressions.second.first, scope, code, tail)
+    if not tail:
+        jump_end = code.emit(JUMP)
+    code.patch(jump_original)
+    compile_expression(expressions.second.second.first, scope, code, tail)
+    if not tail:
+        code.patch(jump_end)
+
+
+COMPILERS = {
+    FOLDED: compile_folded,
+    'and': compile_and,
+    'begin': compile_begin,
+    'cond': compile_cond,
+    'define': compile_define,
+    'define-memo': compile_define_memo,
+    'if': compile_if,
+    'lambda': compile_lambda,
+    'let': compile_let,
+    'or': compile_or,
+    'quote': compile_quote,
+}
+
+
+# 虚拟机
+
+def execute(code, env, genv):
+    """在环境env中执行code，返回code的返回值。
+
+    genv是全局环境。调用VMProcedure时，把当前的(code, pc, env, genv)
+    压入调用栈frames，返回时再弹出；尾调用不压栈。"""
+    stack = []
+    frames = []
+    instructions, constants = code.instructions, code.constants
+    pc = 0
+    while True:
+        op, arg = instructions[pc], instructions[pc + 1]
+        pc += 2
+        if op == LOAD_LOCAL:
+            stack.append(env.slots[arg])
+        elif op == CONST:
+            stack.append(constants[arg])
+        elif op == LOAD_GLOBAL:
+            if RUNTIME_NAMES and code.names[arg] in RUNTIME_NAMES:
+                # 函数体中运行时define的名字（见analyze_global）
+                stack.append(env.lookup(code.names[arg]))
+                continue
+            if code.cache_versions[arg] != genv.version:
+                code.cache_values[arg] = genv.lookup(code.names[arg])
+                code.cache_versions[arg] = genv.version
+            stack.append(code.cache_values[arg])
+        elif op == CALL or op == TAIL_CALL:
+            if arg:
+                args = stack[-arg:]
+                del stack[-arg:]
+            else:
+                args = []
+            procedure = stack.pop()
+            if type(procedure) is VMProcedure:
+                frame = make_vm_frame(procedure, args)
+                if op == CALL:
+                    if len(frames) >= MAX_FRAMES:
+                        raise RecursionError('maximum recursion depth exceeded')
+                    frames.append((code, pc, env, genv))
+                code, env, genv = procedure.code, frame, procedure.genv
+                instructions, constants = code.instructions, code.constants
+                pc = 0
+                continue
+            elif type(procedure) is PrimitiveProcedure:
+                # 两个int参数时直接使用运算符，见INT_BINARY_OPS
+                if (arg == 2 and procedure.int_op is not None and
+                        type(args[0]) is int and type(args[1]) is int):
+                    value = procedure.int_op(args[0], args[1])
+                else:
+                    value = procedure.call(args, env)
+            else:
+                value = complete_apply(procedure, scheme_list(*args), env)
+            if op == CALL:
+                stack.append(value)
+            else:
+                if not frames:
+                    return value
+                code, pc, env, genv = frames.pop()
+                instructions, constants = code.instructions, code.constants
+                stack.append(value)
+        elif op == RETURN:
+            value = stack.pop()
+            if not frames:
+                return value
+            code, pc, env, genv = frames.pop()
+            instructions, constants = code.instructions, code.constants
+            stack.append(value)
+        elif op == CHECK_PROCEDURE:
+            if not isinstance(stack[-1], Procedure):
+                check_procedure(stack[-1])
+        elif op == POP_JUMP_IF_FALSE:
+            if stack.pop() is False:
+                pc = arg
+        elif op == LOAD_FREE:
+            depth, i = code.addresses[arg]
+            frame = env
+            for _ in range(depth):
+                frame = frame.parent
+            stack.append(frame.slots[i])
+        elif op == LOAD_DEFINED:
+            depth, i, name = code.addresses[arg]
+            frame = env
+            for _ in range(depth):
+                frame = frame.parent
+            value = frame.slots[i]
+            if value is UNASSIGNED:
+                value = frame.parent.lookup(name)
+            stack.append(value)
+        elif op == JUMP:
+            pc = arg
+        elif op == POP:
+            stack.pop()
+        elif op == JUMP_IF_FALSE_OR_POP:
+            if stack[-1] is False:
+                pc = arg
+            else:
+                stack.pop()
+        elif op == JUMP_IF_TRUE_OR_POP:
+            if stack[-1] is not False:
+                pc = arg
+            else:
+                stack.pop()
+        elif op == MAKE_CLOSURE:
+            stack.append(VMProcedure(constants[arg], env, genv))
+        elif op == MAKE_LET:
+            info = constants[arg]
+            if info.count:
+                slots = stack[-info.count:]
+                del stack[-info.count:]
+            else:
+                slots = []
+            if info.padding:
+                slots += [UNASSIGNED] * info.padding
+            env = SlotFrame(env, info.index, slots)
+        elif op == LEAVE_LET:
+            env = env.parent
+        elif op == STORE_LOCAL:
+            env.slots[arg] = stack.pop()
+        elif op == DEFINE_NAME:
+            env.define(code.names[arg], stack.pop())
+        elif op == LOAD_NAME:
+            stack.append(env.lookup(code.names[arg]))
+        elif op == EVAL_FORM:
+            stack.append(scheme_eval(constants[arg], env))
+        elif op == RAISE:
+            raise constants[arg]
+        elif op == CHECK_GUARD:
+            stack.append(constants[arg].valid())
+        else:
+            raise SchemeError('未知的操作码: {0}'.format(op))
+
+
+def disassemble(code):
+    """返回code及其中嵌套的函数代码的反汇编文本。
+
+    >>> env = create_global_frame()
+    >>> print(disassemble(vm_compile(read_line('(define (f x) (if x (g x) 0))'), env)))
+    Code <toplevel>:
+       0 MAKE_CLOSURE        0 (f)
+       2 DEFINE_NAME         0 (f)
+       4 CONST               1 (f)
+       6 RETURN              0
+    <BLANKLINE>
+    Code f (x):
+       0 LOAD_LOCAL          0 (x)
+       2 POP_JUMP_IF_FALSE  12
+       4 LOAD_GLOBAL         0 (g)
+       6 CHECK_PROCEDURE     0
+       8 LOAD_LOCAL          0 (x)
+      10 TAIL_CALL           1
+      12 CONST               0 (0)
+      14 RETURN              0
+    """
+    header = 'Code {0}:'.format(code.name)
+    if code.formals is not nil:
+        header = 'Code {0} {1}:'.format(code.name, code.formals)
+    lines = [header]
+    nested = []
+    instructions = code.instructions
+    for pc in range(0, len(instructions), 2):
+        op, arg = instructions[pc], instructions[pc + 1]
+        detail = ''
+        if op in (CONST, EVAL_FORM, RAISE, MAKE_LET, CHECK_GUARD):
+            detail = str(code.constants[arg])
+        elif op == MAKE_CLOSURE:
+            detail = code.constants[arg].name
+            nested.append(code.constants[arg])
+        elif op in (LOAD_GLOBAL, LOAD_NAME, DEFINE_NAME):
+            detail = code.names[arg]
+        elif pc in code.notes:
+            detail = code.notes[pc]
+        line = '{0:>4} {1:<18}{2:>3}'.format(pc, OPNAMES[op], arg)
+        if detail:
+            line += ' ({0})'.format(detail)
+        lines.append(line)
+    for nested_code in nested:
+        lines.append('')
+        lines.append(disassemble(nested_code))
+    return '\n'.join(lines)